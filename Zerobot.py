@@ -3,38 +3,86 @@ from discord.ext import commands
 from discord import app_commands
 import json
 import os
-import shutil
 import asyncio
 from datetime import datetime, timedelta
-import random
+import contextlib
+import functools
+import weakref
+from collections import deque
+import queue
+import threading
+import concurrent.futures
+import time
+import hashlib
+import logging
+from typing import NamedTuple
 from dotenv import load_dotenv
+from storage import create_storage, new_user_record, add_to_stats, copy_stats, freeze_accounts
+from ledger_index import HistoryPage, RankIndex, TransactionIndex
+from metrics import MetricsRegistry, start_http_server
+from profiler import LoopWatchdog, ProfileCapture, StackSampler, format_stack, output_path
+from chinchiro import (
+    KIND_PINZORO, KIND_SHIGORO, KIND_ZORO, KIND_ME, KIND_HIFUMI,
+    MAX_LOSS_MULTIPLIER, RESULT_WIN, RESULT_LOSE, lookup_hand, pack_dice, play_game, unpack_dice
+)
 
-# .envファイルを読み込み
-load_dotenv()
-
-# デバッグ: .envファイルの読み込み確認
-print(f"[DEBUG] .envファイル読み込み確認:")
-print(f"[DEBUG] BOT_TOKEN exists: {bool(os.getenv('BOT_TOKEN'))}")
-print(f"[DEBUG] ADMIN_USER_IDS: {os.getenv('ADMIN_USER_IDS')}")
-print(f"[DEBUG] GUILD_ID: {os.getenv('GUILD_ID')}")
-print(f"[DEBUG] LOG_CHANNEL_ID raw: '{os.getenv('LOG_CHANNEL_ID')}'")
-print(f"[DEBUG] Current working directory: {os.getcwd()}")
-print(f"[DEBUG] .env file exists: {os.path.exists('.env')}")
-
-# より確実な読み込みを試行
-if not os.getenv('LOG_CHANNEL_ID'):
-    # 明示的にパスを指定して再読み込み
-    env_path = os.path.join(os.getcwd(), '.env')
-    print(f"[DEBUG] 明示的パスで再読み込み: {env_path}")
-    load_dotenv(env_path)
-    print(f"[DEBUG] 再読み込み後 LOG_CHANNEL_ID: '{os.getenv('LOG_CHANNEL_ID')}'")
+# .envファイルを読み込み（カレントディレクトリにあればそれを、無ければスクリプトの場所から探す）
+load_dotenv(os.path.join(os.getcwd(), '.env') if os.path.exists('.env') else None)
+
+# ログ出力（LOG_LEVEL=DEBUG で設定の読み込み状況などの詳細も表示）
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').strip().upper()
+discord.utils.setup_logging(level=logging.INFO)
+logger = logging.getLogger('zerobot')
+logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+logger.debug("BOT_TOKEN exists: %s", bool(os.getenv('BOT_TOKEN')))
+logger.debug("ADMIN_USER_IDS: %s / GUILD_ID: %s / LOG_CHANNEL_ID: %r",
+             os.getenv('ADMIN_USER_IDS'), os.getenv('GUILD_ID'), os.getenv('LOG_CHANNEL_ID'))
+logger.debug("Current working directory: %s (.env exists: %s)", os.getcwd(), os.path.exists('.env'))
 
 # Botの設定
 intents = discord.Intents.default()
 intents.message_content = True
 
-# データファイルのパス
+# データファイルのパス（JSON 形式のスナップショット）
 DATA_FILE = 'z_currency_data.json'
+# バイナリ形式のスナップショット
+SNAPSHOT_FILE = 'z_currency_data.snapshot'
+# スナップショットの形式（binary / json）。読み込みはどちらの形式からでもでき、次の保存で切り替わる
+SNAPSHOT_FORMAT = os.getenv('SNAPSHOT_FORMAT', 'binary').strip().lower()
+if SNAPSHOT_FORMAT not in ('binary', 'json'):
+    print(f"⚠️ 不明な SNAPSHOT_FORMAT です: {SNAPSHOT_FORMAT}（binary を使用します）")
+    SNAPSHOT_FORMAT = 'binary'
+# 残高変更を追記していくジャーナル（スナップショット以降の差分）
+JOURNAL_FILE = 'z_currency_data.journal'
+# ジャーナルがこのサイズを超えたらスナップショットを作り直す
+JOURNAL_COMPACT_BYTES = 4 * 1024 * 1024
+# メモリ上に保持する直近の取引件数（JSON バックエンド）。古い取引は日付ごとの gzip に退避する
+TRANSACTION_WINDOW = 10000
+if os.getenv('TRANSACTION_WINDOW'):
+    try:
+        TRANSACTION_WINDOW = int(os.getenv('TRANSACTION_WINDOW'))
+    except ValueError:
+        print("⚠️ TRANSACTION_WINDOWの形式が正しくありません")
+ARCHIVE_DIR = 'transaction_archive'
+# SQLite バックエンドのデータベース
+SQLITE_FILE = 'z_currency_data.db'
+# 台帳の保存先（json / sqlite）。sqlite に切り替えると初回起動時に JSON から移行する
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json').strip().lower()
+# 永続化スレッドに積めるジョブ数の上限（超えたらコマンド側が待つ）
+PERSIST_QUEUE_SIZE = 64
+# グループコミット：この時間内、またはこの件数までの変更を1回の fsync にまとめる
+COMMIT_WINDOW_MS = 30
+COMMIT_MAX_BATCH = 256
+if os.getenv('COMMIT_WINDOW_MS'):
+    try:
+        COMMIT_WINDOW_MS = int(os.getenv('COMMIT_WINDOW_MS'))
+    except ValueError:
+        print("⚠️ COMMIT_WINDOW_MSの形式が正しくありません")
+if os.getenv('COMMIT_MAX_BATCH'):
+    try:
+        COMMIT_MAX_BATCH = int(os.getenv('COMMIT_MAX_BATCH'))
+    except ValueError:
+        print("⚠️ COMMIT_MAX_BATCHの形式が正しくありません")
 
 # 初期設定
 INITIAL_BALANCE = 0  # 初期残高
@@ -58,13 +106,81 @@ LOG_CHANNEL_ID = None
 if os.getenv('LOG_CHANNEL_ID'):
     try:
         LOG_CHANNEL_ID = int(os.getenv('LOG_CHANNEL_ID'))
-        print(f"[DEBUG] LOG_CHANNEL_ID 読み込み成功: {LOG_CHANNEL_ID}")
     except ValueError as e:
         print(f"⚠️ LOG_CHANNEL_IDの形式が正しくありません: {e}")
-        print(f"[DEBUG] 読み込み値: '{os.getenv('LOG_CHANNEL_ID')}'")
+        logger.debug("LOG_CHANNEL_ID の読み込み値: %r", os.getenv('LOG_CHANNEL_ID'))
 else:
-    print(f"[DEBUG] LOG_CHANNEL_ID 環境変数が見つかりません")
-    print(f"[DEBUG] 利用可能な環境変数: {[key for key in os.environ.keys() if 'LOG' in key.upper()]}")
+    logger.debug("LOG_CHANNEL_ID 環境変数が見つかりません（LOG を含む環境変数: %s）",
+                 [key for key in os.environ.keys() if 'LOG' in key.upper()])
+
+# 前回同期したスラッシュコマンド定義のハッシュ（変わっていなければ起動時の同期を省く）
+COMMAND_SYNC_FILE = 'command_sync.json'
+# 1 にするとハッシュに関係なく同期する
+FORCE_COMMAND_SYNC = os.getenv('FORCE_COMMAND_SYNC', '').strip().lower() in ('1', 'true', 'yes')
+
+# ログ送信キュー（溢れた分はファイルに退避し、次回起動時に再送する）
+LOG_QUEUE_SIZE = 1000
+LOG_SPILL_FILE = 'log_spill.jsonl'
+# 解決したログチャンネルと権限チェック結果を使い回す時間（秒）
+LOG_CHANNEL_CACHE_SECONDS = 600
+
+# 動作指標を Prometheus 形式で公開するアドレス（METRICS_PORT=0 で無効）
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1').strip()
+METRICS_PORT = 9108
+if os.getenv('METRICS_PORT'):
+    try:
+        METRICS_PORT = int(os.getenv('METRICS_PORT'))
+    except ValueError:
+        print("⚠️ METRICS_PORTの形式が正しくありません")
+
+# イベントループの監視：この時間（ミリ秒）以上ループが止まったら、止まっていた箇所のスタックを記録する（0 で無効）
+LOOP_STALL_THRESHOLD_MS = 250
+if os.getenv('LOOP_STALL_THRESHOLD_MS'):
+    try:
+        LOOP_STALL_THRESHOLD_MS = int(os.getenv('LOOP_STALL_THRESHOLD_MS'))
+    except ValueError:
+        print("⚠️ LOOP_STALL_THRESHOLD_MSの形式が正しくありません")
+# ループが止まった記録（1行1件の JSON）
+LOOP_STALL_FILE = 'loop_stalls.jsonl'
+
+# /プロファイル の結果の保存先と、1回に計測できる最長の秒数
+PROFILE_DIR = 'profiles'
+PROFILE_MAX_SECONDS = 300
+
+# /履歴 の1ページの件数
+HISTORY_PAGE_SIZE = 10
+# アーカイブ済みの取引を読むスレッドの数（ジャーナルの書き込みとは別のスレッドで読む）
+ARCHIVE_READ_WORKERS = 2
+
+# 取引種別の表示名
+TRANSACTION_TYPE_LABELS = {
+    'chinchin': "🎲 ちんちろ",
+    'transfer_in': "📥 送金受取",
+    'transfer_out': "📤 送金",
+    'role_issue': "🎭 ロール発行",
+    'admin_issue': "💰 発行",
+    'admin_reduce': "📉 減少",
+}
+
+# ちんちろの演出モード（full: すべて / compact: 転がり演出を省いて短縮 / off: 結果だけ）
+CHINCHIN_ANIMATION = os.getenv('CHINCHIN_ANIMATION', 'full').strip().lower()
+# 演出中のゲームがこの数以上なら full でも compact に落とす
+CHINCHIN_ANIMATION_MAX_ACTIVE = 50
+# compact 時のフレーム間隔（秒）
+CHINCHIN_COMPACT_DELAY = 1.5
+# 同時に進行できるちんちろの数（超えた分は混雑中として断る）
+CHINCHIN_MAX_ACTIVE_GAMES = 200
+if os.getenv('CHINCHIN_MAX_ACTIVE_GAMES'):
+    try:
+        CHINCHIN_MAX_ACTIVE_GAMES = int(os.getenv('CHINCHIN_MAX_ACTIVE_GAMES'))
+    except ValueError:
+        print("⚠️ CHINCHIN_MAX_ACTIVE_GAMESの形式が正しくありません")
+
+# インタラクションのメッセージ編集の送信レート
+EDIT_RATE_PER_ROUTE = 1.0     # 1メッセージ（Webhook トークン）あたり毎秒
+EDIT_BURST_PER_ROUTE = 2
+EDIT_RATE_GLOBAL = 40.0       # Bot 全体で毎秒
+EDIT_MAX_IN_FLIGHT = 20       # 同時に送信中にできる編集の数
 
 # ちんちろの役の強さ（表に基づく配当率）
 CHINCHIN_HANDS = {
@@ -82,150 +198,835 @@ CHINCHIN_HANDS = {
     'ゾロ目': 3,            # 2,2,2 3,3,3 5,5,5 6,6,6 - 3倍もらう
     'ピンゾロ_win': 5       # 1,1,1（特別扱い） - 5倍もらう
 }
+
+# 動作指標（/metrics で公開）
+# 記録はホットパスでも軽い辞書の更新だけ。キューの長さなどは読み出し時に関数で取る
+metrics = MetricsRegistry(prefix='zerobot_')
+command_duration = metrics.histogram('command_duration_seconds', "スラッシュコマンドの処理時間（秒）", ('command',))
+command_total = metrics.counter('commands_total', "スラッシュコマンドの実行回数", ('command', 'outcome'))
+save_duration = metrics.histogram(
+    'save_duration_seconds', "保存先の圧縮（save_data）にかかった時間（秒）", ('backend',),
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+save_bytes = metrics.counter('save_bytes_total', "save_data で書き出したバイト数", ('backend',))
+save_errors = metrics.counter('save_errors_total', "save_data の圧縮に失敗した回数", ('backend',))
+commit_duration = metrics.histogram('journal_commit_seconds', "ジャーナルのグループコミット1回の書き込み時間（秒）")
+log_embeds = metrics.counter('log_embeds_total', "ログチャンネル宛ての埋め込みの結果（sent / spilled / rate_limited / error）", ('outcome',))
+chinchin_games = metrics.counter('chinchin_games_total', "ちんちろの対戦数（勝敗別）", ('result',))
+chinchin_game_duration = metrics.histogram(
+    'chinchin_game_seconds', "ちんちろ1ゲーム（演出の終了まで）の時間（秒）",
+    buckets=(1.0, 2.5, 5.0, 10.0, 15.0, 20.0, 30.0, 60.0)
+)
+metrics.gauge('chinchin_active_games', "進行中のちんちろの数", function=lambda: len(bot.game_sessions))
+metrics.counter('chinchin_rejected_total', "混雑のため断ったちんちろの数", function=lambda: bot.game_sessions.rejected_busy)
+metrics.gauge('log_queue_depth', "ログ送信キューの長さ",
+              function=lambda: bot.log_dispatcher.queue.qsize() if bot.log_dispatcher.queue else 0)
+metrics.gauge('persistence_queue_depth', "永続化スレッドの待ちジョブ数", function=lambda: bot.persistence.queue_depth())
+metrics.gauge('journal_buffer_records', "次のコミットを待っているジャーナルレコード数", function=lambda: len(bot._journal_buffer))
+metrics.gauge('edit_queue_depth', "送信待ちのメッセージ編集数", function=lambda: bot.edit_scheduler.queue_depth())
+metrics.counter(
+    'edits_total', "メッセージ編集の件数（submitted / coalesced / sent / failed / rate_limited）", ('outcome',),
+    function=lambda: {key: value for key, value in bot.edit_scheduler.stats().items() if key not in ('queue_depth', 'routes')}
+)
+metrics.gauge('ledger_users', "台帳のユーザー数", function=lambda: len(bot.data['users']) if bot.data else 0)
+loop_lag = metrics.histogram(
+    'event_loop_lag_seconds', "イベントループの予定からの遅れ（秒）",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+loop_stalls = metrics.counter('event_loop_stalls_total', "閾値を超えてイベントループが止まった回数（その時に実行中だったコマンド別）", ('command',))
+loop_stall_duration = metrics.histogram(
+    'event_loop_stall_seconds', "閾値を超えてイベントループが止まっていた時間（秒）",
+    buckets=(0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+)
+
+# 実行中のスラッシュコマンド（タスク → コマンド名）。ループが止まった時の記録に使う
+running_commands = {}
+
+def timed_command(func):
+    """スラッシュコマンドの処理時間と成否を記録する（@bot.tree.command の内側に付ける）"""
+    @functools.wraps(func)
+    async def wrapper(interaction, *args, **kwargs):
+        name = interaction.command.name if interaction.command else func.__name__
+        task = asyncio.current_task()
+        running_commands[task] = name
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            result = await func(interaction, *args, **kwargs)
+            outcome = 'ok'
+            return result
+        finally:
+            running_commands.pop(task, None)
+            command_duration.observe(time.perf_counter() - started, command=name)
+            command_total.inc(command=name, outcome=outcome)
+    return wrapper
+
+def commands_in_progress():
+    """ループが止まった時点で動いていたタスクと実行中のコマンド（監視スレッドから呼ばれる）"""
+    task = asyncio.current_task(bot.watchdog.loop)
+    return {
+        'command': running_commands.get(task),
+        'task': task.get_name() if task else None,
+        'in_progress': sorted(list(running_commands.values()))
+    }
+
+def record_loop_stall(event):
+    """ループが止まった1回分を指標・標準出力・LOOP_STALL_FILE に記録する（監視スレッドから呼ばれる）"""
+    context = event.context or {}
+    command = context.get('command') or context.get('task') or '-'
+    loop_stalls.inc(command=command)
+    loop_stall_duration.observe(event.duration)
+    print(f"⚠️ イベントループが{event.duration:.2f}秒止まりました: {event.site}（実行中: {command}）")
+    logger.debug("止まっていた時点のスタック:\n%s", format_stack(event.stack or ()))
+    record = {
+        'time': datetime.fromtimestamp(event.started).isoformat(),
+        'duration': round(event.duration, 4),
+        'site': event.site,
+        **context,
+        'stack': [f"{filename}:{lineno} {name}" for filename, lineno, name in event.stack or ()]
+    }
+    try:
+        with open(LOOP_STALL_FILE, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    except OSError as e:
+        print(f"⚠️ ループ停止の記録を書き込めませんでした: {e}")
+
+class ChinchinFrame(NamedTuple):
+    """ちんちろの演出1コマ"""
+    embed: discord.Embed
+    delay: float        # 次のフレームまでの秒数
+    skippable: bool     # 遅れている時・短縮時に飛ばしてよいか
+
+# 演出を再生中のタスク
+active_chinchin_renders = set()
+
+class GameSession:
+    """進行中のちんちろ1ゲーム"""
+    
+    def __init__(self, user_id, amount):
+        self.user_id = user_id
+        self.amount = amount
+        # 精算まで確保している額（最悪の負け＝賭け金の MAX_LOSS_MULTIPLIER 倍）
+        self.held = amount * MAX_LOSS_MULTIPLIER
+        self.started = time.monotonic()
+
+class GameSessionManager:
+    """ちんちろの進行中ゲームを管理する
+    
+    1ユーザー1ゲームに制限し、開始時に最悪の負け額（ピンゾロ負けの5倍払い）を確保して
+    （精算まで他の支払いに使えない）、負けても残高がマイナスにならないようにする。
+    Bot 全体の同時ゲーム数にも上限を設ける。
+    """
+    
+    def __init__(self, max_active):
+        self.max_active = max_active
+        self.sessions = {}      # user_id → GameSession
+        self.rejected_busy = 0
+    
+    def __len__(self):
+        return len(self.sessions)
+    
+    def get(self, user_id):
+        return self.sessions.get(str(user_id))
+    
+    def held_amount(self, user_id):
+        """そのユーザーのゲームが確保している金額"""
+        session = self.sessions.get(str(user_id))
+        return session.held if session else 0
+    
+    def open(self, user_id, amount, available):
+        """ゲームを始める。(GameSession, None) か、始められない理由 (None, 'active' / 'busy' / 'funds') を返す
+        
+        available は確保分を除いた残高。呼び出し側がユーザーロックを持った状態で呼ぶ。
+        """
+        user_id = str(user_id)
+        if user_id in self.sessions:
+            return None, 'active'
+        if len(self.sessions) >= self.max_active:
+            self.rejected_busy += 1
+            return None, 'busy'
+        session = GameSession(user_id, amount)
+        if available < session.held:
+            return None, 'funds'
+        self.sessions[user_id] = session
+        return session, None
+    
+    def settle(self, session):
+        """精算済みにして確保を解く（演出が終わるまでゲームは進行中のまま）"""
+        session.held = 0
+    
+    def close(self, session):
+        if self.sessions.get(session.user_id) is session:
+            del self.sessions[session.user_id]
+
+class TokenBucket:
+    """トークンバケット（rate 個/秒で補充、最大 capacity 個）"""
+    
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+    
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self._refill(now)
+            if now >= self.blocked_until and self.tokens >= 1:
+                self.tokens -= 1
+                return
+            wait = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+            await asyncio.sleep(wait)
+    
+    def block(self, seconds):
+        """429 を受けた時などに、しばらく払い出しを止める"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+    
+    def idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.blocked_until
+
+class EditScheduler:
+    """インタラクションのメッセージ編集をまとめて送る
+    
+    ルート（Webhook トークン）ごとと Bot 全体のトークンバケットで送信を絞り、
+    同じメッセージへの未送信の編集は最新の1件にまとめる（古いフレームは送らない）。
+    """
+    
+    def __init__(self):
+        self._pending = {}      # メッセージ → [interaction, embed, view, 待っている Future]
+        self._drainers = {}     # メッセージ → 送信タスク
+        self._buckets = {}      # ルート → TokenBucket
+        self._followups = {}    # 元メッセージが消えた時に代わりに編集するメッセージ
+        self._global = TokenBucket(EDIT_RATE_GLOBAL, EDIT_RATE_GLOBAL)
+        self._in_flight = None
+        self.submitted = 0
+        self.coalesced = 0
+        self.sent = 0
+        self.failed = 0
+        self.rate_limited = 0
+    
+    def queue_depth(self):
+        """送信待ちのメッセージ数"""
+        return len(self._pending)
+    
+    def stats(self):
+        return {
+            'queue_depth': self.queue_depth(),
+            'routes': len(self._buckets),
+            'submitted': self.submitted,
+            'coalesced': self.coalesced,
+            'sent': self.sent,
+            'failed': self.failed,
+            'rate_limited': self.rate_limited
+        }
+    
+    def submit(self, interaction, embed, view=None):
+        """元メッセージの編集を予約する。送信（またはより新しい編集の送信）で完了する Future を返す"""
+        if self._in_flight is None:
+            self._in_flight = asyncio.Semaphore(EDIT_MAX_IN_FLIGHT)
+        key = interaction.id
+        future = asyncio.get_running_loop().create_future()
+        self.submitted += 1
+        pending = self._pending.get(key)
+        if pending:
+            # まだ送っていない古い編集は捨て、最新の内容だけを送る
+            self.coalesced += 1
+            pending[1] = embed
+            pending[2] = view
+            pending[3].append(future)
+        else:
+            self._pending[key] = [interaction, embed, view, [future]]
+        if key not in self._drainers:
+            self._drainers[key] = asyncio.create_task(self._drain(key))
+        return future
+    
+    async def edit(self, interaction, embed, view=None):
+        """編集を予約し、送信されるまで待つ"""
+        await self.submit(interaction, embed, view)
+    
+    def _bucket(self, route):
+        bucket = self._buckets.get(route)
+        if bucket is None:
+            bucket = TokenBucket(EDIT_RATE_PER_ROUTE, EDIT_BURST_PER_ROUTE)
+            self._buckets[route] = bucket
+        return bucket
+    
+    async def _drain(self, key):
+        try:
+            while key in self._pending:
+                route = self._pending[key][0].token
+                bucket = self._bucket(route)
+                await bucket.acquire()
+                await self._global.acquire()
+                interaction, embed, view, waiters = self._pending.pop(key)
+                async with self._in_flight:
+                    retry = await self._send(key, interaction, embed, view, bucket)
+                if retry and key not in self._pending:
+                    # 送れなかった内容は、より新しい編集が来ていなければもう一度送る
+                    self._pending[key] = [interaction, embed, view, waiters]
+                    continue
+                if retry:
+                    self._pending[key][3].extend(waiters)
+                    continue
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_result(None)
+        finally:
+            self._drainers.pop(key, None)
+            self._prune()
+    
+    async def _send(self, key, interaction, embed, view, bucket):
+        """1件送信する。レート制限で送れなかった場合は True を返す"""
+        try:
+            followup = self._followups.get(key)
+            if followup:
+                await followup.edit(embed=embed, view=view)
+            else:
+                await interaction.edit_original_response(embed=embed, view=view)
+            self.sent += 1
+        except discord.NotFound:
+            # メッセージが見つからない場合は followup で作り直し、以降はそれを編集する
+            try:
+                self._followups[key] = await interaction.followup.send(embed=embed, view=view, wait=True)
+                self.sent += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"メッセージ更新エラー: {e}")
+        except discord.HTTPException as e:
+            if e.status == 429:
+                self.rate_limited += 1
+                bucket.block(getattr(e, 'retry_after', None) or 1.0)
+                return True
+            self.failed += 1
+            print(f"メッセージ更新エラー: {e}")
+        except Exception as e:
+            self.failed += 1
+            print(f"メッセージ更新エラー: {e}")
+        return False
+    
+    def forget(self, interaction):
+        """ゲーム終了後、そのメッセージ用の状態を捨てる"""
+        self._followups.pop(interaction.id, None)
+    
+    def _prune(self):
+        """しばらく使われていないルートのバケットを捨てる"""
+        now = time.monotonic()
+        active = {pending[0].token for pending in self._pending.values()}
+        for route in [route for route, bucket in self._buckets.items() if route not in active and bucket.idle(now)]:
+            del self._buckets[route]
+
+class PersistenceWorker:
+    """ディスク書き込み専用スレッド（イベントループを止めないため）"""
+    
+    def __init__(self, max_queue=PERSIST_QUEUE_SIZE):
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._submit_lock = None
+        self._thread = threading.Thread(target=self._run, name='ledger-persistence', daemon=True)
+        self._thread.start()
+    
+    def _run(self):
+        while True:
+            job, future = self._queue.get()
+            if job is None:
+                future.set_result(None)
+                return
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(job())
+            except BaseException as e:
+                future.set_exception(e)
+    
+    async def submit(self, job):
+        """ジョブを投入し、書き込み完了（耐久化）まで待つ"""
+        if self._submit_lock is None:
+            self._submit_lock = asyncio.Lock()
+        future = concurrent.futures.Future()
+        # 投入順＝書き込み順を保つため、キューが満杯の時も順番に並ばせる
+        async with self._submit_lock:
+            try:
+                self._queue.put_nowait((job, future))
+            except queue.Full:
+                await asyncio.to_thread(self._queue.put, (job, future))
+        return await asyncio.wrap_future(future)
+    
+    def queue_depth(self):
+        return self._queue.qsize()
+    
+    def stop(self):
+        """残りのジョブを処理し終えてからスレッドを止める"""
+        future = concurrent.futures.Future()
+        self._queue.put((None, future))
+        self._thread.join()
+
+class LogDispatcher:
+    """ログチャンネルへの送信をまとめて行うバックグラウンド送信係
+    
+    埋め込みは1メッセージに最大10個（合計6000文字まで）詰めて送り、
+    429 を受けたら待ってから再送する。キューが溢れた分・送れなかった分はファイルに退避し、
+    次に送れた時（と次回起動時）にキューへ戻す。退避ファイルの読み書きは別スレッドで行う。
+    """
+    MAX_EMBEDS = 10
+    MAX_CHARS = 6000
+    MAX_RETRIES = 5
+    
+    def __init__(self, bot, channel_id):
+        self.bot = bot
+        self.channel_id = channel_id
+        self.queue = None
+        self._task = None
+        self._channel = None
+        self._channel_checked_at = 0
+        self._carry = None
+        self.sent = 0
+        self.spilled = 0
+        # 退避ファイルの読み書きは別スレッドで行うので、同時に触らないようにする
+        self._spill_lock = threading.Lock()
+        # 退避ファイルにキューへ戻していないログがあるか（起動時は前回分を確認する）
+        self._spill_pending = True
+        self._spill_tasks = set()
+    
+    def start(self):
+        """送信タスクを開始（イベントループ上で呼ぶ）"""
+        if self._task:
+            return
+        self.queue = asyncio.Queue(maxsize=LOG_QUEUE_SIZE)
+        self._task = asyncio.create_task(self._run())
+    
+    def enqueue(self, embed):
+        """ログを積む。キューが満杯（または未開始）ならファイルに退避する"""
+        if self.queue is not None:
+            try:
+                self.queue.put_nowait(embed)
+                return
+            except asyncio.QueueFull:
+                pass
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # ループの外（起動前など）ならその場で書く
+            self._spill([embed])
+            return
+        task = asyncio.create_task(self._spill_async([embed]))
+        self._spill_tasks.add(task)
+        task.add_done_callback(self._spill_tasks.discard)
+    
+    async def _spill_async(self, embeds):
+        await asyncio.to_thread(self._spill, embeds)
     
+    def _spill(self, embeds):
+        """ファイルに追記する（別スレッドから呼ぶ）"""
+        try:
+            payload = ''.join(json.dumps(embed.to_dict(), ensure_ascii=False) + '\n' for embed in embeds)
+            with self._spill_lock:
+                with open(LOG_SPILL_FILE, 'a', encoding='utf-8') as f:
+                    f.write(payload)
+                self.spilled += len(embeds)
+                self._spill_pending = True
+            log_embeds.inc(len(embeds), outcome='spilled')
+        except Exception as e:
+            print(f"⚠️ ログの退避に失敗しました（{len(embeds)}件破棄）: {e}")
+            log_embeds.inc(len(embeds), outcome='dropped')
+    
+    def _take_spilled(self, room):
+        """退避ファイルから先頭の room 件を取り出す（残りはファイルに残す。別スレッドから呼ぶ）"""
+        with self._spill_lock:
+            self._spill_pending = False
+            if not os.path.exists(LOG_SPILL_FILE):
+                return []
+            with open(LOG_SPILL_FILE, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+            taken, rest = lines[:room], lines[room:]
+            if rest:
+                with open(f"{LOG_SPILL_FILE}.tmp", 'w', encoding='utf-8') as f:
+                    f.writelines(rest)
+                os.replace(f"{LOG_SPILL_FILE}.tmp", LOG_SPILL_FILE)
+                self._spill_pending = True
+            else:
+                os.remove(LOG_SPILL_FILE)
+        embeds = []
+        for line in taken:
+            try:
+                embeds.append(discord.Embed.from_dict(json.loads(line)))
+            except ValueError:
+                continue
+        return embeds
+    
+    async def _restore_spilled(self):
+        """退避したログをキューに戻す（入りきらない分はファイルに残す）"""
+        room = self.queue.maxsize - self.queue.qsize()
+        if room <= 0:
+            return
+        try:
+            embeds = await asyncio.to_thread(self._take_spilled, room)
+        except Exception as e:
+            print(f"⚠️ 退避済みログの読み込みに失敗しました: {e}")
+            return
+        overflow = []
+        for embed in embeds:
+            try:
+                self.queue.put_nowait(embed)
+            except asyncio.QueueFull:
+                overflow.append(embed)
+        if overflow:
+            await self._spill_async(overflow)
+        if embeds:
+            print(f"退避済みのログ {len(embeds) - len(overflow)} 件を再送します")
+    
+    async def _resolve_channel(self):
+        """ログチャンネルを取得し、送信権限を確認する（結果は一定時間キャッシュ）"""
+        now = asyncio.get_running_loop().time()
+        if now - self._channel_checked_at < LOG_CHANNEL_CACHE_SECONDS:
+            return self._channel
+        self._channel_checked_at = now
+        self._channel = None
+        
+        channel = self.bot.get_channel(self.channel_id)
+        if channel is None:
+            try:
+                channel = await self.bot.fetch_channel(self.channel_id)
+            except Exception as e:
+                print(f"⚠️ ログチャンネル（ID: {self.channel_id}）が見つかりません: {e}")
+                return None
+        
+        # 権限チェック
+        bot_member = channel.guild.get_member(self.bot.user.id) if getattr(channel, 'guild', None) else None
+        if bot_member:
+            permissions = channel.permissions_for(bot_member)
+            if not (permissions.send_messages and permissions.embed_links):
+                print(f"⚠️ 権限不足 - 送信権限: {permissions.send_messages}, 埋め込み権限: {permissions.embed_links}")
+                return None
+        self._channel = channel
+        return channel
+    
+    async def _next_batch(self):
+        """キューから1メッセージ分（最大10個・6000文字以内）の埋め込みを取り出す"""
+        first = self._carry or await self.queue.get()
+        self._carry = None
+        batch = [first]
+        chars = len(first)
+        while len(batch) < self.MAX_EMBEDS and not self.queue.empty():
+            embed = self.queue.get_nowait()
+            if chars + len(embed) > self.MAX_CHARS:
+                self._carry = embed
+                break
+            batch.append(embed)
+            chars += len(embed)
+        return batch
+    
+    async def _run(self):
+        # 前回起動時までに退避したログを戻す
+        await self._restore_spilled()
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._send(batch)
+            except Exception as e:
+                print(f"⚠️ ログ送信エラー: {e}")
+                await self._spill_async(batch)
+    
+    async def _send(self, batch):
+        delay = 1.0
+        for _ in range(self.MAX_RETRIES):
+            channel = await self._resolve_channel()
+            if channel is None:
+                # 送れない間は退避しておき、送れるようになったら再送する
+                await self._spill_async(batch)
+                return
+            try:
+                await channel.send(embeds=batch)
+                self.sent += len(batch)
+                log_embeds.inc(len(batch), outcome='sent')
+                if self._spill_pending:
+                    # 送れるようになったので、退避していた分をキューに戻す
+                    await self._restore_spilled()
+                return
+            except discord.HTTPException as e:
+                log_embeds.inc(len(batch), outcome='rate_limited' if e.status == 429 else 'error')
+                if e.status == 429:
+                    retry_after = getattr(e, 'retry_after', None) or delay
+                    print(f"⚠️ ログ送信がレート制限されました。{retry_after:.1f}秒待機します")
+                    await asyncio.sleep(retry_after)
+                elif e.status == 403:
+                    # 権限が変わった可能性があるので次回は取り直す
+                    self._channel_checked_at = 0
+                    await asyncio.sleep(delay)
+                else:
+                    print(f"⚠️ ログ送信エラー: {e}")
+                    await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+        await self._spill_async(batch)
+
 class ZCurrencyBot(commands.Bot):
     def __init__(self):
         super().__init__(command_prefix='!', intents=intents)
-        self.data = self.load_data()
+        self._journal_buffer = []
+        self._commit_waiter = None
+        self._commit_timer = None
+        self._commit_tasks = set()
+        # スナップショットの作成中だけ、変更するユーザーの変更前のコピーを残す（user_id → UserAccount）
+        self._snapshot_originals = None
+        self._user_locks = weakref.WeakValueDictionary()
+        self.storage = create_storage(
+            STORAGE_BACKEND, DATA_FILE, JOURNAL_FILE, SQLITE_FILE,
+            initial_balance=INITIAL_BALANCE, compact_bytes=JOURNAL_COMPACT_BYTES,
+            archive_dir=ARCHIVE_DIR, transaction_window=TRANSACTION_WINDOW,
+            snapshot_file=SNAPSHOT_FILE, snapshot_format=SNAPSHOT_FORMAT
+        )
+        # 台帳は setup_hook で（コマンド同期と並行して）読み込む
+        self.data = None
+        self.persistence = PersistenceWorker()
+        self.archive_reader = concurrent.futures.ThreadPoolExecutor(ARCHIVE_READ_WORKERS, thread_name_prefix='archive-reader')
+        self.log_dispatcher = LogDispatcher(self, LOG_CHANNEL_ID)
+        self.edit_scheduler = EditScheduler()
+        self.game_sessions = GameSessionManager(CHINCHIN_MAX_ACTIVE_GAMES)
+        self.metrics_runner = None
+        # 実行中の /プロファイル の方式（同時に1つだけ）
+        self.profiling = None
+        # イベントループの遅れの監視（setup_hook で開始）
+        self.watchdog = None
+        if LOOP_STALL_THRESHOLD_MS > 0:
+            self.watchdog = LoopWatchdog(
+                LOOP_STALL_THRESHOLD_MS / 1000, context=commands_in_progress,
+                on_lag=loop_lag.observe, on_block=record_loop_stall
+            )
+    
+    async def close(self):
+        """終了前に未確定の変更を書き出す"""
+        try:
+            await self.commit()
+        except Exception as e:
+            print(f"終了時の保存エラー: {e}")
+        if self.metrics_runner:
+            await self.metrics_runner.cleanup()
+            self.metrics_runner = None
+        if self.watchdog:
+            self.watchdog.stop()
+        self.persistence.stop()
+        self.archive_reader.shutdown(wait=True)
+        self.storage.close()
+        await super().close()
     
     async def setup_hook(self):
-        """Botの起動時にスラッシュコマンドを同期"""
-        if GUILD_ID:
-            # 特定のギルドに同期（即座に反映）
-            guild = discord.Object(id=GUILD_ID)
+        """Botの起動時に台帳を読み込み、スラッシュコマンドを同期"""
+        if self.watchdog:
+            self.watchdog.start()
+        
+        # 台帳の読み込み（ファイルの解析）は別スレッドで行い、その間にコマンドの同期を済ませる
+        await asyncio.gather(self.load_ledger(), self.sync_commands())
+        
+        # ちんちろのレート選択ボタン（再起動前に出したメッセージのボタンもここで受ける）
+        self.add_view(chinchin_rate_view)
+        # /履歴 のページ送りボタン
+        self.add_dynamic_items(HistoryPageButton)
+        
+        if LOG_CHANNEL_ID:
+            self.log_dispatcher.start()
+        
+        if METRICS_PORT:
+            try:
+                self.metrics_runner = await start_http_server(metrics, METRICS_HOST, METRICS_PORT)
+                print(f"📈 動作指標を http://{METRICS_HOST}:{METRICS_PORT}/metrics で公開しています")
+            except OSError as e:
+                print(f"⚠️ 動作指標のサーバーを起動できませんでした: {e}")
+    
+    async def load_ledger(self):
+        """台帳を読み込んでインデックスを作る（イベントループを止めないよう別スレッドで）"""
+        started = time.perf_counter()
+        self.data = await asyncio.to_thread(self.load_data)
+        self.build_indexes()
+        logger.info("台帳を読み込みました（ユーザー %d人 / %.2f秒）", len(self.data['users']), time.perf_counter() - started)
+    
+    def command_tree_hash(self, guild=None):
+        """同期対象のコマンド定義のハッシュ"""
+        payload = [command.to_dict(self.tree) for command in self.tree.get_commands(guild=guild)]
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+    
+    async def sync_commands(self):
+        """コマンド定義が前回の同期から変わっている時だけ同期する"""
+        guild = discord.Object(id=GUILD_ID) if GUILD_ID else None
+        if guild:
             self.tree.copy_global_to(guild=guild)
+        digest = self.command_tree_hash(guild)
+        scope = f"{self.application_id}:{GUILD_ID or 'global'}"
+        
+        try:
+            with open(COMMAND_SYNC_FILE, 'r', encoding='utf-8') as f:
+                synced = json.load(f)
+        except (OSError, ValueError):
+            synced = {}
+        if not FORCE_COMMAND_SYNC and synced.get(scope) == digest:
+            logger.info("スラッシュコマンドに変更がないため同期を省略しました")
+            return
+        
+        if guild:
+            # 特定のギルドに同期（即座に反映）
             await self.tree.sync(guild=guild)
             print(f"スラッシュコマンドがギルド {GUILD_ID} に同期されました（即座反映）")
         else:
             # グローバル同期（反映まで最大1時間）
             await self.tree.sync()
             print("スラッシュコマンドがグローバルに同期されました（反映まで最大1時間）")
+        
+        synced[scope] = digest
+        with open(f"{COMMAND_SYNC_FILE}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(synced, f)
+        os.replace(f"{COMMAND_SYNC_FILE}.tmp", COMMAND_SYNC_FILE)
     
     def is_admin(self, user_id):
         """管理者かどうかをチェック"""
         return user_id in ADMIN_USER_IDS
     
     async def send_log(self, embed):
-        """ログチャンネルにログを送信"""
-        print(f"[DEBUG] send_log 呼び出し - LOG_CHANNEL_ID: {LOG_CHANNEL_ID}")
-        
-        if LOG_CHANNEL_ID:
-            try:
-                channel = self.get_channel(LOG_CHANNEL_ID)
-                print(f"[DEBUG] チャンネル取得結果: {channel}")
-                
-                if channel:
-                    # 権限チェック
-                    bot_member = channel.guild.get_member(self.user.id)
-                    if bot_member:
-                        permissions = channel.permissions_for(bot_member)
-                        print(f"[DEBUG] ボットの権限 - 送信: {permissions.send_messages}, 埋め込み: {permissions.embed_links}")
-                        
-                        if permissions.send_messages and permissions.embed_links:
-                            await channel.send(embed=embed)
-                            print(f"[SUCCESS] ログをチャンネル {channel.name} (ID: {LOG_CHANNEL_ID}) に送信しました")
-                        else:
-                            print(f"⚠️ 権限不足 - 送信権限: {permissions.send_messages}, 埋め込み権限: {permissions.embed_links}")
-                    else:
-                        print("⚠️ ボットがそのサーバーのメンバーではありません")
-                else:
-                    print(f"⚠️ ログチャンネル（ID: {LOG_CHANNEL_ID}）が見つかりません")
-                    # チャンネルが見つからない場合、fetch_channel を試行
-                    try:
-                        channel = await self.fetch_channel(LOG_CHANNEL_ID)
-                        if channel:
-                            await channel.send(embed=embed)
-                            print(f"[SUCCESS] fetch_channel でログ送信成功: {channel.name}")
-                        else:
-                            print("⚠️ fetch_channel でもチャンネルが見つかりません")
-                    except Exception as fetch_error:
-                        print(f"⚠️ fetch_channel エラー: {fetch_error}")
-            except Exception as e:
-                print(f"⚠️ ログ送信エラー: {e}")
-                import traceback
-                traceback.print_exc()
-        else:
+        """ログチャンネルへの送信を予約（実際の送信は LogDispatcher が行うので待たない）"""
+        if not LOG_CHANNEL_ID:
             print("⚠️ LOG_CHANNEL_ID が設定されていません")
+            return
+        self.log_dispatcher.enqueue(embed)
     
     def evaluate_chinchin_dice(self, dice):
-        """ちんちろのサイコロを評価（表に基づく）"""
-        dice_sorted = sorted(dice)
-        
-        # ピンゾロ（1,1,1）- 特別扱い：5倍もらう
-        if dice_sorted == [1, 1, 1]:
-            return 'ピンゾロ', 5
-        
-        # シゴロ（4,5,6）- 即勝ち：2倍もらう
-        if dice_sorted == [4, 5, 6]:
-            return 'シゴロ', 2
-        
-        # ゾロ目（2,2,2 3,3,3 4,4,4 5,5,5 6,6,6）- 3倍もらう
-        if dice_sorted[0] == dice_sorted[1] == dice_sorted[2]:
-            if dice_sorted[0] in [2, 3, 4, 5, 6]:
-                return f'{dice_sorted[0]}ゾロ', 3
-        
-        # ヒフミ（1,2,3）- 即負け：2倍払う
-        if dice_sorted == [1, 2, 3]:
-            return 'ヒフミ', -2
-        
-        # 通常の目（ゾロ目が一つある場合）
-        # 例：1,1,2 → 2の目, 3,4,4 → 3の目
-        if dice_sorted[0] == dice_sorted[1]:
-            # 最初の2つが同じ場合、3番目が目
-            return f'{dice_sorted[2]}の目', dice_sorted[2]
-        elif dice_sorted[1] == dice_sorted[2]:
-            # 後ろの2つが同じ場合、1番目が目
-            return f'{dice_sorted[0]}の目', dice_sorted[0]
-        
-        # 役無し
-        return '役無し', 0
+        """ちんちろのサイコロを評価（表に基づく）→ (役名, power)"""
+        hand = lookup_hand(dice)
+        return hand.name, hand.power
     
     def load_data(self):
-        """データファイルを読み込む"""
-        if os.path.exists(DATA_FILE):
-            try:
-                with open(DATA_FILE, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except:
-                return {'users': {}, 'transactions': []}
-        return {'users': {}, 'transactions': []}
-    
-    def save_data(self):
-        """データファイルに保存（改善版 - バックアップ・原子操作）"""
+        """保存先から台帳を読み込む"""
+        data = self.storage.load()
+        # 直近の取引だけを保持するリングバッファ（溢れた分は update_balance でアーカイブへ）
+        data['transactions'] = deque(data['transactions'])
+        return data
+    
+    def build_indexes(self):
+        """ランキング用のインデックスを読み込んだ台帳から作る（以降は update_balance で更新）"""
+        self.balance_index = RankIndex((user_id, user_data['balance']) for user_id, user_data in self.data['users'].items())
+        self.chinchin_index = RankIndex(self.data['stats']['users']['chinchin'].items())
+        # 取引履歴をメモリに持つ保存先だけ、ユーザーごとの履歴インデックスを作る（SQLite はテーブルの索引を使う）
+        self.transaction_index = TransactionIndex(self.data['transactions']) if self.storage.in_memory_transactions else None
+    
+    def _journal(self, record):
+        """変更をジャーナルバッファに積む（commit でまとめて書き込む）"""
+        self.data['journal_seq'] += 1
+        record['seq'] = self.data['journal_seq']
+        self._journal_buffer.append(record)
+    
+    async def commit(self):
+        """現在のコミット窓に参加し、窓内の変更がまとめて fsync されるまで待つ"""
+        if self._commit_waiter is None:
+            if not self._journal_buffer:
+                return True
+            loop = asyncio.get_running_loop()
+            self._commit_waiter = loop.create_future()
+            self._commit_timer = loop.call_later(COMMIT_WINDOW_MS / 1000, self._start_group_commit)
+        waiter = self._commit_waiter
+        # 窓の途中でも件数が溜まったら即座に書き出す
+        if len(self._journal_buffer) >= COMMIT_MAX_BATCH:
+            self._start_group_commit()
+        return await asyncio.shield(waiter)
+    
+    def _start_group_commit(self):
+        """コミット窓を閉じ、溜まった変更を1回の書き込みとして永続化スレッドへ渡す"""
+        waiter = self._commit_waiter
+        if waiter is None:
+            return
+        self._commit_waiter = None
+        if self._commit_timer:
+            self._commit_timer.cancel()
+            self._commit_timer = None
+        records = self._journal_buffer
+        self._journal_buffer = []
+        task = asyncio.create_task(self._group_commit(records, waiter))
+        self._commit_tasks.add(task)
+        task.add_done_callback(self._commit_tasks.discard)
+    
+    async def _group_commit(self, records, waiter):
+        """1回の書き込みが終わったら、窓に参加した全員にまとめて応答する"""
+        durable = True
         try:
-            # バックアップを作成
-            if os.path.exists(DATA_FILE):
-                backup_file = f"{DATA_FILE}.backup"
-                shutil.copy2(DATA_FILE, backup_file)
-            
-            # 一時ファイルに書き込み
-            temp_file = f"{DATA_FILE}.tmp"
-            with open(temp_file, 'w', encoding='utf-8') as f:
-                json.dump(self.data, f, ensure_ascii=False, indent=2)
-            
-            # 原子的な置換
-            if os.path.exists(temp_file):
-                os.replace(temp_file, DATA_FILE)
-                
+            if records:
+                with commit_duration.time():
+                    await self.persistence.submit(lambda: self.storage.write_batch(records))
         except Exception as e:
-            print(f"データ保存エラー: {e}")
-            # バックアップから復元を試行
-            backup_file = f"{DATA_FILE}.backup"
-            if os.path.exists(backup_file):
-                try:
-                    shutil.copy2(backup_file, DATA_FILE)
-                    print("バックアップから復元しました")
-                except:
-                    print("バックアップからの復元も失敗しました")
+            print(f"ジャーナル書き込みエラー: {e}")
+            # 次回の commit で再試行する
+            self._journal_buffer = records + self._journal_buffer
+            durable = False
+        if not waiter.done():
+            waiter.set_result(durable)
+    
+    async def save_data(self):
+        """保存先を圧縮する（JSON ならスナップショットを作り直してジャーナルを切り詰める）"""
+        started = time.perf_counter()
+        # 開いているコミット窓を引き取る（窓の変更はここで書き出すので、書き出せてから応答する）
+        waiter = self._commit_waiter
+        self._commit_waiter = None
+        if self._commit_timer:
+            self._commit_timer.cancel()
+            self._commit_timer = None
+        records = self._journal_buffer
+        self._journal_buffer = []
+        durable = True
+        try:
+            if records:
+                with commit_duration.time():
+                    await self.persistence.submit(lambda: self.storage.write_batch(records))
+        except Exception:
+            # 次回の commit で再試行する
+            self._journal_buffer = records + self._journal_buffer
+            durable = False
+            raise
+        finally:
+            if waiter is not None and not waiter.done():
+                waiter.set_result(durable)
+        
+        snapshot = None
+        originals = None
+        if self.storage.wants_snapshot:
+            # ループ上では辞書の浅いコピーだけ取り、ユーザーごとのコピー・シリアライズ・書き込みは
+            # 永続化スレッドで行う。その間に変更するユーザーは update_balance が変更前を残す（コピーオンライト）
+            # （取引レコードは追記後に変更されないので共有してよい）
+            originals = self._snapshot_originals = {}
+            snapshot = {
+                'users': dict(self.data['users']),
+                'transactions': list(self.data['transactions']),
+                'stats': copy_stats(self.data['stats']),
+                'journal_seq': self.data['journal_seq']
+            }
+        
+        def compact():
+            if snapshot is not None:
+                snapshot['users'] = freeze_accounts(snapshot['users'], originals)
+            return self.storage.compact(snapshot, [])
+        
+        try:
+            written = await self.persistence.submit(compact)
+        except Exception:
+            # 失敗は時間・バイト数に混ぜず別に数える
+            save_errors.inc(backend=self.storage.name)
+            raise
+        finally:
+            self._snapshot_originals = None
+        save_duration.observe(time.perf_counter() - started, backend=self.storage.name)
+        save_bytes.inc(written, backend=self.storage.name)
     
     def start_auto_save(self):
-        """定期的な自動保存を開始"""
+        """定期的なジャーナル確定とバックグラウンドのコンパクションを開始"""
         async def auto_save_loop():
             while True:
                 try:
-                    await asyncio.sleep(300)  # 5分ごとに保存
-                    self.save_data()
-                    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] データを自動保存しました")
+                    await asyncio.sleep(300)  # 5分ごとに確認
+                    # 通常は各コマンドのグループコミットで確定済み。ここは取りこぼし用の保険
+                    await self.commit()
+                    # ジャーナル（WAL）が大きくなった時だけ圧縮する
+                    if self.storage.needs_compaction():
+                        await self.save_data()
+                        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 保存先（{self.storage.name}）を圧縮しました")
                 except Exception as e:
                     print(f"自動保存エラー: {e}")
         
@@ -236,18 +1037,20 @@ class ZCurrencyBot(commands.Bot):
         """ユーザーデータを取得"""
         user_id = str(user_id)
         if user_id not in self.data['users']:
-            self.data['users'][user_id] = {
-                'balance': INITIAL_BALANCE,
-                'total_earned': INITIAL_BALANCE,
-                'total_spent': 0,
-                'join_date': datetime.now().isoformat()
-            }
-            self.save_data()
+            join_date = datetime.now().isoformat()
+            self.data['users'][user_id] = new_user_record(INITIAL_BALANCE, join_date)
+            self.balance_index.set(user_id, INITIAL_BALANCE)
+            # 作成だけならジャーナルに積んでおき、次の commit でまとめて書く
+            self._journal({'op': 'user', 'user_id': user_id, 'join_date': join_date, 'timestamp': join_date})
         return self.data['users'][user_id]
     
     def update_balance(self, user_id, amount, transaction_type='other'):
         """残高を更新"""
         user_data = self.get_user_data(user_id)
+        originals = self._snapshot_originals
+        if originals is not None and str(user_id) not in originals:
+            # 作成中のスナップショットには変更前の値を使わせる
+            originals[str(user_id)] = user_data.copy()
         user_data['balance'] += amount
         
         if amount > 0:
@@ -255,27 +1058,152 @@ class ZCurrencyBot(commands.Bot):
         else:
             user_data['total_spent'] += abs(amount)
         
+        # ランキング用のインデックスと種別ごとの累計を更新
+        user_id = str(user_id)
+        stats = self.data['stats']
+        add_to_stats(stats, user_id, amount, transaction_type)
+        self.balance_index.set(user_id, user_data['balance'])
+        if transaction_type == 'chinchin':
+            self.chinchin_index.set(user_id, stats['users']['chinchin'][user_id])
+        
         # 取引履歴を記録
-        self.data['transactions'].append({
+        timestamp = datetime.now().isoformat()
+        record = {
+            'op': 'balance',
             'user_id': str(user_id),
             'amount': amount,
             'type': transaction_type,
-            'timestamp': datetime.now().isoformat()
-        })
+            'timestamp': timestamp
+        }
+        self._journal(record)
+        if self.storage.in_memory_transactions:
+            transactions = self.data['transactions']
+            transaction = {
+                'user_id': str(user_id),
+                'amount': amount,
+                'type': transaction_type,
+                'timestamp': timestamp,
+                'seq': record['seq']
+            }
+            transactions.append(transaction)
+            self.transaction_index.add(transaction)
+            # 直近の範囲から外れた取引は、同じコミットでアーカイブへ書き出す
+            while len(transactions) > TRANSACTION_WINDOW:
+                evicted = transactions.popleft()
+                self.transaction_index.evict(evicted)
+                self._journal_buffer.append({'op': 'archive', 'transaction': evicted})
         
-        self.save_data()
+        # 書き込みは呼び出し側が await bot.commit() で確定させる
         return user_data['balance']
     
-    def transfer_currency(self, from_user_id, to_user_id, amount):
-        """通貨の送金"""
-        from_user = self.get_user_data(from_user_id)
+    async def fetch_history(self, user_id, transaction_type=None, start_date=None, end_date=None,
+                            before=None, after=None, limit=HISTORY_PAGE_SIZE):
+        """取引履歴の1ページ（HistoryPage）を取得"""
+        if self.transaction_index is not None:
+            result = self.transaction_index.page(user_id, transaction_type, start_date, end_date, before, after, limit)
+            return await self._page_with_archive(result, user_id, transaction_type, start_date, end_date, before, after, limit)
+        # SQLite の読み出しは書き込みと同じ永続化スレッドで行う（確定済みの取引まで見える）
+        return await self.persistence.submit(
+            lambda: self.storage.read_history(user_id, transaction_type, start_date, end_date, before, after, limit)
+        )
+    
+    async def _page_with_archive(self, result, user_id, transaction_type, start_date, end_date, before, after, limit):
+        """メモリ上の直近分で足りないページを、アーカイブ済みの取引で埋める
         
-        if from_user['balance'] < amount:
-            return False, "残高が不足しています"
+        アーカイブの読み出し（索引を引いて gzip のメンバーを展開する）は、ジャーナルの書き込みを
+        待たせないよう永続化スレッドではなくアーカイブ読み出し用のスレッドで行う。
+        """
+        async def read_archive(before=None, after=None, limit=limit):
+            # 直近分から外れたばかりでまだ書き出していない取引も読めるよう、先に確定させる
+            await self.commit()
+            if self._commit_tasks:
+                await asyncio.wait(set(self._commit_tasks))
+            return await asyncio.get_running_loop().run_in_executor(self.archive_reader, lambda: self.storage.read_archived_page(
+                user_id, transaction_type, start_date, end_date, before, after, limit
+            ))
         
-        # 送金処理
-        self.update_balance(from_user_id, -amount, 'transfer_out')
-        self.update_balance(to_user_id, amount, 'transfer_in')
+        if after is None:
+            if result.has_older:
+                return result
+            # 直近分がこのページで尽きたので、続きをアーカイブから読む（1件多く読んで、さらに古いものの有無を見る）
+            need = limit - len(result.transactions)
+            cursor = result.transactions[-1]['seq'] if result.transactions else before
+            archived = await read_archive(before=cursor, limit=need + 1)
+            has_newer = result.has_newer if result.transactions else before is not None
+            return HistoryPage(result.transactions + archived[:need], has_newer, len(archived) > need)
+        
+        if result.has_older:
+            # 位置が直近分の中にある
+            return result
+        # 位置がアーカイブ内にある: アーカイブの続き（古い順）の後に直近分の古い方をつなぐ
+        archived = await read_archive(after=after, limit=limit + 1)
+        if len(archived) > limit:
+            return HistoryPage(archived[:limit][::-1], True, True)
+        need = limit - len(archived)
+        recent = result.transactions[::-1]
+        transactions = archived + recent[:need]
+        return HistoryPage(transactions[::-1], result.has_newer or len(recent) > need, True)
+    
+    def available_balance(self, user_id):
+        """進行中のゲームで確保している分を除いた、使える残高"""
+        return self.get_user_data(user_id)['balance'] - self.game_sessions.held_amount(user_id)
+    
+    def _user_lock(self, user_id):
+        """ユーザーごとの asyncio.Lock（誰も使っていなければ自動的に破棄される）"""
+        user_id = str(user_id)
+        lock = self._user_locks.get(user_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._user_locks[user_id] = lock
+        return lock
+    
+    @contextlib.asynccontextmanager
+    async def lock_users(self, *user_ids):
+        """関係するユーザーのロックをまとめて取得（デッドロックを避けるため常にID順）"""
+        locks = [self._user_lock(user_id) for user_id in sorted({str(user_id) for user_id in user_ids})]
+        async with contextlib.AsyncExitStack() as stack:
+            for lock in locks:
+                await stack.enter_async_context(lock)
+            yield
+    
+    async def apply_transaction(self, entries, require=None):
+        """複数の残高変更を1つの単位として適用し、1回の書き込みで確定する
+        
+        entries: [(user_id, amount, transaction_type), ...]
+        require: (user_id, amount) を渡すと、そのユーザーの使える残高が amount 未満なら何もせず None を返す
+        戻り値: 各 entry 適用後の残高のリスト
+        """
+        async with self.lock_users(*[user_id for user_id, _, _ in entries]):
+            if require:
+                user_id, amount = require
+                if self.available_balance(user_id) < amount:
+                    return None
+            balances = [self.update_balance(user_id, amount, transaction_type) for user_id, amount, transaction_type in entries]
+            # ロックを持ったまま確定させ、同じユーザーの次の操作は確定後の残高を見る
+            await self.commit()
+        return balances
+    
+    async def bulk_credit(self, user_ids, amount, transaction_type='other'):
+        """複数ユーザーに同額を入金し、1回の書き込みでまとめて確定する（戻り値: 入金人数）"""
+        # 入金だけなので残高確認やユーザーロックは不要
+        # 途中で await しない: 他のコマンドの commit に一部だけ書き出されたり、
+        # ランキングなどに途中までの入金が見えたりしないよう、全員分を適用してから1回で確定する
+        count = 0
+        for user_id in user_ids:
+            self.update_balance(user_id, amount, transaction_type)
+            count += 1
+        await self.commit()
+        return count
+    
+    async def transfer_currency(self, from_user_id, to_user_id, amount):
+        """通貨の送金"""
+        # 残高確認・引き落とし・入金を1つの単位として行う
+        balances = await self.apply_transaction(
+            [(from_user_id, -amount, 'transfer_out'), (to_user_id, amount, 'transfer_in')],
+            require=(from_user_id, amount)
+        )
+        if balances is None:
+            return False, "残高が不足しています"
         
         return True, "送金が完了しました"
 
@@ -320,6 +1248,7 @@ async def on_ready():
 # スラッシュコマンド: 残高確認
 @bot.tree.command(name="残高確認", description="残高を確認します（管理者は他ユーザーの残高も確認可能）")
 @app_commands.describe(user="確認したいユーザー（管理者のみ）")
+@timed_command
 async def balance_slash(interaction: discord.Interaction, user: discord.Member = None):
     # 他のユーザーの残高を確認しようとしている場合
     if user and user != interaction.user:
@@ -351,6 +1280,7 @@ async def balance_slash(interaction: discord.Interaction, user: discord.Member =
 # スラッシュコマンド: 発行
 @bot.tree.command(name="発行", description="管理者専用：指定ユーザーに通貨を発行")
 @app_commands.describe(user="発行対象のユーザー", amount="発行する金額")
+@timed_command
 async def issue_slash(interaction: discord.Interaction, user: discord.Member, amount: int):
     if not bot.is_admin(interaction.user.id):
         await interaction.response.send_message("❌ この機能を使用する権限がありません", ephemeral=True)
@@ -361,6 +1291,7 @@ async def issue_slash(interaction: discord.Interaction, user: discord.Member, am
         return
     
     new_balance = bot.update_balance(user.id, amount, 'admin_issue')
+    await bot.commit()
     
     embed = discord.Embed(
         title="🏦 通貨発行",
@@ -392,6 +1323,7 @@ async def issue_slash(interaction: discord.Interaction, user: discord.Member, am
 # スラッシュコマンド: 減少
 @bot.tree.command(name="減少", description="管理者専用：指定ユーザーの通貨を減少")
 @app_commands.describe(user="減少対象のユーザー", amount="減少する金額")
+@timed_command
 async def reduce_slash(interaction: discord.Interaction, user: discord.Member, amount: int):
     if not bot.is_admin(interaction.user.id):
         await interaction.response.send_message("❌ この機能を使用する権限がありません", ephemeral=True)
@@ -401,12 +1333,12 @@ async def reduce_slash(interaction: discord.Interaction, user: discord.Member, a
         await interaction.response.send_message("❌ 減少額は1以上である必要があります", ephemeral=True)
         return
     
-    user_data = bot.get_user_data(user.id)
-    if user_data['balance'] < amount:
+    balances = await bot.apply_transaction([(user.id, -amount, 'admin_reduce')], require=(user.id, amount))
+    if balances is None:
+        user_data = bot.get_user_data(user.id)
         await interaction.response.send_message(f"❌ {user.display_name} の残高が不足しています（現在: {user_data['balance']:,}Z）", ephemeral=True)
         return
-    
-    new_balance = bot.update_balance(user.id, -amount, 'admin_reduce')
+    new_balance = balances[0]
     
     embed = discord.Embed(
         title="🏦 通貨減少",
@@ -438,6 +1370,7 @@ async def reduce_slash(interaction: discord.Interaction, user: discord.Member, a
 # スラッシュコマンド: ロール発行
 @bot.tree.command(name="ロール発行", description="管理者専用：指定ロールのメンバー全員に通貨を発行")
 @app_commands.describe(role="発行対象のロール", amount="発行する金額（一人当たり）")
+@timed_command
 async def role_issue_slash(interaction: discord.Interaction, role: discord.Role, amount: int):
     if not bot.is_admin(interaction.user.id):
         await interaction.response.send_message("❌ この機能を使用する権限がありません", ephemeral=True)
@@ -452,12 +1385,11 @@ async def role_issue_slash(interaction: discord.Interaction, role: discord.Role,
         await interaction.response.send_message(f"❌ ロール {role.name} にメンバーがいません", ephemeral=True)
         return
     
-    # 発行処理
-    issued_count = 0
-    for member in members:
-        if not member.bot:  # ボットには発行しない
-            bot.update_balance(member.id, amount, 'role_issue')
-            issued_count += 1
+    # 大きなロールでも3秒以内に応答できるよう先に保留応答を返す
+    await interaction.response.defer()
+    
+    # 発行処理（ボットには発行しない）
+    issued_count = await bot.bulk_credit([member.id for member in members if not member.bot], amount, 'role_issue')
     
     embed = discord.Embed(
         title="👥 ロール一括発行",
@@ -471,7 +1403,7 @@ async def role_issue_slash(interaction: discord.Interaction, role: discord.Role,
     embed.add_field(name="総発行額", value=f"{amount * issued_count:,}Z", inline=True)
     embed.set_footer(text=f"管理者: {interaction.user.display_name}")
     
-    await interaction.response.send_message(embed=embed)
+    await interaction.followup.send(embed=embed)
     
     # ログチャンネルにも送信
     log_embed = discord.Embed(
@@ -500,6 +1432,7 @@ async def role_issue_slash(interaction: discord.Interaction, role: discord.Role,
 # スラッシュコマンド: 送金
 @bot.tree.command(name="送金", description="他のユーザーに送金")
 @app_commands.describe(user="送金先のユーザー", amount="送金する金額")
+@timed_command
 async def send_slash(interaction: discord.Interaction, user: discord.Member, amount: int):
     if amount <= 0:
         await interaction.response.send_message("❌ 送金額は1以上である必要があります", ephemeral=True)
@@ -513,7 +1446,7 @@ async def send_slash(interaction: discord.Interaction, user: discord.Member, amo
         await interaction.response.send_message("❌ ボットには送金できません", ephemeral=True)
         return
     
-    success, message = bot.transfer_currency(interaction.user.id, user.id, amount)
+    success, message = await bot.transfer_currency(interaction.user.id, user.id, amount)
     
     if success:
         embed = discord.Embed(
@@ -549,58 +1482,285 @@ async def send_slash(interaction: discord.Interaction, user: discord.Member, amo
     else:
         await interaction.response.send_message(f"❌ {message}", ephemeral=True)
 
+# スラッシュコマンド: ランキング
+@bot.tree.command(name="ランキング", description="残高・ちんちろ収支のランキングを表示")
+@app_commands.describe(kind="ランキングの種類", count="表示する人数（最大25）")
+@app_commands.choices(kind=[
+    app_commands.Choice(name="残高", value="balance"),
+    app_commands.Choice(name="ちんちろ収支", value="chinchin")
+])
+@timed_command
+async def ranking_slash(interaction: discord.Interaction, kind: str = "balance", count: int = 10):
+    count = max(1, min(count, 25))
+    if kind == "chinchin":
+        index = bot.chinchin_index
+        title = "🎲 ちんちろ収支ランキング"
+        amount_format = "{:+,}Z"
+    else:
+        index = bot.balance_index
+        title = "💰 残高ランキング"
+        amount_format = "{:,}Z"
+    
+    embed = discord.Embed(title=title, color=0xffd700, timestamp=datetime.now())
+    
+    # インデックスから上位だけを取り出す（全ユーザーの走査はしない）
+    medals = {1: "🥇", 2: "🥈", 3: "🥉"}
+    lines = []
+    for user_id, value in index.top(count):
+        rank = index.rank(user_id)
+        lines.append(f"{medals.get(rank, f'{rank}.')} <@{user_id}> — **{amount_format.format(value)}**")
+    embed.description = "\n".join(lines) if lines else "まだデータがありません"
+    
+    # 実行者自身の順位
+    user_id = str(interaction.user.id)
+    rank = index.rank(user_id)
+    if rank is not None:
+        value = index.get(user_id)
+        embed.add_field(name="あなたの順位", value=f"**{rank:,}位** / {len(index):,}人（{amount_format.format(value)}）", inline=False)
+    
+    if kind == "chinchin":
+        # Bot 全体のちんちろの累計（プレイヤーから見た増減）
+        totals = bot.data['stats']['types'].get('chinchin')
+        if totals:
+            embed.add_field(name="総対戦数", value=f"{totals['count']:,}回", inline=True)
+            embed.add_field(name="プレイヤーの総獲得", value=f"{totals['earned']:,}Z", inline=True)
+            embed.add_field(name="プレイヤーの総損失", value=f"{totals['spent']:,}Z", inline=True)
+    
+    await interaction.response.send_message(embed=embed)
+
+# 取引履歴のページ送り
+# 表示条件（対象ユーザー・種別・期間）と移動先の位置（取引の連番）を custom_id に入れておくので、
+# Bot 側にページの状態を持たず、再起動後でもボタンが使える
+class HistoryQuery(NamedTuple):
+    """/履歴 の表示条件（未指定の項目は空文字）"""
+    user_id: str
+    transaction_type: str
+    start_date: str
+    end_date: str
 
-# スラッシュコマンド: ちんちろ
-@bot.tree.command(name="ちんちろ", description="通貨を賭けてサイコロバトル")
-async def chinchin_slash(interaction: discord.Interaction):
-    user_data = bot.get_user_data(interaction.user.id)
+class HistoryPageButton(
+    discord.ui.DynamicItem[discord.ui.Button],
+    template=r'history:(?P<direction>newer|older):(?P<user_id>\d+):(?P<type>\w*):(?P<start>[0-9-]*):(?P<end>[0-9-]*):(?P<page>\d+):(?P<cursor>-?\d+)'
+):
+    def __init__(self, query: HistoryQuery, direction: str, page: int, cursor: int, disabled: bool = False):
+        self.query = query
+        self.direction = direction
+        self.page = page
+        self.cursor = cursor
+        super().__init__(discord.ui.Button(
+            label="◀ 新しい" if direction == 'newer' else "古い ▶",
+            style=discord.ButtonStyle.secondary,
+            custom_id=f"history:{direction}:{query.user_id}:{query.transaction_type}:{query.start_date}:{query.end_date}:{page}:{cursor}",
+            disabled=disabled
+        ))
+    
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        query = HistoryQuery(match['user_id'], match['type'], match['start'], match['end'])
+        return cls(query, match['direction'], int(match['page']), int(match['cursor']))
+    
+    async def interaction_check(self, interaction: discord.Interaction):
+        if str(interaction.user.id) != self.query.user_id and not bot.is_admin(interaction.user.id):
+            await interaction.response.send_message("❌ 他のユーザーの履歴を確認する権限がありません", ephemeral=True)
+            return False
+        return True
+    
+    async def callback(self, interaction: discord.Interaction):
+        await interaction.response.defer()
+        if self.direction == 'older':
+            embed, view = await build_history_page(self.query, self.page, before=self.cursor)
+        else:
+            embed, view = await build_history_page(self.query, self.page, after=self.cursor)
+        await interaction.edit_original_response(embed=embed, view=view)
+
+async def build_history_page(query: HistoryQuery, page: int, before=None, after=None):
+    """履歴の1ページ分の埋め込みとページ送りボタンを作る"""
+    result = await bot.fetch_history(
+        query.user_id, query.transaction_type or None, query.start_date or None, query.end_date or None,
+        before=before, after=after
+    )
     
-    # レート選択用のView
-    class ChinchinRateView(discord.ui.View):
-        def __init__(self):
-            super().__init__(timeout=60)
-        
-        @discord.ui.button(label="1,000Z", style=discord.ButtonStyle.primary, emoji="🎲")
-        async def rate_1000(self, interaction: discord.Interaction, button: discord.ui.Button):
-            await self.start_chinchin(interaction, 1000)
-        
-        @discord.ui.button(label="5,000Z", style=discord.ButtonStyle.success, emoji="🎲")
-        async def rate_5000(self, interaction: discord.Interaction, button: discord.ui.Button):
-            await self.start_chinchin(interaction, 5000)
-        
-        @discord.ui.button(label="10,000Z", style=discord.ButtonStyle.danger, emoji="🎲")
-        async def rate_10000(self, interaction: discord.Interaction, button: discord.ui.Button):
-            await self.start_chinchin(interaction, 10000)
+    embed = discord.Embed(
+        title="📜 取引履歴",
+        description=f"<@{query.user_id}>",
+        color=0x0099ff,
+        timestamp=datetime.now()
+    )
+    if query.transaction_type:
+        embed.add_field(name="種類", value=TRANSACTION_TYPE_LABELS.get(query.transaction_type, query.transaction_type), inline=True)
+    if query.start_date or query.end_date:
+        embed.add_field(name="期間", value=f"{query.start_date or '…'} 〜 {query.end_date or '…'}", inline=True)
+    
+    lines = [
+        f"`{transaction['timestamp'][:16].replace('T', ' ')}` "
+        f"{TRANSACTION_TYPE_LABELS.get(transaction['type'], transaction['type'])} **{transaction['amount']:+,}Z**"
+        for transaction in result.transactions
+    ]
+    embed.add_field(name="取引", value="\n".join(lines) if lines else "該当する取引はありません", inline=False)
+    embed.set_footer(text=f"ページ {page}")
+    
+    view = discord.ui.View(timeout=None)
+    if result.transactions:
+        view.add_item(HistoryPageButton(query, 'newer', max(page - 1, 1), result.transactions[0]['seq'], disabled=not result.has_newer))
+        view.add_item(HistoryPageButton(query, 'older', page + 1, result.transactions[-1]['seq'], disabled=not result.has_older))
+    return embed, view
+
+# スラッシュコマンド: 履歴
+@bot.tree.command(name="履歴", description="取引履歴を表示します（管理者は他ユーザーの履歴も確認可能）")
+@app_commands.describe(
+    user="確認したいユーザー（管理者のみ）",
+    kind="取引の種類",
+    start_date="開始日（YYYY-MM-DD）",
+    end_date="終了日（YYYY-MM-DD）"
+)
+@app_commands.choices(kind=[
+    app_commands.Choice(name=label, value=transaction_type) for transaction_type, label in TRANSACTION_TYPE_LABELS.items()
+])
+@timed_command
+async def history_slash(interaction: discord.Interaction, user: discord.Member = None, kind: str = None,
+                        start_date: str = None, end_date: str = None):
+    # 他のユーザーの履歴を確認しようとしている場合
+    if user and user != interaction.user:
+        if not bot.is_admin(interaction.user.id):
+            await interaction.response.send_message("❌ 他のユーザーの履歴を確認する権限がありません", ephemeral=True)
+            return
+        target_user = user
+    else:
+        target_user = interaction.user
+    
+    for value in (start_date, end_date):
+        if value:
+            try:
+                datetime.strptime(value, '%Y-%m-%d')
+            except ValueError:
+                await interaction.response.send_message("❌ 日付は YYYY-MM-DD の形式で入力してください", ephemeral=True)
+                return
+    
+    await interaction.response.defer(ephemeral=True)
+    query = HistoryQuery(str(target_user.id), kind or '', start_date or '', end_date or '')
+    embed, view = await build_history_page(query, 1)
+    await interaction.followup.send(embed=embed, view=view, ephemeral=True)
+
+
+# ちんちろのレート選択ボタン
+# Bot 全体で1つだけ登録する永続 View。賭け金は custom_id（chinchiro:rate:<金額>）に入っており、
+# 誰のゲームかはボタンの付いたメッセージ（/ちんちろ の応答）から分かるので、再起動後も押せる
+CHINCHIN_RATE_PREFIX = 'chinchiro:rate:'
+CHINCHIN_CANCEL_ID = 'chinchiro:cancel'
+
+def chinchin_owner_id(interaction: discord.Interaction):
+    """押されたレート選択メッセージを出した /ちんちろ の実行者（分からなければ None）"""
+    metadata = interaction.message.interaction_metadata if interaction.message else None
+    return metadata.user.id if metadata else None
+
+# (賭け金, ボタンの色)
+CHINCHIN_RATES = (
+    (1000, discord.ButtonStyle.primary),
+    (5000, discord.ButtonStyle.success),
+    (10000, discord.ButtonStyle.danger),
+)
+
+def chinchin_rate_buttons():
+    """レート選択画面のボタン（押されたボタンは custom_id で chinchin_rate_view が受ける）"""
+    buttons = [
+        discord.ui.Button(label=f"{amount:,}Z", style=style, emoji="🎲", custom_id=f"{CHINCHIN_RATE_PREFIX}{amount}")
+        for amount, style in CHINCHIN_RATES
+    ]
+    buttons.append(discord.ui.Button(label="キャンセル", style=discord.ButtonStyle.secondary, emoji="❌", custom_id=CHINCHIN_CANCEL_ID))
+    return buttons
+
+class ChinchinRateButtons(discord.ui.View):
+    """/ちんちろ の応答に付けるボタン（送信専用）
+    
+    押されたボタンは chinchin_rate_view が受けるので、この View は discord.py に
+    メッセージごとの View として登録させない（timeout=None の登録はいつまでも残る）。
+    """
+    
+    def __init__(self):
+        super().__init__(timeout=None)
+        for button in chinchin_rate_buttons():
+            self.add_item(button)
+    
+    def is_finished(self):
+        # 送信時の登録は終了済みの View では行われない
+        return True
+
+class ChinchinRateView(discord.ui.View):
+    """押されたレート選択ボタンを受ける永続 View（setup_hook で1つだけ登録する）"""
+    
+    def __init__(self):
+        super().__init__(timeout=None)
+        for button in chinchin_rate_buttons():
+            if button.custom_id == CHINCHIN_CANCEL_ID:
+                button.callback = self.cancel
+            else:
+                button.callback = lambda interaction, button=button: self.start_chinchin(interaction, button)
+            self.add_item(button)
+    
+    async def interaction_check(self, interaction: discord.Interaction):
+        owner_id = chinchin_owner_id(interaction)
+        if owner_id is not None and owner_id != interaction.user.id:
+            await interaction.response.send_message("❌ このボタンは /ちんちろ を実行した人だけが押せます", ephemeral=True)
+            return False
+        return True
+    
+    async def cancel(self, interaction: discord.Interaction):
+        embed = discord.Embed(
+            title="❌ ちんちろをキャンセルしました",
+            color=0xff0000,
+            timestamp=datetime.now()
+        )
+        await interaction.response.edit_message(embed=embed, view=None)
+    
+    async def start_chinchin(self, interaction: discord.Interaction, button: discord.ui.Button):
+        amount = int(button.custom_id[len(CHINCHIN_RATE_PREFIX):])
         
-        @discord.ui.button(label="キャンセル", style=discord.ButtonStyle.secondary, emoji="❌")
-        async def cancel(self, interaction: discord.Interaction, button: discord.ui.Button):
-            embed = discord.Embed(
-                title="❌ ちんちろをキャンセルしました",
-                color=0xff0000,
-                timestamp=datetime.now()
+        # 1ユーザー1ゲーム・同時ゲーム数の上限を確認し、賭け金を確保する
+        async with bot.lock_users(interaction.user.id):
+            session, reason = bot.game_sessions.open(
+                interaction.user.id, amount, bot.available_balance(interaction.user.id)
             )
-            await interaction.response.edit_message(embed=embed, view=None)
         
-        async def start_chinchin(self, interaction: discord.Interaction, amount: int):
+        if reason == 'funds':
             user_data = bot.get_user_data(interaction.user.id)
-            if user_data['balance'] < amount:
-                await interaction.response.edit_message(
-                    embed=discord.Embed(
-                        title="❌ 残高不足",
-                        description=f"賭け金{amount:,}Zに対して残高が不足しています\n現在の残高: {user_data['balance']:,}Z",
-                        color=0xff0000,
-                        timestamp=datetime.now()
+            await interaction.response.edit_message(
+                embed=discord.Embed(
+                    title="❌ 残高不足",
+                    description=(
+                        f"賭け金{amount:,}Zで遊ぶには、最大の負け（{MAX_LOSS_MULTIPLIER}倍払い）に備えて"
+                        f"{amount * MAX_LOSS_MULTIPLIER:,}Zの残高が必要です\n現在の残高: {user_data['balance']:,}Z"
                     ),
-                    view=None
-                )
-                return
-            
-            await play_chinchin_game(interaction, amount)
+                    color=0xff0000,
+                    timestamp=datetime.now()
+                ),
+                view=None
+            )
+            return
+        if reason == 'active':
+            await interaction.response.send_message("❌ 進行中のちんちろがあります。終わるまでお待ちください", ephemeral=True)
+            return
+        if reason == 'busy':
+            await interaction.response.send_message("🚦 ただいま混雑しています。少し待ってからもう一度お試しください", ephemeral=True)
+            return
         
-        async def on_timeout(self):
-            # タイムアウト時の処理
-            for item in self.children:
-                item.disabled = True
+        try:
+            await play_chinchin_game(interaction, amount, session)
+        finally:
+            bot.game_sessions.close(session)
+            chinchin_game_duration.observe(time.monotonic() - session.started)
+
+# 押されたボタンを受ける View（setup_hook で add_view し、メッセージに依らず custom_id で振り分ける）
+chinchin_rate_view = ChinchinRateView()
+
+# スラッシュコマンド: ちんちろ
+@bot.tree.command(name="ちんちろ", description="通貨を賭けてサイコロバトル")
+@timed_command
+async def chinchin_slash(interaction: discord.Interaction):
+    if bot.game_sessions.get(interaction.user.id):
+        await interaction.response.send_message("❌ 進行中のちんちろがあります。終わるまでお待ちください", ephemeral=True)
+        return
+    
+    user_data = bot.get_user_data(interaction.user.id)
     
     # レート選択画面を表示
     embed = discord.Embed(
@@ -611,485 +1771,451 @@ async def chinchin_slash(interaction: discord.Interaction):
     )
     embed.add_field(name="現在の残高", value=f"{user_data['balance']:,}Z", inline=True)
     embed.add_field(name="選択可能なレート", value="1,000Z / 5,000Z / 10,000Z", inline=False)
+    embed.add_field(name="必要な残高", value=f"賭け金の{MAX_LOSS_MULTIPLIER}倍（最大の負けの分を精算まで確保します）", inline=False)
     
-    view = ChinchinRateView()
-    await interaction.response.send_message(embed=embed, view=view)
+    await interaction.response.send_message(embed=embed, view=ChinchinRateButtons())
 
-# ちんちろゲーム本体の処理
-async def play_chinchin_game(interaction: discord.Interaction, amount: int):
-    global bot  # botインスタンスをグローバルに使用
+# ちんちろ演出フレームのテンプレート
+# サイコロの出目 216 通りの絵文字表示と、(場面, 役, 賭け金) ごとの固定部分を作り置きしておき、
+# フレームごとには履歴などの変化する部分だけを組み立てる
+DICE_EMOJIS = ['⚀', '⚁', '⚂', '⚃', '⚄', '⚅']
+DICE_DISPLAY = tuple(' '.join(DICE_EMOJIS[d - 1] for d in unpack_dice(key)) for key in range(216))
+DICE_DESCRIPTION = tuple(
+    f"**{DICE_DISPLAY[key]}**\n({dice[0]}, {dice[1]}, {dice[2]})"
+    for key, dice in ((key, unpack_dice(key)) for key in range(216))
+)
+CHINCHIN_TEMPLATE_CACHE_SIZE = 4096
+
+class ChinchinTemplate(NamedTuple):
+    """演出フレームの固定部分"""
+    title: str
+    description: str    # None ならフレームごとに渡す
+    color: int
+    fields: tuple       # 固定の項目は dict、フレームごとに変わる項目は (名前, 値の引数名, inline)
+    footer: dict = None
+
+chinchin_templates = {}
+
+def dice_display(dice):
+    """出目（3個）の絵文字表示"""
+    return DICE_DISPLAY[pack_dice(*dice)]
+
+def _field(name, value, inline):
+    return {'name': name, 'value': value, 'inline': inline}
+
+# 出た役ごとの結果欄（絵文字, 色, 説明）
+_HAND_FLAVOURS = {
+    KIND_PINZORO: ("🏆", 0xffd700, "⭐最強役！⭐"),
+    KIND_SHIGORO: ("🎉", 0xff69b4, "🔥即勝ち役！🔥"),
+    KIND_ZORO: ("✨", 0x9932cc, "💎強力な役！💎"),
+    KIND_ME: ("⭐", 0x32cd32, "📈役が出た！📈"),
+    KIND_HIFUMI: ("💀", 0x8b0000, "⚡即負け役...⚡"),
+}
+_NO_HAND_FLAVOUR = ("😐", 0x696969, "💨まだ役なし💨")
+
+def _player_next_field(hand, attempt):
+    if hand.final:
+        if hand.kind == KIND_HIFUMI:
+            return _field("⚡ 次の展開", "即負け役が出ました！\n🤖 **Botのターンへ！**", False)
+        if hand.kind == KIND_SHIGORO:
+            return _field("🔥 次の展開", "シゴロ！即勝ち役です！\n🤖 **Botのターンで逆転なるか？**", False)
+        if hand.kind == KIND_PINZORO:
+            return _field("👑 次の展開", "最強役ピンゾロ！\n🤖 **Botに勝ち目はあるのか？**", False)
+        return _field("✨ 次の展開", "役が確定しました！\n🤖 **Botの反撃が始まる！**", False)
+    if attempt < 2:
+        return _field("🔄 次の展開", f"役なし...まだ**{2-attempt}回**チャンスがあります！\n⏳ **次の投げで運命が決まる！**", False)
+    return _field("😓 結果", "3回振っても役なし...\n🤖 **Botのターンです！**", False)
+
+def _bot_next_field(hand, attempt):
+    if hand.final:
+        if hand.kind == KIND_HIFUMI:
+            return _field("⚡ 展開", "Botが即負け役を出しました！\n🎊 **勝敗判定へ！**", False)
+        if hand.kind == KIND_SHIGORO:
+            return _field("🔥 展開", "Botがシゴロを出しました！\n⚔️ **最終決戦！**", False)
+        if hand.kind == KIND_PINZORO:
+            return _field("👑 展開", "Botが最強役を出しました！\n💥 **究極の対決！**", False)
+        return _field("✨ 展開", "Botも役が確定！\n🎭 **運命の判定タイム！**", False)
+    if attempt < 2:
+        return _field("🔄 展開", f"Botも役なし...まだ**{2-attempt}回**残っています！\n🎲 **AIの逆転なるか？**", False)
+    return _field("😓 結果", "Botも3回振って役なし...\n🎊 **ついに勝敗判定！**", False)
+
+def _result_fields(outcome, amount):
+    """結果発表の固定部分（役の欄より前の「結果」と、後ろの勝敗・賭け金・増減の欄）"""
+    result = outcome.result
+    winnings = amount * outcome.multiplier
+    if result == RESULT_WIN:
+        head = _field("🏆 結果", f"**🎉 {result} 🎉**", False)
+        verdict = _field("⚔️ 勝敗", "🏆 **勝利！** 🏆", True)
+    elif result == RESULT_LOSE:
+        head = _field("💔 結果", f"**😢 {result} 😢**", False)
+        verdict = _field("⚔️ 勝敗", "💀 **敗北...** 💀", True)
+    else:
+        head = _field("🤝 結果", f"**🤝 {result} 🤝**", False)
+        verdict = _field("⚔️ 勝敗", "🤝 **引き分け** 🤝", True)
     
-    # メッセージ更新のヘルパー関数
-    async def safe_edit_message(embed, view=None):
-        try:
-            await interaction.edit_original_response(embed=embed, view=view)
-        except discord.NotFound:
-            # メッセージが見つからない場合はfollowupを使用
-            try:
-                await interaction.followup.send(embed=embed, view=view)
-            except:
-                pass  # 失敗した場合は無視
-        except Exception as e:
-            print(f"メッセージ更新エラー: {e}")
+    if winnings > 0:
+        change = _field("💎 獲得", f"**+{winnings:,}Z** 🎉", True)
+    elif winnings < 0:
+        change = _field("💸 損失", f"**{winnings:,}Z** 😢", True)
+    else:
+        change = _field("💫 増減", "**±0Z** 🤝", True)
     
-    # バトル開始の演出
-    embed = discord.Embed(
-        title="🎲✨ ちんちろバトル開始！ ✨🎲",
-        description=f"**{interaction.user.mention}** が **{amount:,}Z** を賭けて熱いバトルに挑戦！\n🔥 運命のサイコロが回り始める... 🔥",
-        color=0xff6600,
-        timestamp=datetime.now()
-    )
-    embed.add_field(name="💰 賭け金", value=f"**{amount:,}Z**", inline=True)
-    embed.add_field(name="📋 ルール", value="最大3回までサイコロを振れます\n役が出るまで挑戦しよう！", inline=True)
-    embed.add_field(name="🎯 目標", value="相手より強い役を出せ！", inline=True)
+    tail = []
+    # 配当説明
+    if abs(winnings) > amount:
+        multiplier = abs(winnings) // amount
+        if multiplier >= 5:
+            tail.append(_field("🏆 配当", f"**{multiplier}倍** ⭐超大当たり⭐", False))
+        elif multiplier >= 3:
+            tail.append(_field("✨ 配当", f"**{multiplier}倍** 💎大当たり💎", False))
+        else:
+            tail.append(_field("🎉 配当", f"**{multiplier}倍** 🎊当たり🎊", False))
     
-    # インタラクションが既に応答済みかどうかをチェック
-    if interaction.response.is_done():
-        await safe_edit_message(embed, view=None)
+    # 特別メッセージ
+    if result == RESULT_WIN:
+        if winnings >= amount * 5:
+            tail.append(_field("🌟 特別メッセージ", "🎆 **伝説級の大勝利！** 🎆\n✨ あなたは真のちんちろマスター！ ✨", False))
+        elif winnings >= amount * 3:
+            tail.append(_field("🎉 特別メッセージ", "🔥 **素晴らしい勝利！** 🔥\n⭐ 運が味方についています！ ⭐", False))
+        else:
+            tail.append(_field("😊 特別メッセージ", "🎊 **ナイス勝利！** 🎊\n👍 調子が良いですね！ 👍", False))
+    elif result == RESULT_LOSE:
+        tail.append(_field("💪 特別メッセージ", "😤 **次こそリベンジ！** 😤\n🔥 諦めずに挑戦しよう！ 🔥", False))
     else:
-        await interaction.response.edit_message(embed=embed, view=None)
-    await asyncio.sleep(4)
+        tail.append(_field("🤝 特別メッセージ", "⚡ **互角の戦い！** ⚡\n🎲 次の勝負で決着をつけよう！ 🎲", False))
     
-    # プレイヤーのターン開始
-    embed = discord.Embed(
-        title="🎲 あなたのターン開始！",
-        description="🌟 **運命のサイコロを振ろう！** 🌟",
-        color=0x00ff00,
-        timestamp=datetime.now()
+    return (head, ('👤 あなたの役', 'player', True), ('🤖 Botの役', 'bot', True), verdict,
+            _field("💰 賭け金", f"{amount:,}Z", True), change, ('🏦 現在の残高', 'balance', True), *tail)
+
+def _build_chinchin_template(phase, amount, hand=None, attempt=0, outcome=None):
+    if phase == 'start':
+        return ChinchinTemplate("🎲✨ ちんちろバトル開始！ ✨🎲", None, 0xff6600, (
+            _field("💰 賭け金", f"**{amount:,}Z**", True),
+            _field("📋 ルール", "最大3回までサイコロを振れます\n役が出るまで挑戦しよう！", True),
+            _field("🎯 目標", "相手より強い役を出せ！", True),
+        ))
+    if phase == 'player_turn':
+        return ChinchinTemplate("🎲 あなたのターン開始！", "🌟 **運命のサイコロを振ろう！** 🌟", 0x00ff00, (
+            _field("💰 賭け金", f"{amount:,}Z", True),
+            ("👤 挑戦者", 'player', True),
+            _field("🎯 状況", "最初の挑戦！", True),
+        ))
+    if phase == 'player_roll':
+        return ChinchinTemplate(f"🎲 第{attempt + 1}投目 🎲", "🌀 **サイコロが転がっています...** 🌀", 0x00ff00, (
+            _field("💰 賭け金", f"{amount:,}Z", True),
+            _field("🔄 投目", f"{attempt + 1}/3回目", True),
+            _field("⏳ 状況", "運命を決める瞬間...", True),
+        ))
+    if phase == 'player_result':
+        emoji, color, flavour = _HAND_FLAVOURS.get(hand.kind, _NO_HAND_FLAVOUR)
+        return ChinchinTemplate(f"🎲 第{attempt + 1}投目の結果！ 🎲", None, color, (
+            _field(f"{emoji} 結果", f"**{hand.name}** {flavour}", False),
+            ("📊 あなたの全結果", 'history', False),
+            _player_next_field(hand, attempt),
+        ))
+    if phase == 'bot_turn':
+        return ChinchinTemplate("🤖✨ Botのターン開始！ ✨🤖", "🔥 **AIが反撃開始！** 🔥\n⚡ 人工知能の運命やいかに... ⚡", 0xff4500, (
+            ("👤 あなたの最終結果", 'player', False),
+            _field("🎯 Botの目標", "あなたの役を上回れ！", True),
+            _field("⚔️ 戦況", "激戦必至！", True),
+        ))
+    if phase == 'bot_roll':
+        return ChinchinTemplate(f"🤖 Bot 第{attempt + 1}投目 🤖", "⚙️ **AIが計算中...サイコロが回転！** ⚙️", 0xff4500, (
+            _field("👤 あなたの最終結果", f"**{hand.name}**", True),
+            _field("🤖 Bot投目", f"{attempt + 1}/3回目", True),
+            _field("⏳ 状況", "AIの運命を決める瞬間...", True),
+        ))
+    if phase == 'bot_result':
+        emoji, color, flavour = _HAND_FLAVOURS.get(hand.kind, _NO_HAND_FLAVOUR)
+        return ChinchinTemplate(f"🤖 Bot 第{attempt + 1}投目の結果！ 🤖", None, color, (
+            ("👤 あなたの結果", 'player', True),
+            _field(f"{emoji} Bot結果", f"**{hand.name}** {flavour}", True),
+            _field("　", "　", True),
+            ("🤖 Botの全結果", 'history', False),
+            _bot_next_field(hand, attempt),
+        ))
+    if phase == 'judge':
+        return ChinchinTemplate("⚡ 運命の判定タイム ⚡", "🎭 **ドキドキの結果発表！** 🎭\n✨ 勝敗を決める瞬間です... ✨", 0xffff00, (
+            ("👤 あなたの最終結果", 'player', True),
+            _field("🆚", "**VS**", True),
+            ("🤖 Botの最終結果", 'bot', True),
+            _field("💰 賭け金", f"{amount:,}Z", True),
+            _field("⏳ 状況", "判定中...", True),
+            _field("🎲 緊張", "MAX!", True),
+        ))
+    if phase == 'result':
+        return ChinchinTemplate(
+            f"{outcome.emoji} 🎊 ちんちろバトル結果発表！ 🎊 {outcome.emoji}",
+            f"🎭 **{outcome.result}** 🎭\n✨ 運命の戦いが決着しました！ ✨",
+            outcome.color,
+            _result_fields(outcome, amount),
+            {'text': "🎊 また挑戦してね！次回も熱い戦いを期待しています 🎊"}
+        )
+    raise ValueError(f"unknown phase: {phase}")
+
+def chinchin_template(phase, amount, hand=None, attempt=0, outcome=None):
+    """(場面, 役, 賭け金) ごとのテンプレートを返す（初回だけ組み立てる）"""
+    key = (phase, amount, hand, attempt, outcome)
+    template = chinchin_templates.get(key)
+    if template is None:
+        if len(chinchin_templates) >= CHINCHIN_TEMPLATE_CACHE_SIZE:
+            chinchin_templates.clear()
+        template = _build_chinchin_template(phase, amount, hand, attempt, outcome)
+        chinchin_templates[key] = template
+    return template
+
+def render_chinchin_template(template, description=None, extra_fields=(), **values):
+    """テンプレートに変化する部分を埋めて Embed を作る（時刻は送信時に render_chinchin_frames が付ける）"""
+    # 固定部分の dict もコピーする（Embed.from_dict はそのまま持つので、共有するとフレームの変更がテンプレートに及ぶ）
+    fields = [
+        dict(field) if isinstance(field, dict) else {'name': field[0], 'value': values[field[1]], 'inline': field[2]}
+        for field in template.fields
+    ]
+    fields.extend(extra_fields)
+    data = {
+        'type': 'rich',
+        'title': template.title,
+        'description': template.description if description is None else description,
+        'color': template.color,
+        'fields': fields
+    }
+    if template.footer:
+        data['footer'] = dict(template.footer)
+    return discord.Embed.from_dict(data)
+
+def _history_text(results):
+    return "\n".join([f"第{i+1}投: {result}" for i, result in enumerate(results)])
+
+# ちんちろゲームの演出フレームを作る（勝敗・精算は済んだ状態で呼ぶ）
+def build_chinchin_frames(user, amount, game, new_balance):
+    """ChinchinFrame のリストを返す（最後のフレームが結果発表）"""
+    frames = []
+    
+    # バトル開始の演出
+    embed = render_chinchin_template(
+        chinchin_template('start', amount),
+        description=f"**{user.mention}** が **{amount:,}Z** を賭けて熱いバトルに挑戦！\n🔥 運命のサイコロが回り始める... 🔥"
     )
-    embed.add_field(name="💰 賭け金", value=f"{amount:,}Z", inline=True)
-    embed.add_field(name="👤 挑戦者", value=interaction.user.display_name, inline=True)
-    embed.add_field(name="🎯 状況", value="最初の挑戦！", inline=True)
+    frames.append(ChinchinFrame(embed, 4, False))
     
-    await safe_edit_message(embed)
-    await asyncio.sleep(3)
+    # プレイヤーのターン開始
+    embed = render_chinchin_template(chinchin_template('player_turn', amount), player=user.display_name)
+    frames.append(ChinchinFrame(embed, 3, False))
     
     # プレイヤーのターン
-    player_hand = None
-    player_power = 0
-    player_dice_history = []
     player_results = []
-    
-    for attempt in range(3):
-        # サイコロを振る演出
-        embed = discord.Embed(
-            title=f"🎲 第{attempt + 1}投目 🎲",
-            description="🌀 **サイコロが転がっています...** 🌀",
-            color=0x00ff00,
-            timestamp=datetime.now()
-        )
-        embed.add_field(name="💰 賭け金", value=f"{amount:,}Z", inline=True)
-        embed.add_field(name="🔄 投目", value=f"{attempt + 1}/3回目", inline=True)
-        embed.add_field(name="⏳ 状況", value="運命を決める瞬間...", inline=True)
-        
-        # 過去の結果を表示
-        if player_results:
-            history_text = "\n".join([f"第{i+1}投: {result}" for i, result in enumerate(player_results)])
-            embed.add_field(name="📊 これまでの結果", value=history_text, inline=False)
-        
-        await safe_edit_message(embed)
-        await asyncio.sleep(3)
-        
-        # サイコロの結果
-        dice = [random.randint(1, 6) for _ in range(3)]
-        player_dice_history.append(dice)
-        hand, power = bot.evaluate_chinchin_dice(dice)
-        
-        # サイコロの絵文字表示
-        dice_emojis = ['⚀', '⚁', '⚂', '⚃', '⚄', '⚅']
-        dice_display = ' '.join([dice_emojis[d-1] for d in dice])
-        
-        # 結果を記録
-        player_results.append(f"{dice_display} → **{hand}**")
+    for attempt, (dice, hand) in enumerate(game.player.rolls):
+        # サイコロを振る演出（過去の結果があれば表示）
+        extra = [_field("📊 これまでの結果", _history_text(player_results), False)] if player_results else ()
+        embed = render_chinchin_template(chinchin_template('player_roll', amount, attempt=attempt), extra_fields=extra)
+        frames.append(ChinchinFrame(embed, 3, True))
         
         # 結果表示
-        embed = discord.Embed(
-            title=f"🎲 第{attempt + 1}投目の結果！ 🎲",
-            description=f"**{dice_display}**\n({dice[0]}, {dice[1]}, {dice[2]})",
-            color=0x00ff00,
-            timestamp=datetime.now()
+        key = pack_dice(*dice)
+        player_results.append(f"{DICE_DISPLAY[key]} → **{hand.name}**")
+        embed = render_chinchin_template(
+            chinchin_template('player_result', amount, hand, attempt),
+            description=DICE_DESCRIPTION[key],
+            history=_history_text(player_results)
         )
-        
-        # 役の結果に応じて色とメッセージを変更
-        if hand == 'ピンゾロ':
-            embed.color = 0xffd700
-            embed.add_field(name="🏆 結果", value=f"**{hand}** ⭐最強役！⭐", inline=False)
-        elif 'シゴロ' in hand:
-            embed.color = 0xff69b4
-            embed.add_field(name="🎉 結果", value=f"**{hand}** 🔥即勝ち役！🔥", inline=False)
-        elif 'ゾロ' in hand:
-            embed.color = 0x9932cc
-            embed.add_field(name="✨ 結果", value=f"**{hand}** 💎強力な役！💎", inline=False)
-        elif '目' in hand:
-            embed.color = 0x32cd32
-            embed.add_field(name="⭐ 結果", value=f"**{hand}** 📈役が出た！📈", inline=False)
-        elif hand == 'ヒフミ':
-            embed.color = 0x8b0000
-            embed.add_field(name="💀 結果", value=f"**{hand}** ⚡即負け役...⚡", inline=False)
-        else:
-            embed.color = 0x696969
-            embed.add_field(name="😐 結果", value=f"**{hand}** 💨まだ役なし💨", inline=False)
-        
-        # これまでの全結果を表示
-        all_results = "\n".join([f"第{i+1}投: {result}" for i, result in enumerate(player_results)])
-        embed.add_field(name="📊 あなたの全結果", value=all_results, inline=False)
-        
-        # 役が出た場合は終了
-        if hand == 'ヒフミ' or '目' in hand or hand == 'ピンゾロ' or 'シゴロ' in hand or (hand not in ['役無し'] and power != 0):
-            player_hand = hand
-            player_power = power
-            
-            if hand == 'ヒフミ':
-                embed.add_field(name="⚡ 次の展開", value="即負け役が出ました！\n🤖 **Botのターンへ！**", inline=False)
-            elif 'シゴロ' in hand:
-                embed.add_field(name="🔥 次の展開", value="シゴロ！即勝ち役です！\n🤖 **Botのターンで逆転なるか？**", inline=False)
-            elif hand == 'ピンゾロ':
-                embed.add_field(name="👑 次の展開", value="最強役ピンゾロ！\n🤖 **Botに勝ち目はあるのか？**", inline=False)
-            else:
-                embed.add_field(name="✨ 次の展開", value="役が確定しました！\n🤖 **Botの反撃が始まる！**", inline=False)
-            
-            await safe_edit_message(embed)
-            await asyncio.sleep(4)
-            break
-        else:
-            if attempt < 2:
-                embed.add_field(name="🔄 次の展開", value=f"役なし...まだ**{2-attempt}回**チャンスがあります！\n⏳ **次の投げで運命が決まる！**", inline=False)
-                await safe_edit_message(embed)
-                await asyncio.sleep(4)
-            else:
-                player_hand = hand
-                player_power = power
-                embed.add_field(name="😓 結果", value="3回振っても役なし...\n🤖 **Botのターンです！**", inline=False)
-                await safe_edit_message(embed)
-                await asyncio.sleep(4)
+        frames.append(ChinchinFrame(embed, 4, False))
+    
+    player_hand = game.player.hand
+    player_final = f"**{player_hand.name}**\n{dice_display(game.player.rolls[-1][0])}"
     
     # Botのターン開始演出
-    embed = discord.Embed(
-        title="🤖✨ Botのターン開始！ ✨🤖",
-        description="🔥 **AIが反撃開始！** 🔥\n⚡ 人工知能の運命やいかに... ⚡",
-        color=0xff4500,
-        timestamp=datetime.now()
+    embed = render_chinchin_template(
+        chinchin_template('bot_turn', amount),
+        player=f"**{player_hand.name}**\n🎲 {dice_display(game.player.rolls[-1][0])}"
     )
-    embed.add_field(name="👤 あなたの最終結果", value=f"**{player_hand}**\n🎲 {' '.join([['⚀', '⚁', '⚂', '⚃', '⚄', '⚅'][d-1] for d in player_dice_history[-1]])}", inline=False)
-    embed.add_field(name="🎯 Botの目標", value="あなたの役を上回れ！", inline=True)
-    embed.add_field(name="⚔️ 戦況", value="激戦必至！", inline=True)
-    
-    await safe_edit_message(embed)
-    await asyncio.sleep(4)
+    frames.append(ChinchinFrame(embed, 4, False))
     
     # Botのターン
-    bot_hand = None
-    bot_power = 0
-    bot_dice_history = []
     bot_results = []
-    
-    for attempt in range(3):
-        # サイコロを振る演出
-        embed = discord.Embed(
-            title=f"🤖 Bot 第{attempt + 1}投目 🤖",
-            description="⚙️ **AIが計算中...サイコロが回転！** ⚙️",
-            color=0xff4500,
-            timestamp=datetime.now()
-        )
-        
-        # プレイヤーの結果を常に表示
-        embed.add_field(name="👤 あなたの最終結果", value=f"**{player_hand}**", inline=True)
-        embed.add_field(name="🤖 Bot投目", value=f"{attempt + 1}/3回目", inline=True)
-        embed.add_field(name="⏳ 状況", value="AIの運命を決める瞬間...", inline=True)
-        
-        # Botの過去の結果を表示
-        if bot_results:
-            bot_history = "\n".join([f"第{i+1}投: {result}" for i, result in enumerate(bot_results)])
-            embed.add_field(name="🤖 Botのこれまでの結果", value=bot_history, inline=False)
-        
-        await safe_edit_message(embed)
-        await asyncio.sleep(3)
-        
-        # サイコロの結果
-        dice = [random.randint(1, 6) for _ in range(3)]
-        bot_dice_history.append(dice)
-        hand, power = bot.evaluate_chinchin_dice(dice)
-        
-        # サイコロの絵文字表示
-        dice_emojis = ['⚀', '⚁', '⚂', '⚃', '⚄', '⚅']
-        dice_display = ' '.join([dice_emojis[d-1] for d in dice])
-        
-        # 結果を記録
-        bot_results.append(f"{dice_display} → **{hand}**")
+    for attempt, (dice, hand) in enumerate(game.bot.rolls):
+        # サイコロを振る演出（Botの過去の結果があれば表示）
+        extra = [_field("🤖 Botのこれまでの結果", _history_text(bot_results), False)] if bot_results else ()
+        embed = render_chinchin_template(chinchin_template('bot_roll', amount, player_hand, attempt), extra_fields=extra)
+        frames.append(ChinchinFrame(embed, 3, True))
         
         # 結果表示
-        embed = discord.Embed(
-            title=f"🤖 Bot 第{attempt + 1}投目の結果！ 🤖",
-            description=f"**{dice_display}**\n({dice[0]}, {dice[1]}, {dice[2]})",
-            color=0xff4500,
-            timestamp=datetime.now()
+        key = pack_dice(*dice)
+        bot_results.append(f"{DICE_DISPLAY[key]} → **{hand.name}**")
+        embed = render_chinchin_template(
+            chinchin_template('bot_result', amount, hand, attempt),
+            description=DICE_DESCRIPTION[key],
+            player=player_final,
+            history=_history_text(bot_results)
         )
-        
-        # プレイヤーの結果を比較表示
-        player_dice_display = ' '.join([['⚀', '⚁', '⚂', '⚃', '⚄', '⚅'][d-1] for d in player_dice_history[-1]])
-        embed.add_field(name="👤 あなたの結果", value=f"**{player_hand}**\n{player_dice_display}", inline=True)
-        
-        # Botの役の結果に応じて色とメッセージを変更
-        if hand == 'ピンゾロ':
-            embed.color = 0xffd700
-            embed.add_field(name="🏆 Bot結果", value=f"**{hand}** ⭐最強役！⭐", inline=True)
-        elif 'シゴロ' in hand:
-            embed.color = 0xff69b4
-            embed.add_field(name="🎉 Bot結果", value=f"**{hand}** 🔥即勝ち役！🔥", inline=True)
-        elif 'ゾロ' in hand:
-            embed.color = 0x9932cc
-            embed.add_field(name="✨ Bot結果", value=f"**{hand}** 💎強力な役！💎", inline=True)
-        elif '目' in hand:
-            embed.color = 0x32cd32
-            embed.add_field(name="⭐ Bot結果", value=f"**{hand}** 📈役が出た！📈", inline=True)
-        elif hand == 'ヒフミ':
-            embed.color = 0x8b0000
-            embed.add_field(name="💀 Bot結果", value=f"**{hand}** ⚡即負け役...⚡", inline=True)
-        else:
-            embed.color = 0x696969
-            embed.add_field(name="😐 Bot結果", value=f"**{hand}** 💨まだ役なし💨", inline=True)
-        
-        # 空白調整
-        embed.add_field(name="　", value="　", inline=True)
-        
-        # Botの全結果を表示
-        all_bot_results = "\n".join([f"第{i+1}投: {result}" for i, result in enumerate(bot_results)])
-        embed.add_field(name="🤖 Botの全結果", value=all_bot_results, inline=False)
-        
-        # 役が出た場合は終了
-        if hand == 'ヒフミ' or '目' in hand or hand == 'ピンゾロ' or 'シゴロ' in hand or (hand not in ['役無し'] and power != 0):
-            bot_hand = hand
-            bot_power = power
+        frames.append(ChinchinFrame(embed, 4, False))
+    
+    bot_final = f"**{game.bot.hand.name}**\n{dice_display(game.bot.rolls[-1][0])}"
+    
+    # 勝敗判定の演出
+    embed = render_chinchin_template(chinchin_template('judge', amount), player=player_final, bot=bot_final)
+    frames.append(ChinchinFrame(embed, 9, False))
+    
+    # 結果表示（勝敗は事前に決定済み）
+    embed = render_chinchin_template(
+        chinchin_template('result', amount, outcome=game.outcome),
+        player=player_final,
+        bot=bot_final,
+        balance=f"**{new_balance:,}Z**"
+    )
+    embed.set_author(name=f"🎲 {user.display_name} のちんちろバトル", icon_url=user.avatar.url if user.avatar else None)
+    frames.append(ChinchinFrame(embed, 0, False))
+    return frames
+
+def chinchin_animation_mode():
+    """今回の演出モード（同時進行中のゲームが多い時は自動的に短縮する）"""
+    if CHINCHIN_ANIMATION == 'full' and len(active_chinchin_renders) >= CHINCHIN_ANIMATION_MAX_ACTIVE:
+        return 'compact'
+    return CHINCHIN_ANIMATION
+
+# ちんちろゲーム本体の処理
+async def play_chinchin_game(interaction: discord.Interaction, amount: int, session: GameSession):
+    global bot  # botインスタンスをグローバルに使用
+    
+    # 勝敗と精算を先に済ませ、演出は結果の再生だけにする
+    game = play_game()
+    winnings = amount * game.outcome.multiplier
+    async with bot.lock_users(interaction.user.id):
+        new_balance = bot.update_balance(interaction.user.id, winnings, 'chinchin')
+        bot.game_sessions.settle(session)
+        await bot.commit()
+    chinchin_games.inc(result=game.outcome.result)
+    
+    frames = build_chinchin_frames(interaction.user, amount, game, new_balance)
+    await render_chinchin_frames(interaction, frames)
+
+async def render_chinchin_frames(interaction: discord.Interaction, frames):
+    """演出フレームを順に表示する（遅れている時や混雑時は途中の演出を飛ばす）"""
+    mode = chinchin_animation_mode()
+    if mode == 'off':
+        frames = frames[-1:]
+    elif mode == 'compact':
+        # 「サイコロが転がっています」系のフレームを除き、間隔も詰める
+        frames = [frame._replace(delay=min(frame.delay, CHINCHIN_COMPACT_DELAY)) for frame in frames if not frame.skippable]
+    
+    task = asyncio.current_task()
+    active_chinchin_renders.add(task)
+    try:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        for index, frame in enumerate(frames):
+            is_last = index == len(frames) - 1
+            # 予定より遅れていて、次のフレームの時刻も過ぎているなら飛ばせるものは飛ばす
+            if not is_last and frame.skippable and loop.time() > deadline + frame.delay:
+                deadline += frame.delay
+                continue
+            
+            # 時刻は表示する時点のもの
+            frame.embed.timestamp = datetime.now().astimezone()
             
-            if hand == 'ヒフミ':
-                embed.add_field(name="⚡ 展開", value="Botが即負け役を出しました！\n🎊 **勝敗判定へ！**", inline=False)
-            elif 'シゴロ' in hand:
-                embed.add_field(name="🔥 展開", value="Botがシゴロを出しました！\n⚔️ **最終決戦！**", inline=False)
-            elif hand == 'ピンゾロ':
-                embed.add_field(name="👑 展開", value="Botが最強役を出しました！\n💥 **究極の対決！**", inline=False)
+            # インタラクションが既に応答済みかどうかをチェック
+            if index == 0 and not interaction.response.is_done():
+                await interaction.response.edit_message(embed=frame.embed, view=None)
+            elif is_last:
+                # 結果発表だけは確実に届くまで待つ
+                await bot.edit_scheduler.edit(interaction, frame.embed)
             else:
-                embed.add_field(name="✨ 展開", value="Botも役が確定！\n🎭 **運命の判定タイム！**", inline=False)
+                # 途中のフレームは予約だけ。送信が詰まっていれば新しいフレームに置き換わる
+                bot.edit_scheduler.submit(interaction, frame.embed)
             
-            await safe_edit_message(embed)
-            await asyncio.sleep(4)
-            break
+            if not is_last:
+                deadline += frame.delay
+                await asyncio.sleep(max(0, deadline - loop.time()))
+    finally:
+        active_chinchin_renders.discard(task)
+        bot.edit_scheduler.forget(interaction)
+
+# スラッシュコマンド: プロファイル
+@bot.tree.command(name="プロファイル", description="管理者専用：稼働中の処理を指定秒数だけ計測し、時間のかかっている関数を表示")
+@app_commands.describe(seconds="計測する秒数", mode="計測方式", top="表示する関数の数（最大30）")
+@app_commands.choices(mode=[
+    app_commands.Choice(name="サンプリング（軽い・collapsed 形式）", value="sampling"),
+    app_commands.Choice(name="cProfile（正確・pstats 形式）", value="cprofile")
+])
+@timed_command
+async def profile_slash(interaction: discord.Interaction, seconds: int = 30, mode: str = "sampling", top: int = 15):
+    if not bot.is_admin(interaction.user.id):
+        await interaction.response.send_message("❌ この機能を使用する権限がありません", ephemeral=True)
+        return
+    
+    if not 1 <= seconds <= PROFILE_MAX_SECONDS:
+        await interaction.response.send_message(f"❌ 計測時間は1〜{PROFILE_MAX_SECONDS}秒で指定してください", ephemeral=True)
+        return
+    
+    if bot.profiling:
+        await interaction.response.send_message(f"❌ 別のプロファイル（{bot.profiling}）を計測中です", ephemeral=True)
+        return
+    
+    top = max(1, min(top, 30))
+    bot.profiling = mode
+    try:
+        await interaction.response.send_message(f"⏱️ {seconds}秒間計測しています（{mode}）...", ephemeral=True)
+        
+        # イベントループのスレッドで動いている処理（全コマンド・演出・ログ送信など）が対象
+        if mode == "cprofile":
+            capture = ProfileCapture()
         else:
-            if attempt < 2:
-                embed.add_field(name="🔄 展開", value=f"Botも役なし...まだ**{2-attempt}回**残っています！\n🎲 **AIの逆転なるか？**", inline=False)
-                await safe_edit_message(embed)
-                await asyncio.sleep(4)
+            capture = StackSampler(threading.get_ident())
+        started = time.perf_counter()
+        capture.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            capture.stop()
+        elapsed = time.perf_counter() - started
+        
+        # 保存と集計はループを止めないよう別スレッドで行う
+        path = output_path(PROFILE_DIR, mode)
+        def write():
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            if mode == "cprofile":
+                capture.write_pstats(path)
             else:
-                bot_hand = hand
-                bot_power = power
-                embed.add_field(name="😓 結果", value="Botも3回振って役なし...\n🎊 **ついに勝敗判定！**", inline=False)
-                await safe_edit_message(embed)
-                await asyncio.sleep(4)
+                capture.write_collapsed(path)
+            return capture.summary(top)
+        summary = await asyncio.to_thread(write)
+    finally:
+        bot.profiling = None
     
-    # 勝敗判定の演出
     embed = discord.Embed(
-        title="⚡ 運命の判定タイム ⚡",
-        description="🎭 **ドキドキの結果発表！** 🎭\n✨ 勝敗を決める瞬間です... ✨",
-        color=0xffff00,
+        title="⏱️ プロファイル結果",
+        description=f"```\n{summary[:3900]}\n```",
+        color=0x0099ff,
         timestamp=datetime.now()
     )
+    embed.add_field(name="計測時間", value=f"{elapsed:.1f}秒", inline=True)
+    embed.add_field(name="方式", value=mode, inline=True)
+    if mode == "sampling":
+        embed.add_field(name="サンプル数", value=f"{capture.samples:,}", inline=True)
+    embed.add_field(name="保存先", value=f"`{path}`", inline=False)
+    embed.set_footer(text=f"管理者: {interaction.user.display_name}")
     
-    # 両者の最終結果を美しく表示
-    player_final_dice = ' '.join([['⚀', '⚁', '⚂', '⚃', '⚄', '⚅'][d-1] for d in player_dice_history[-1]])
-    bot_final_dice = ' '.join([['⚀', '⚁', '⚂', '⚃', '⚄', '⚅'][d-1] for d in bot_dice_history[-1]])
-    
-    embed.add_field(name="👤 あなたの最終結果", value=f"**{player_hand}**\n{player_final_dice}", inline=True)
-    embed.add_field(name="🆚", value="**VS**", inline=True)
-    embed.add_field(name="🤖 Botの最終結果", value=f"**{bot_hand}**\n{bot_final_dice}", inline=True)
-    embed.add_field(name="💰 賭け金", value=f"{amount:,}Z", inline=True)
-    embed.add_field(name="⏳ 状況", value="判定中...", inline=True)
-    embed.add_field(name="🎲 緊張", value="MAX!", inline=True)
-    
-    await safe_edit_message(embed)
-    await asyncio.sleep(5)
-    
-    await asyncio.sleep(4)
-    
-    # 勝敗判定（表に基づく）
-    player_is_instant_lose = player_hand == 'ヒフミ'
-    bot_is_instant_lose = bot_hand == 'ヒフミ'
-    player_is_shigoro = 'シゴロ' in player_hand
-    bot_is_shigoro = 'シゴロ' in bot_hand
-    
-    if player_is_instant_lose and bot_is_instant_lose:
-        # 両方即負け → 引き分け
-        result = "引き分け"
-        winnings = 0
-        color = 0xffff00
-        result_emoji = "🤝"
-    elif player_is_instant_lose:
-        # プレイヤーのみ即負け → 敗北
-        result = "敗北"
-        winnings = -amount * 2  # ヒフミは2倍払う
-        color = 0xff0000
-        result_emoji = "😢"
-    elif bot_is_instant_lose:
-        # Botのみ即負け → 勝利
-        result = "勝利"
-        winnings = amount * 2  # ヒフミは2倍もらう
-        color = 0x00ff00
-        result_emoji = "🎉"
-    elif player_is_shigoro and bot_is_shigoro:
-        # 両方シゴロ → 引き分け
-        result = "引き分け"
-        winnings = 0
-        color = 0xffff00
-        result_emoji = "🤝"
-    elif player_is_shigoro:
-        # プレイヤーのみシゴロ → 勝利
-        result = "勝利"
-        winnings = amount * 2  # シゴロは2倍もらう
-        color = 0x00ff00
-        result_emoji = "🎉"
-    elif bot_is_shigoro:
-        # Botのみシゴロ → 敗北
-        result = "敗北"
-        winnings = -amount * 2  # シゴロは2倍払う
-        color = 0xff0000
-        result_emoji = "😢"
-    else:
-        # 通常の勝負（役の強さで比較）
-        if player_hand == 'ピンゾロ' and bot_hand != 'ピンゾロ':
-            # プレイヤーがピンゾロ → 5倍もらう
-            result = "勝利"
-            winnings = amount * 5
-            color = 0xffd700
-            result_emoji = "🏆"
-        elif bot_hand == 'ピンゾロ' and player_hand != 'ピンゾロ':
-            # Botがピンゾロ → 5倍払う
-            result = "敗北"
-            winnings = -amount * 5
-            color = 0xff0000
-            result_emoji = "😱"
-        elif '目' in player_hand and '目' in bot_hand:
-            # 両方通常の目 → 目の数で比較
-            player_num = int(player_hand[0])
-            bot_num = int(bot_hand[0])
-            if player_num > bot_num:
-                result = "勝利"
-                winnings = amount
-                color = 0x00ff00
-                result_emoji = "🎉"
-            elif player_num < bot_num:
-                result = "敗北"
-                winnings = -amount
-                color = 0xff0000
-                result_emoji = "😢"
-            else:
-                result = "引き分け"
-                winnings = 0
-                color = 0xffff00
-                result_emoji = "🤝"
-        elif '目' in player_hand and player_hand != '役無し':
-            # プレイヤーに目があり、Botが役無し
-            result = "勝利"
-            winnings = amount
-            color = 0x00ff00
-            result_emoji = "🎉"
-        elif '目' in bot_hand and bot_hand != '役無し':
-            # Botに目があり、プレイヤーが役無し
-            result = "敗北"
-            winnings = -amount
-            color = 0xff0000
-            result_emoji = "😢"
-        elif 'ゾロ' in player_hand and 'ゾロ' not in bot_hand:
-            # プレイヤーのみゾロ目 → 3倍もらう
-            result = "勝利"
-            winnings = amount * 3
-            color = 0x00ff00
-            result_emoji = "🎉"
-        elif 'ゾロ' in bot_hand and 'ゾロ' not in player_hand:
-            # Botのみゾロ目 → 3倍払う
-            result = "敗北"
-            winnings = -amount * 3
-            color = 0xff0000
-            result_emoji = "😢"
-        else:
-            # 両方役無し → 引き分け
-            result = "引き分け"
-            winnings = 0
-            color = 0xffff00
-            result_emoji = "🤝"
-    
-    # 残高更新
-    new_balance = bot.update_balance(interaction.user.id, winnings, 'chinchin')
+    # 結果のファイルも添付する（大きすぎる場合は保存先だけ）
+    files = []
+    if os.path.getsize(path) <= 8 * 1024 * 1024:
+        files.append(discord.File(path))
+    await interaction.followup.send(embed=embed, files=files, ephemeral=True)
     
-    # 結果表示
-    embed = discord.Embed(
-        title=f"{result_emoji} 🎊 ちんちろバトル結果発表！ 🎊 {result_emoji}",
-        description=f"🎭 **{result}** 🎭\n✨ 運命の戦いが決着しました！ ✨",
-        color=color,
+    # ログチャンネルにも送信
+    log_embed = discord.Embed(
+        title="⏱️ プロファイル取得ログ",
+        description="管理者がプロファイルを取得しました",
+        color=0x0099ff,
         timestamp=datetime.now()
     )
-    
-    # 勝敗結果を大きく表示
-    if result == "勝利":
-        embed.add_field(name="🏆 結果", value=f"**🎉 {result} 🎉**", inline=False)
-    elif result == "敗北":
-        embed.add_field(name="💔 結果", value=f"**😢 {result} 😢**", inline=False)
-    else:
-        embed.add_field(name="🤝 結果", value=f"**🤝 {result} 🤝**", inline=False)
-    
-    # 詳細結果
-    player_final_dice = ' '.join([['⚀', '⚁', '⚂', '⚃', '⚄', '⚅'][d-1] for d in player_dice_history[-1]])
-    bot_final_dice = ' '.join([['⚀', '⚁', '⚂', '⚃', '⚄', '⚅'][d-1] for d in bot_dice_history[-1]])
-    
-    embed.add_field(name="👤 あなたの役", value=f"**{player_hand}**\n{player_final_dice}", inline=True)
-    embed.add_field(name="🤖 Botの役", value=f"**{bot_hand}**\n{bot_final_dice}", inline=True)
-    
-    # 勝敗による絵文字
-    if result == "勝利":
-        embed.add_field(name="⚔️ 勝敗", value="🏆 **勝利！** 🏆", inline=True)
-    elif result == "敗北":
-        embed.add_field(name="⚔️ 勝敗", value="💀 **敗北...** 💀", inline=True)
-    else:
-        embed.add_field(name="⚔️ 勝敗", value="🤝 **引き分け** 🤝", inline=True)
-    
-    embed.add_field(name="💰 賭け金", value=f"{amount:,}Z", inline=True)
-    
-    # 獲得/損失の表示
-    if winnings > 0:
-        embed.add_field(name="💎 獲得", value=f"**+{winnings:,}Z** 🎉", inline=True)
-    elif winnings < 0:
-        embed.add_field(name="💸 損失", value=f"**{winnings:,}Z** 😢", inline=True)
-    else:
-        embed.add_field(name="💫 増減", value="**±0Z** 🤝", inline=True)
-    
-    embed.add_field(name="🏦 現在の残高", value=f"**{new_balance:,}Z**", inline=True)
-    
-    # 配当説明
-    if abs(winnings) > amount:
-        multiplier = abs(winnings) // amount
-        if multiplier >= 5:
-            embed.add_field(name="🏆 配当", value=f"**{multiplier}倍** ⭐超大当たり⭐", inline=False)
-        elif multiplier >= 3:
-            embed.add_field(name="✨ 配当", value=f"**{multiplier}倍** 💎大当たり💎", inline=False)
-        else:
-            embed.add_field(name="🎉 配当", value=f"**{multiplier}倍** 🎊当たり🎊", inline=False)
-    
-    # 特別メッセージ
-    if result == "勝利":
-        if winnings >= amount * 5:
-            embed.add_field(name="🌟 特別メッセージ", value="🎆 **伝説級の大勝利！** 🎆\n✨ あなたは真のちんちろマスター！ ✨", inline=False)
-        elif winnings >= amount * 3:
-            embed.add_field(name="🎉 特別メッセージ", value="🔥 **素晴らしい勝利！** 🔥\n⭐ 運が味方についています！ ⭐", inline=False)
-        else:
-            embed.add_field(name="😊 特別メッセージ", value="🎊 **ナイス勝利！** 🎊\n👍 調子が良いですね！ 👍", inline=False)
-    elif result == "敗北":
-        embed.add_field(name="💪 特別メッセージ", value="😤 **次こそリベンジ！** 😤\n🔥 諦めずに挑戦しよう！ 🔥", inline=False)
-    else:
-        embed.add_field(name="🤝 特別メッセージ", value="⚡ **互角の戦い！** ⚡\n🎲 次の勝負で決着をつけよう！ 🎲", inline=False)
-    
-    embed.set_author(name=f"🎲 {interaction.user.display_name} のちんちろバトル", icon_url=interaction.user.avatar.url if interaction.user.avatar else None)
-    embed.set_footer(text="🎊 また挑戦してね！次回も熱い戦いを期待しています 🎊")
-    await safe_edit_message(embed)
+    log_embed.add_field(name="管理者", value=f"{interaction.user.mention} ({interaction.user.display_name})", inline=True)
+    log_embed.add_field(name="方式", value=mode, inline=True)
+    log_embed.add_field(name="計測時間", value=f"{elapsed:.1f}秒", inline=True)
+    log_embed.add_field(name="保存先", value=f"`{path}`", inline=False)
+    await bot.send_log(log_embed)
 
 # スラッシュコマンド: ヘルプ
 @bot.tree.command(name="ヘルプ", description="Z通貨Botの使い方を表示")
+@timed_command
 async def help_slash(interaction: discord.Interaction):
     embed = discord.Embed(
         title="🤖 Z通貨Bot ヘルプ",
@@ -1102,6 +2228,8 @@ async def help_slash(interaction: discord.Interaction):
     user_commands = """
     `/残高確認` - 自分の残高を確認
     `/送金 <ユーザー> <金額>` - 他のユーザーに送金
+    `/ランキング [種類] [人数]` - 残高・ちんちろ収支のランキング
+    `/履歴 [種類] [開始日] [終了日]` - 取引履歴を表示
     `/ちんちろ <金額>` - ちんちろバトルで勝負
     """
     
@@ -1111,9 +2239,11 @@ async def help_slash(interaction: discord.Interaction):
     if bot.is_admin(interaction.user.id):
         admin_commands = """
         `/残高確認 <ユーザー>` - 他ユーザーの残高確認
+        `/履歴 <ユーザー>` - 他ユーザーの取引履歴
         `/発行 <ユーザー> <金額>` - 通貨を発行
         `/減少 <ユーザー> <金額>` - 通貨を減少
         `/ロール発行 <ロール> <金額>` - ロール一括発行
+        `/プロファイル [秒数] [方式]` - 稼働中の処理の計測
         """
         embed.add_field(name="🛡️ 管理者専用コマンド", value=admin_commands, inline=False)
     
@@ -1172,4 +2302,5 @@ if __name__ == "__main__":
         print("=" * 50)
     else:
         print("🤖 Z通貨Bot 起動中...")
-        bot.run(TOKEN)
+        # ログの出力先は起動時に設定済み
+        bot.run(TOKEN, log_handler=None)
@@ -0,0 +1,380 @@
+"""台帳・ちんちろのホットパスのベンチマーク
+
+合成した台帳（ユーザー数 1万 / 10万 / 100万 と直近の取引履歴）を一時ディレクトリに用意し、
+Discord に接続せずに Zerobot の処理を直接呼んで計測する。
+結果は JSON で出力するので、コミット間で --compare して比べられる。
+
+    python benchmark.py                                  # 1万・10万ユーザー
+    python benchmark.py --sizes 10k,100k,1m --output after.json
+    python benchmark.py --backend sqlite --only save_data,load_data
+    python benchmark.py --compare before.json after.json # 10% 以上遅くなったものがあれば終了コード 1
+
+計測対象: update_balance / transfer_currency / save_data / load_data /
+evaluate_chinchin_dice / role_issue_slash
+"""
+import argparse
+import asyncio
+import contextlib
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from fake_discord import FakeInteraction, FakeRole, FakeUser, RestSimulator
+from storage import UserAccount, add_to_stats, new_stats
+
+BENCHMARKS = ('update_balance', 'transfer_currency', 'save_data', 'load_data', 'evaluate_chinchin_dice', 'role_issue_slash')
+DEFAULT_SIZES = '10k,100k'
+# 合成する取引の種別
+TRANSACTION_TYPES = ('chinchin', 'transfer_in', 'transfer_out', 'role_issue', 'admin_issue', 'admin_reduce')
+# 合成ユーザーのIDの始まり（Discord のスノーフレークと同じ桁数にする）
+USER_ID_BASE = 300_000_000_000_000_000
+
+
+def parse_size(text):
+    """'10k' / '1m' / '5000' → 整数"""
+    text = text.strip().lower()
+    scale = {'k': 1_000, 'm': 1_000_000}.get(text[-1:], 1)
+    return int(float(text[:-1] if scale > 1 else text) * scale)
+
+
+def user_id(index):
+    return str(USER_ID_BASE + index)
+
+
+def generate_users(count, seed=0):
+    """count 人分の UserAccount（ID → アカウント）"""
+    rng = random.Random(seed)
+    # 参加日時は直近1年に散らす（エポックからのマイクロ秒）
+    now = int(time.time() * 1_000_000)
+    year = 365 * 24 * 3600 * 1_000_000
+    users = {}
+    for index in range(count):
+        earned = rng.randrange(0, 500_000)
+        spent = rng.randrange(0, earned + 1)
+        users[user_id(index)] = UserAccount(earned - spent, earned, spent, now - rng.randrange(year))
+    return users
+
+
+def generate_transactions(users, count, seed=0):
+    """直近 count 件の取引（古い順、連番付き）"""
+    rng = random.Random(seed)
+    user_ids = list(users)
+    started = datetime.now().timestamp() - count
+    transactions = []
+    for seq in range(1, count + 1):
+        transaction_type = rng.choice(TRANSACTION_TYPES)
+        amount = rng.choice((1000, 5000, 10000)) * rng.choice((1, -1, 2, -2))
+        if transaction_type in ('transfer_in', 'role_issue', 'admin_issue'):
+            amount = abs(amount)
+        elif transaction_type in ('transfer_out', 'admin_reduce'):
+            amount = -abs(amount)
+        transactions.append({
+            'user_id': rng.choice(user_ids),
+            'amount': amount,
+            'type': transaction_type,
+            # 1秒に1件のペースで並べる
+            'timestamp': datetime.fromtimestamp(started + seq).isoformat(),
+            'seq': seq
+        })
+    return transactions
+
+
+def generate_ledger(users, transactions, seed=0):
+    """Bot の self.data と同じ形の合成台帳"""
+    accounts = generate_users(users, seed)
+    history = generate_transactions(accounts, transactions, seed + 1)
+    stats = new_stats()
+    for transaction in history:
+        add_to_stats(stats, transaction['user_id'], transaction['amount'], transaction['type'])
+    return {'users': accounts, 'transactions': history, 'stats': stats, 'journal_seq': len(history)}
+
+
+class Runner:
+    """Zerobot を一時ディレクトリで読み込み、合成台帳を載せて計測する"""
+
+    def __init__(self, workdir, backend, repeat, seed):
+        self.workdir = workdir
+        self.repeat = repeat
+        self.seed = seed
+        os.chdir(workdir)
+        os.environ['STORAGE_BACKEND'] = backend
+        # 計測中にログチャンネルや動作指標のサーバーを使わない
+        os.environ['METRICS_PORT'] = '0'
+        import Zerobot
+        self.zerobot = Zerobot
+        self.bot = Zerobot.bot
+        self.admin = FakeUser(1)
+        # 応答は記録するだけ（遅延・レート制限なし）
+        self.rest = RestSimulator(route_limit=None, global_limit=None)
+        Zerobot.ADMIN_USER_IDS.append(self.admin.id)
+        Zerobot.LOG_CHANNEL_ID = 1
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def close(self):
+        self.loop.run_until_complete(self.bot.close())
+        self.loop.close()
+
+    def load(self, name, ledger):
+        """空のディレクトリに合成台帳を書き、Bot の起動時と同じ手順で読み込む"""
+        Z = self.zerobot
+        bot = self.bot
+        os.chdir(self.workdir)
+        os.makedirs(name)
+        os.chdir(name)
+        # 保存先のパスは相対パスなので、作り直せば新しいディレクトリを使う
+        bot.storage.close()
+        bot.storage = Z.create_storage(
+            Z.STORAGE_BACKEND, Z.DATA_FILE, Z.JOURNAL_FILE, Z.SQLITE_FILE,
+            initial_balance=Z.INITIAL_BALANCE, compact_bytes=Z.JOURNAL_COMPACT_BYTES,
+            archive_dir=Z.ARCHIVE_DIR, transaction_window=Z.TRANSACTION_WINDOW,
+            snapshot_file=Z.SNAPSHOT_FILE, snapshot_format=Z.SNAPSHOT_FORMAT
+        )
+        # JSON の保存先に書いておけば、SQLite はそこから移行して読み込む
+        json_storage = getattr(bot.storage, 'migrate_from', None) or bot.storage
+        json_storage.compact(ledger, [])
+        bot._journal_buffer = []
+        self.loop.run_until_complete(bot.load_ledger())
+
+    def measure(self, name, users, func, number, setup=None):
+        """func(number) を repeat 回実行し、1操作あたりの時間を集計する"""
+        samples = []
+        for _ in range(self.repeat):
+            if setup:
+                setup()
+            gc.collect()
+            started = time.perf_counter()
+            func(number)
+            samples.append((time.perf_counter() - started) / number)
+        median = statistics.median(samples)
+        result = {
+            'name': name,
+            'users': users,
+            'number': number,
+            'repeat': self.repeat,
+            'median_seconds': median,
+            'min_seconds': min(samples),
+            'max_seconds': max(samples),
+            'ops_per_second': 1 / median if median else None,
+        }
+        print(f"  {name:<24} {median * 1e6:12.2f} µs/op  ({result['ops_per_second']:,.1f} ops/s)", file=sys.stderr)
+        return result
+
+    def run(self, name, users):
+        return getattr(self, f"bench_{name}")(users)
+
+    def _random_user_ids(self, users, count):
+        rng = random.Random(self.seed)
+        return [user_id(rng.randrange(users)) for _ in range(count)]
+
+    def bench_update_balance(self, users):
+        bot = self.bot
+        targets = self._random_user_ids(users, 20_000)
+        types = [TRANSACTION_TYPES[i % len(TRANSACTION_TYPES)] for i in range(len(targets))]
+
+        def run(number):
+            for index, (target, transaction_type) in enumerate(zip(targets[:number], types)):
+                bot.update_balance(target, 1000 if index % 2 else -1000, transaction_type)
+
+        # 溜まったジャーナルは書かずに捨てる（書き込みは transfer_currency で測る）
+        return self.measure('update_balance', users, run, len(targets), setup=lambda: bot._journal_buffer.clear())
+
+    def bench_transfer_currency(self, users):
+        bot = self.bot
+        senders = self._random_user_ids(users, 2_000)
+        receivers = senders[1:] + senders[:1]
+
+        def run(number):
+            # 同時に送金が来た時と同じように並行に実行する（グループコミットで fsync がまとまる）
+            async def transfer_all():
+                await asyncio.gather(*(
+                    bot.transfer_currency(sender, receiver, 1) for sender, receiver in zip(senders[:number], receivers)
+                ))
+            self.loop.run_until_complete(transfer_all())
+
+        return self.measure('transfer_currency', users, run, len(senders))
+
+    def bench_save_data(self, users):
+        bot = self.bot
+        save_bytes = self.zerobot.save_bytes
+        results = []
+        formats = ('binary', 'json') if bot.storage.name == 'json' else (None,)
+        for snapshot_format in formats:
+            if snapshot_format:
+                bot.storage.snapshot_format = snapshot_format
+
+            def run(number):
+                for _ in range(number):
+                    self.loop.run_until_complete(bot.save_data())
+
+            name = f"save_data[{snapshot_format}]" if snapshot_format else 'save_data'
+            written = save_bytes.get(backend=bot.storage.name)
+            result = self.measure(name, users, run, 1)
+            # 1回の保存で書き出したバイト数（動作指標の save_bytes_total から）
+            result['bytes_written'] = (save_bytes.get(backend=bot.storage.name) - written) // self.repeat
+            results.append(result)
+        return results
+
+    def bench_load_data(self, users):
+        bot = self.bot
+        results = []
+        formats = ('binary', 'json') if bot.storage.name == 'json' else (None,)
+        for snapshot_format in formats:
+            if snapshot_format:
+                # 読み込む形式のスナップショットを書いてから計測する
+                bot.storage.snapshot_format = snapshot_format
+                self.loop.run_until_complete(bot.save_data())
+
+            def run(number):
+                for _ in range(number):
+                    bot.load_data()
+
+            name = f"load_data[{snapshot_format}]" if snapshot_format else 'load_data'
+            results.append(self.measure(name, users, run, 1))
+        return results
+
+    def bench_evaluate_chinchin_dice(self, users):
+        rng = random.Random(self.seed)
+        rolls = [[rng.randint(1, 6) for _ in range(3)] for _ in range(100_000)]
+        evaluate = self.bot.evaluate_chinchin_dice
+
+        def run(number):
+            for dice in rolls[:number]:
+                evaluate(dice)
+
+        return self.measure('evaluate_chinchin_dice', None, run, len(rolls))
+
+    def bench_role_issue_slash(self, users):
+        members = [FakeUser(USER_ID_BASE + index) for index in range(users)]
+        role = FakeRole(members, name="benchmark")
+        callback = self.zerobot.role_issue_slash.callback
+
+        def run(number):
+            for _ in range(number):
+                self.loop.run_until_complete(callback(FakeInteraction(self.admin, self.rest), role, 100))
+
+        # 全ユーザーに発行した分のジャーナル・アーカイブは計測対象に含まれる（commit で書き込む）
+        return self.measure('role_issue_slash', users, run, 1)
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(args):
+    sizes = [parse_size(size) for size in args.sizes.split(',') if size.strip()]
+    names = [name.strip() for name in args.only.split(',')] if args.only else list(BENCHMARKS)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        raise SystemExit(f"不明なベンチマークです: {', '.join(sorted(unknown))}")
+
+    started = time.perf_counter()
+    results = []
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory(prefix='zerobot-bench-') as workdir:
+        runner = Runner(workdir, args.backend, args.repeat, args.seed)
+        try:
+            for size in sizes:
+                print(f"ユーザー {size:,}人 / 取引 {args.transactions:,}件", file=sys.stderr)
+                generating = time.perf_counter()
+                ledger = generate_ledger(size, args.transactions, args.seed)
+                runner.load(f"users-{size}", ledger)
+                print(f"  （合成台帳の作成と読み込み {time.perf_counter() - generating:.1f}秒）", file=sys.stderr)
+                for name in names:
+                    if name == 'evaluate_chinchin_dice' and size != sizes[0]:
+                        # 台帳の大きさに関係しないので1回だけ
+                        continue
+                    result = runner.run(name, size)
+                    results.extend(result if isinstance(result, list) else [result])
+                del ledger
+        finally:
+            runner.close()
+            os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    return {
+        'meta': {
+            'revision': git_revision(),
+            'created_at': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'backend': args.backend,
+            'transactions': args.transactions,
+            'repeat': args.repeat,
+            'seed': args.seed,
+            'elapsed_seconds': time.perf_counter() - started,
+        },
+        'results': results,
+    }
+
+
+def compare(before_path, after_path, threshold):
+    """2つの結果を (名前, ユーザー数) ごとに比べる。threshold 以上遅くなったものがあれば 1 を返す"""
+    with open(before_path, 'r', encoding='utf-8') as f:
+        before = json.load(f)
+    with open(after_path, 'r', encoding='utf-8') as f:
+        after = json.load(f)
+    baseline = {(r['name'], r['users']): r for r in before['results']}
+    print(f"{before['meta'].get('revision')} → {after['meta'].get('revision')}")
+    regressed = False
+    for result in after['results']:
+        old = baseline.get((result['name'], result['users']))
+        users = f"{result['users']:,}" if result['users'] is not None else '-'
+        if old is None:
+            print(f"{result['name']:<24} {users:>10}  （比較対象なし）")
+            continue
+        ratio = result['median_seconds'] / old['median_seconds']
+        mark = ''
+        if ratio >= 1 + threshold:
+            mark = '  ⚠️ 遅くなりました'
+            regressed = True
+        elif ratio <= 1 - threshold:
+            mark = '  ✅ 速くなりました'
+        print(f"{result['name']:<24} {users:>10}  {old['median_seconds'] * 1e6:12.2f} → "
+              f"{result['median_seconds'] * 1e6:12.2f} µs/op  ({ratio:.2f}倍){mark}")
+    return 1 if regressed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="台帳・ちんちろのベンチマーク")
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help=f"ユーザー数（カンマ区切り、k / m 可。既定: {DEFAULT_SIZES}）")
+    parser.add_argument('--transactions', type=parse_size, default=10_000, help="合成する直近の取引数（既定: 10k）")
+    parser.add_argument('--backend', choices=('json', 'sqlite'), default='json')
+    parser.add_argument('--only', help="実行するベンチマーク（カンマ区切り）: " + ', '.join(BENCHMARKS))
+    parser.add_argument('--repeat', type=int, default=5, help="計測の繰り返し回数（中央値を採る）")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="結果の JSON の出力先（省略時は標準出力）")
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help="2つの結果の JSON を比べる")
+    parser.add_argument('--threshold', type=float, default=0.1, help="--compare で遅くなったとみなす割合（既定: 0.1）")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return compare(*args.compare, args.threshold)
+
+    # Bot 本体の print が結果の JSON に混ざらないよう、計測中の標準出力は標準エラーに回す
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run_suite(args)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
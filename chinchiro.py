@@ -0,0 +1,191 @@
+"""ちんちろの役判定と勝敗判定
+
+サイコロ3個の出目は 6^3 = 216 通りしかないので、役（ChinchinHand）と
+両者の役の組み合わせごとの勝敗・配当（ChinchinOutcome）を起動時に
+すべて計算しておき、対戦中は表を引くだけにする。
+Discord に依存しないので、シミュレーションや監査用のツールからも使える。
+"""
+import random
+from typing import NamedTuple
+
+# 役の種類
+KIND_PINZORO = 'pinzoro'    # 1,1,1
+KIND_SHIGORO = 'shigoro'    # 4,5,6
+KIND_ZORO = 'zoro'          # 2,2,2 〜 6,6,6
+KIND_ME = 'me'              # 2つ揃い＋1つ（残りの1つが目）
+KIND_HIFUMI = 'hifumi'      # 1,2,3
+KIND_NONE = 'none'          # 役無し
+
+# 役が出るまでに振れる回数
+MAX_ATTEMPTS = 3
+
+# 勝敗
+RESULT_WIN = "勝利"
+RESULT_LOSE = "敗北"
+RESULT_DRAW = "引き分け"
+
+
+class ChinchinHand(NamedTuple):
+    """出目から決まる役"""
+    id: int             # HANDS 内の位置（RESULT_MATRIX の添字）
+    name: str           # 表示名（'ピンゾロ', '3ゾロ', '5の目' など）
+    kind: str           # KIND_*
+    rank: int           # ゾロ目・目の数字（それ以外は 0）
+    power: int          # evaluate_chinchin_dice が返していた値
+    final: bool         # この役が出たら振り直さない
+
+
+class ChinchinOutcome(NamedTuple):
+    """プレイヤーの役 × Botの役 の勝敗"""
+    result: str         # RESULT_*
+    multiplier: int     # 賭け金に掛ける倍率（負なら支払い）
+    color: int          # 結果表示の埋め込みの色
+    emoji: str
+
+
+def pack_dice(d1, d2, d3):
+    """出目3つを 0〜215 の整数にまとめる"""
+    return (d1 - 1) * 36 + (d2 - 1) * 6 + (d3 - 1)
+
+
+def unpack_dice(key):
+    """pack_dice の逆変換"""
+    return [key // 36 + 1, key // 6 % 6 + 1, key % 6 + 1]
+
+
+def _classify(dice):
+    """出目から (表示名, 種類, 数字, power) を求める（表を作る時だけ使う）"""
+    dice_sorted = sorted(dice)
+
+    # ピンゾロ（1,1,1）- 特別扱い：5倍もらう
+    if dice_sorted == [1, 1, 1]:
+        return 'ピンゾロ', KIND_PINZORO, 1, 5
+
+    # シゴロ（4,5,6）- 即勝ち：2倍もらう
+    if dice_sorted == [4, 5, 6]:
+        return 'シゴロ', KIND_SHIGORO, 0, 2
+
+    # ゾロ目（2,2,2 3,3,3 4,4,4 5,5,5 6,6,6）- 3倍もらう
+    if dice_sorted[0] == dice_sorted[1] == dice_sorted[2]:
+        return f'{dice_sorted[0]}ゾロ', KIND_ZORO, dice_sorted[0], 3
+
+    # ヒフミ（1,2,3）- 即負け：2倍払う
+    if dice_sorted == [1, 2, 3]:
+        return 'ヒフミ', KIND_HIFUMI, 0, -2
+
+    # 通常の目（ゾロ目が一つある場合）
+    # 例：1,1,2 → 2の目, 3,4,4 → 3の目
+    if dice_sorted[0] == dice_sorted[1]:
+        return f'{dice_sorted[2]}の目', KIND_ME, dice_sorted[2], dice_sorted[2]
+    elif dice_sorted[1] == dice_sorted[2]:
+        return f'{dice_sorted[0]}の目', KIND_ME, dice_sorted[0], dice_sorted[0]
+
+    # 役無し
+    return '役無し', KIND_NONE, 0, 0
+
+
+_WIN = ChinchinOutcome(RESULT_WIN, 1, 0x00ff00, "🎉")
+_LOSE = ChinchinOutcome(RESULT_LOSE, -1, 0xff0000, "😢")
+_DRAW = ChinchinOutcome(RESULT_DRAW, 0, 0xffff00, "🤝")
+
+
+def _resolve(player, bot):
+    """両者の役から勝敗を決める（表を作る時だけ使う）"""
+    # ヒフミ（即負け）→ シゴロ（即勝ち）→ ピンゾロ → 目 → ゾロ目 の順に判定する
+    if player.kind == KIND_HIFUMI and bot.kind == KIND_HIFUMI:
+        return _DRAW
+    if player.kind == KIND_HIFUMI:
+        return _LOSE._replace(multiplier=-2)
+    if bot.kind == KIND_HIFUMI:
+        return _WIN._replace(multiplier=2)
+    if player.kind == KIND_SHIGORO and bot.kind == KIND_SHIGORO:
+        return _DRAW
+    if player.kind == KIND_SHIGORO:
+        return _WIN._replace(multiplier=2)
+    if bot.kind == KIND_SHIGORO:
+        return _LOSE._replace(multiplier=-2)
+    if player.kind == KIND_PINZORO and bot.kind != KIND_PINZORO:
+        return ChinchinOutcome(RESULT_WIN, 5, 0xffd700, "🏆")
+    if bot.kind == KIND_PINZORO and player.kind != KIND_PINZORO:
+        return ChinchinOutcome(RESULT_LOSE, -5, 0xff0000, "😱")
+    if player.kind == KIND_ME and bot.kind == KIND_ME:
+        # 両方通常の目 → 目の数で比較
+        if player.rank > bot.rank:
+            return _WIN
+        if player.rank < bot.rank:
+            return _LOSE
+        return _DRAW
+    if player.kind == KIND_ME:
+        return _WIN
+    if bot.kind == KIND_ME:
+        return _LOSE
+    # ここまで来たゾロ目同士・ピンゾロ同士は引き分け
+    if player.kind == KIND_ZORO and bot.kind == KIND_NONE:
+        return _WIN._replace(multiplier=3)
+    if bot.kind == KIND_ZORO and player.kind == KIND_NONE:
+        return _LOSE._replace(multiplier=-3)
+    return _DRAW
+
+
+def _build_tables():
+    hands = []
+    by_name = {}
+    dice_table = []
+    for key in range(216):
+        name, kind, rank, power = _classify(unpack_dice(key))
+        if name not in by_name:
+            by_name[name] = ChinchinHand(len(hands), name, kind, rank, power, kind != KIND_NONE)
+            hands.append(by_name[name])
+        dice_table.append(by_name[name])
+    matrix = tuple(tuple(_resolve(player, bot) for bot in hands) for player in hands)
+    return tuple(hands), tuple(dice_table), by_name, matrix
+
+
+# HANDS: 出現しうる全役（15種類） / HAND_TABLE: pack_dice(...) → 役
+# HAND_BY_NAME: 表示名 → 役 / RESULT_MATRIX[プレイヤーの役.id][Botの役.id] → 勝敗
+HANDS, HAND_TABLE, HAND_BY_NAME, RESULT_MATRIX = _build_tables()
+
+# 1局で失いうる最大の額（賭け金の何倍か）。ちんちろの開始時にこの分の残高を確保する
+MAX_LOSS_MULTIPLIER = -min(outcome.multiplier for row in RESULT_MATRIX for outcome in row)
+
+
+def lookup_hand(dice):
+    """出目（3個）の役を返す"""
+    return HAND_TABLE[(dice[0] - 1) * 36 + (dice[1] - 1) * 6 + (dice[2] - 1)]
+
+
+def resolve(player_hand, bot_hand):
+    """両者の役から勝敗（ChinchinOutcome）を返す"""
+    return RESULT_MATRIX[player_hand.id][bot_hand.id]
+
+
+class ChinchinTurn(NamedTuple):
+    """片方の手番（最大3投）"""
+    rolls: tuple        # ((出目のリスト, 役), ...) を投げた順に
+    hand: ChinchinHand  # 確定した役
+
+
+class ChinchinGame(NamedTuple):
+    """1局分の結果"""
+    player: ChinchinTurn
+    bot: ChinchinTurn
+    outcome: ChinchinOutcome
+
+
+def play_turn(rng=random):
+    """役が出るまで（最大3投）サイコロを振る"""
+    rolls = []
+    for _ in range(MAX_ATTEMPTS):
+        dice = [rng.randint(1, 6) for _ in range(3)]
+        hand = lookup_hand(dice)
+        rolls.append((dice, hand))
+        if hand.final:
+            break
+    return ChinchinTurn(tuple(rolls), hand)
+
+
+def play_game(rng=random):
+    """プレイヤー → Bot の順に振り、勝敗まで決める"""
+    player = play_turn(rng)
+    bot = play_turn(rng)
+    return ChinchinGame(player, bot, resolve(player.hand, bot.hand))
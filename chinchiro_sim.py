@@ -0,0 +1,174 @@
+"""ちんちろの配当・ハウスエッジを確かめるオフラインのシミュレーター
+
+play_chinchin_game と同じ規則（最大3投・役が出たら終了・chinchiro の勝敗表）で
+大量の対戦を NumPy でまとめて計算し、賭け金ごとの期待値・分散・配当分布を出す。
+勝敗表から求めた厳密値と、1局ずつ回す素朴な実装との突き合わせも行う。
+
+    python chinchiro_sim.py                    # 10^8 局
+    python chinchiro_sim.py --games 1e6 --json # 結果を JSON で出力
+    python chinchiro_sim.py --verify           # 厳密値・逐次実装との一致を確認
+
+NumPy はこのツールでだけ使う（Bot 本体の動作には不要）。
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from fractions import Fraction
+
+import numpy as np
+
+from chinchiro import HANDS, HAND_TABLE, MAX_ATTEMPTS, RESULT_MATRIX, play_game
+
+BET_SIZES = (1000, 5000, 10000)
+
+# 勝敗表を NumPy の配列にしておく
+HAND_ID_BY_KEY = np.array([hand.id for hand in HAND_TABLE], dtype=np.int8)
+FINAL_BY_HAND = np.array([hand.final for hand in HANDS], dtype=bool)
+MULTIPLIER_MATRIX = np.array(
+    [[outcome.multiplier for outcome in row] for row in RESULT_MATRIX], dtype=np.int8
+)
+# np.bincount 用に倍率（-5〜5）を 0 始まりにずらす
+MULTIPLIER_OFFSET = 5
+
+
+def roll_final_hands(rng, n):
+    """n 人分、最大3投して確定した役の ID を返す"""
+    # 3個のサイコロは独立なので、0〜215 の一様乱数1つと同じ
+    keys = rng.integers(0, 216, size=(MAX_ATTEMPTS, n), dtype=np.uint8)
+    # 後ろの投目から順に「役が出ていればそれ、出ていなければ次の投目」を畳み込む
+    # （3投とも役無しなら最後の投目＝役無しが残る）
+    result = HAND_ID_BY_KEY[keys[-1]]
+    for attempt in range(MAX_ATTEMPTS - 2, -1, -1):
+        hands = HAND_ID_BY_KEY[keys[attempt]]
+        result = np.where(FINAL_BY_HAND[hands], hands, result)
+    return result
+
+
+def simulate(games, batch_size=10_000_000, seed=None):
+    """games 局を回し、倍率ごとの出現回数（インデックス = 倍率 + 5）を返す"""
+    rng = np.random.default_rng(seed)
+    counts = np.zeros(2 * MULTIPLIER_OFFSET + 1, dtype=np.int64)
+    remaining = games
+    while remaining > 0:
+        n = min(batch_size, remaining)
+        player = roll_final_hands(rng, n)
+        bot = roll_final_hands(rng, n)
+        multipliers = MULTIPLIER_MATRIX[player, bot]
+        counts += np.bincount(multipliers + MULTIPLIER_OFFSET, minlength=counts.size)
+        remaining -= n
+    return counts
+
+
+def exact_distribution():
+    """勝敗表から倍率ごとの厳密な確率を求める"""
+    per_roll = [Fraction(0)] * len(HANDS)
+    for hand in HAND_TABLE:
+        per_roll[hand.id] += Fraction(1, 216)
+    miss = sum(per_roll[hand.id] for hand in HANDS if not hand.final)
+    # 役が出るまで最大3投。3投とも外れたら役無しで確定
+    final = [Fraction(0)] * len(HANDS)
+    for hand in HANDS:
+        if hand.final:
+            final[hand.id] = per_roll[hand.id] * (1 + miss + miss ** 2)
+        else:
+            # 役が確定しない手は「役無し」の1種類だけ
+            final[hand.id] = miss ** 3
+    distribution = {}
+    for player in HANDS:
+        for bot in HANDS:
+            multiplier = RESULT_MATRIX[player.id][bot.id].multiplier
+            distribution[multiplier] = distribution.get(multiplier, 0) + final[player.id] * final[bot.id]
+    return distribution
+
+
+def play_scalar(rng):
+    """1局を Bot 本体と同じ chinchiro.play_game で回し、倍率を返す"""
+    return play_game(rng).outcome.multiplier
+
+
+def summarize(counts, bets=BET_SIZES):
+    """倍率の出現回数から賭け金ごとの統計を作る"""
+    games = int(counts.sum())
+    multipliers = np.arange(counts.size) - MULTIPLIER_OFFSET
+    probabilities = counts / games
+    mean = float((multipliers * probabilities).sum())
+    variance = float(((multipliers - mean) ** 2 * probabilities).sum())
+    distribution = {int(m): int(c) for m, c in zip(multipliers, counts) if c}
+    return {
+        'games': games,
+        # プレイヤーから見た1局あたりの期待倍率。ハウスエッジはその符号反転
+        'expected_multiplier': mean,
+        'house_edge': -mean,
+        'bets': {
+            str(bet): {
+                'expected_value': mean * bet,
+                'variance': variance * bet * bet,
+                'stddev': variance ** 0.5 * bet,
+                'payout_distribution': {str(m * bet): c for m, c in distribution.items()},
+            }
+            for bet in bets
+        },
+    }
+
+
+def verify(games, seed=None):
+    """シミュレーション・Bot 本体の逐次実装・厳密値が一致するか確認する"""
+    exact = exact_distribution()
+    exact_mean = float(sum(m * p for m, p in exact.items()))
+
+    counts = simulate(games, seed=seed)
+    vector_mean = summarize(counts)['expected_multiplier']
+
+    rng = random.Random(seed)
+    scalar_games = min(games, 200_000)
+    scalar_mean = sum(play_scalar(rng) for _ in range(scalar_games)) / scalar_games
+
+    # 倍率の標準偏差は最大でも 5 程度なので、標準誤差の 5 倍を許容範囲とする
+    stddev = float(sum((m - exact_mean) ** 2 * p for m, p in exact.items())) ** 0.5
+    ok = True
+    for label, value, n in (('vectorized', vector_mean, games), ('scalar', scalar_mean, scalar_games)):
+        tolerance = 5 * stddev / n ** 0.5
+        matched = abs(value - exact_mean) <= tolerance
+        ok = ok and matched
+        print(f"{label:>10}: {value:+.6f}（厳密値 {exact_mean:+.6f}、許容 ±{tolerance:.6f}）{'OK' if matched else 'NG'}")
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ちんちろの配当シミュレーター")
+    parser.add_argument('--games', type=float, default=1e8, help="対戦数（既定: 1e8）")
+    parser.add_argument('--batch', type=int, default=10_000_000, help="1回にまとめて計算する対戦数")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--json', action='store_true', help="結果を JSON で出力")
+    parser.add_argument('--verify', action='store_true', help="厳密値・逐次実装との一致を確認")
+    args = parser.parse_args(argv)
+    games = int(args.games)
+
+    if args.verify:
+        return 0 if verify(games, args.seed) else 1
+
+    started = time.perf_counter()
+    summary = summarize(simulate(games, args.batch, args.seed))
+    summary['elapsed_seconds'] = time.perf_counter() - started
+    exact = exact_distribution()
+    summary['exact_expected_multiplier'] = float(sum(m * p for m, p in exact.items()))
+
+    if args.json:
+        json.dump(summary, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+        return 0
+
+    print(f"対戦数: {summary['games']:,}（{summary['elapsed_seconds']:.1f}秒）")
+    print(f"期待倍率: {summary['expected_multiplier']:+.6f}（厳密値 {summary['exact_expected_multiplier']:+.6f}）")
+    print(f"ハウスエッジ: {summary['house_edge'] * 100:+.4f}%")
+    for bet, stats in summary['bets'].items():
+        print(f"\n賭け金 {int(bet):,}Z: 期待値 {stats['expected_value']:+,.1f}Z / 標準偏差 {stats['stddev']:,.1f}Z")
+        for payout, count in sorted(stats['payout_distribution'].items(), key=lambda item: int(item[0])):
+            print(f"  {int(payout):+,}Z: {count / summary['games'] * 100:7.4f}%")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
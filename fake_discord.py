@@ -0,0 +1,261 @@
+"""Discord の Interaction・応答・followup・チャンネルのローカルな代役
+
+負荷試験（loadtest.py）やベンチマーク（benchmark.py）から、実際のギルドに
+接続せずにコマンドの処理を呼ぶために使う。呼び出しはすべて記録し、
+RestSimulator で REST API の遅延と 429（レート制限）を模擬する。
+"""
+import asyncio
+import itertools
+import random
+import time
+from collections import deque
+
+import discord
+
+_ids = itertools.count(1_000_000_000_000_000_000)
+
+
+class _FakeHTTPResponse:
+    """discord.HTTPException に渡す aiohttp の応答の代わり"""
+
+    def __init__(self, status, reason):
+        self.status = status
+        self.reason = reason
+
+
+def http_error(status, message='', retry_after=None):
+    """discord.py が REST の失敗時に出すのと同じ例外を作る"""
+    if status == 404:
+        error = discord.NotFound(_FakeHTTPResponse(404, 'Not Found'), {'message': message, 'code': 10008})
+    elif status == 403:
+        error = discord.Forbidden(_FakeHTTPResponse(403, 'Forbidden'), {'message': message, 'code': 50013})
+    else:
+        error = discord.HTTPException(_FakeHTTPResponse(status, 'Too Many Requests' if status == 429 else 'Error'),
+                                      {'message': message})
+    if retry_after is not None:
+        error.retry_after = retry_after
+    return error
+
+
+class RestSimulator:
+    """REST 呼び出しの遅延とレート制限を模擬する（同じ試験の代役で共有する）
+
+    latency / jitter: 1回の呼び出しにかかる秒数（jitter は指数分布の平均）
+    route_limit: (回数, 秒)。同じルート（Webhook トークン・チャンネル）への呼び出しの上限
+    global_limit: (回数, 秒)。Bot 全体の上限（インタラクションへの初回応答は対象外）
+    rate_limit_probability: 上限とは別に、ランダムに 429 を返す確率
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, route_limit=(5, 2.0), global_limit=(50, 1.0),
+                 rate_limit_probability=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.route_limit = route_limit
+        self.global_limit = global_limit
+        self.rate_limit_probability = rate_limit_probability
+        self.rng = random.Random(seed)
+        self._routes = {}       # ルート → 直近の呼び出し時刻
+        self._global = deque()
+        self.calls = {}         # メソッド → 回数
+        self.rate_limited = {}  # メソッド → 429 の回数
+
+    def _delay(self):
+        if not self.jitter:
+            return self.latency
+        return self.latency + self.rng.expovariate(1 / self.jitter)
+
+    @staticmethod
+    def _retry_after(window, limit, now):
+        """window（時刻の deque）が上限に達していれば、空くまでの秒数"""
+        count, period = limit
+        while window and window[0] <= now - period:
+            window.popleft()
+        if len(window) >= count:
+            return window[0] + period - now
+        return None
+
+    async def call(self, method, route=None):
+        """1回の REST 呼び出し。429 になる場合は discord.HTTPException を出す"""
+        self.calls[method] = self.calls.get(method, 0) + 1
+        delay = self._delay()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if route is None:
+            return
+        now = time.monotonic()
+        window = self._routes.get(route)
+        if window is None:
+            window = self._routes[route] = deque()
+        retry_after = None
+        if self.route_limit:
+            retry_after = self._retry_after(window, self.route_limit, now)
+        if retry_after is None and self.global_limit:
+            retry_after = self._retry_after(self._global, self.global_limit, now)
+        if retry_after is None and self.rate_limit_probability and self.rng.random() < self.rate_limit_probability:
+            retry_after = self.rng.uniform(0.1, 1.0)
+        if retry_after is not None:
+            self.rate_limited[method] = self.rate_limited.get(method, 0) + 1
+            raise http_error(429, 'You are being rate limited.', retry_after)
+        window.append(now)
+        self._global.append(now)
+
+    def forget_route(self, route):
+        self._routes.pop(route, None)
+
+
+class FakeUser:
+    """discord.Member / discord.User の代わり"""
+
+    def __init__(self, id, bot=False, display_name=None):
+        self.id = id
+        self.bot = bot
+        self.display_name = display_name or f"user{id}"
+        self.name = self.display_name
+        self.mention = f"<@{id}>"
+        self.avatar = None
+
+    def __eq__(self, other):
+        return isinstance(other, FakeUser) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class FakeRole:
+    def __init__(self, members, name="loadtest"):
+        self.id = next(_ids)
+        self.name = name
+        self.mention = f"<@&{self.id}>"
+        self.members = members
+
+
+class FakeInteractionMetadata:
+    def __init__(self, user):
+        self.user = user
+
+
+class FakeMessage:
+    """送信済みのメッセージ（followup.send(wait=True) などの戻り値）"""
+
+    def __init__(self, rest, route, content=None, embeds=(), view=None, interaction_metadata=None):
+        self.id = next(_ids)
+        self.rest = rest
+        self.route = route
+        self.content = content
+        self.embeds = list(embeds)
+        self.view = view
+        self.interaction_metadata = interaction_metadata
+        self.edits = []
+
+    async def edit(self, content=None, embed=None, embeds=None, view=None, **kwargs):
+        await self.rest.call('message.edit', self.route)
+        self.edits.append({'content': content, 'embed': embed, 'embeds': embeds, 'view': view, **kwargs})
+
+
+class FakeChannel:
+    """テキストチャンネル（ログチャンネルなど）。送ったメッセージを記録する"""
+
+    def __init__(self, rest=None, id=None):
+        self.rest = rest or RestSimulator()
+        self.id = id or next(_ids)
+        self.mention = f"<#{self.id}>"
+        self.guild = None
+        self.sent = []
+
+    async def send(self, content=None, embed=None, embeds=None, **kwargs):
+        await self.rest.call('channel.send', f"channel:{self.id}")
+        embeds = embeds or ([embed] if embed else [])
+        message = FakeMessage(self.rest, f"channel:{self.id}", content, embeds)
+        self.sent.append(message)
+        return message
+
+
+def _first_time(interaction):
+    if interaction.responded_at is None:
+        interaction.responded_at = time.perf_counter()
+
+
+class FakeResponse:
+    """interaction.response（初回応答は1回だけ。2回目は InteractionResponded）"""
+
+    def __init__(self, interaction):
+        self._interaction = interaction
+        self._done = False
+        self.calls = []
+
+    def is_done(self):
+        return self._done
+
+    async def _respond(self, method, kwargs):
+        if self._done:
+            raise discord.InteractionResponded(self._interaction)
+        self._done = True
+        # 初回応答はレート制限の対象外なので遅延だけ
+        await self._interaction.rest.call(method)
+        _first_time(self._interaction)
+        self.calls.append((method, kwargs))
+
+    async def send_message(self, content=None, **kwargs):
+        await self._respond('response.send_message', dict(kwargs, content=content))
+        self._interaction.original = FakeMessage(
+            self._interaction.rest, self._interaction.route, content,
+            kwargs.get('embeds') or ([kwargs['embed']] if kwargs.get('embed') else []), kwargs.get('view'),
+            FakeInteractionMetadata(self._interaction.user)
+        )
+
+    async def edit_message(self, **kwargs):
+        await self._respond('response.edit_message', kwargs)
+
+    async def defer(self, **kwargs):
+        await self._respond('response.defer', kwargs)
+
+
+class FakeFollowup:
+    """interaction.followup（Webhook。ルートごとのレート制限を受ける）"""
+
+    def __init__(self, interaction):
+        self._interaction = interaction
+        self.sent = []
+
+    async def send(self, content=None, embed=None, embeds=None, view=None, wait=False, **kwargs):
+        interaction = self._interaction
+        await interaction.rest.call('followup.send', interaction.route)
+        _first_time(interaction)
+        message = FakeMessage(interaction.rest, interaction.route, content,
+                              embeds or ([embed] if embed else []), view)
+        self.sent.append(message)
+        return message if wait else None
+
+
+class FakeInteraction:
+    """discord.Interaction の代わり
+
+    user: 実行したユーザー / command: tree.get_command(...) の戻り値（動作指標のコマンド名に使う）
+    message: ボタンが押された場合の、ボタンの付いたメッセージ
+    """
+
+    def __init__(self, user, rest=None, command=None, message=None, channel=None):
+        self.id = next(_ids)
+        self.token = f"token-{self.id}"
+        self.rest = rest or RestSimulator()
+        self.user = user
+        self.command = command
+        self.message = message
+        self.channel = channel or FakeChannel(self.rest)
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+        self.original = None        # 初回応答で送ったメッセージ
+        self.edits = []
+        self.created_at = time.perf_counter()
+        self.responded_at = None    # 最初に応答（または followup）が届いた時刻
+
+    @property
+    def route(self):
+        return f"webhook:{self.token}"
+
+    async def edit_original_response(self, content=None, embed=None, embeds=None, view=None, **kwargs):
+        # 初回応答前はメッセージが無いので 404
+        if not self.response.is_done():
+            raise http_error(404, 'Unknown Message')
+        await self.rest.call('edit_original_response', self.route)
+        self.edits.append({'content': content, 'embed': embed, 'embeds': embeds, 'view': view, **kwargs})
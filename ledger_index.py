@@ -0,0 +1,213 @@
+"""台帳の二次インデックス（ランキング・取引履歴用）
+
+ZCurrencyBot.update_balance で残高や累計が変わるたびに更新し、
+上位N件・順位や、ユーザーごとの取引履歴の問い合わせで全体を走査しなくて済むようにする。
+Discord に依存しない。
+"""
+from bisect import bisect_left, bisect_right, insort
+from itertools import chain, islice
+from typing import NamedTuple
+
+
+# RankIndex の1バケットの長さの目安（2倍を超えたら分割する）
+_BUCKET_SIZE = 512
+
+
+class RankIndex:
+    """値の大きい順に並べたユーザーの一覧
+
+    (-値, user_id) の昇順を長さ _BUCKET_SIZE 前後のソート済みリスト（バケット）に分けて持ち、
+    バケットごとの件数を Fenwick 木で数える。更新・順位は O(log n)
+    （バケット内の挿入・削除はバケットの長さが一定なので定数）。
+    バケットの分割・削除の時だけ O(n / _BUCKET_SIZE) の作り直しがあるが、
+    それまでに _BUCKET_SIZE 回以上の更新を挟むので均せば小さい。
+    同じ値のユーザーは同じ順位になる（表示順は user_id 順）。
+    """
+
+    def __init__(self, values=()):
+        self._values = dict(values)
+        entries = sorted((-value, user_id) for user_id, value in self._values.items())
+        self._buckets = [entries[i:i + _BUCKET_SIZE] for i in range(0, len(entries), _BUCKET_SIZE)]
+        self._rebuild()
+
+    def _rebuild(self):
+        """バケットの並びが変わった時に、各バケットの最大値と Fenwick 木を作り直す"""
+        self._maxes = [bucket[-1] for bucket in self._buckets]
+        tree = [0] * (len(self._buckets) + 1)
+        for i, bucket in enumerate(self._buckets, 1):
+            tree[i] += len(bucket)
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _add(self, index, delta):
+        """index 番目のバケットの件数を delta 増やす"""
+        tree = self._tree
+        index += 1
+        while index < len(tree):
+            tree[index] += delta
+            index += index & -index
+
+    def _count_before(self, index):
+        """index 番目より前のバケットの件数の合計"""
+        tree = self._tree
+        total = 0
+        while index > 0:
+            total += tree[index]
+            index -= index & -index
+        return total
+
+    def _insert(self, entry):
+        if not self._buckets:
+            self._buckets.append([entry])
+            self._rebuild()
+            return
+        index = bisect_left(self._maxes, entry)
+        if index == len(self._buckets):
+            index -= 1
+        bucket = self._buckets[index]
+        insort(bucket, entry)
+        self._maxes[index] = bucket[-1]
+        if len(bucket) > 2 * _BUCKET_SIZE:
+            self._buckets[index:index + 1] = [bucket[:_BUCKET_SIZE], bucket[_BUCKET_SIZE:]]
+            self._rebuild()
+        else:
+            self._add(index, 1)
+
+    def _remove(self, entry):
+        index = bisect_left(self._maxes, entry)
+        bucket = self._buckets[index]
+        del bucket[bisect_left(bucket, entry)]
+        if bucket:
+            self._maxes[index] = bucket[-1]
+            self._add(index, -1)
+        else:
+            del self._buckets[index]
+            self._rebuild()
+
+    def __len__(self):
+        return len(self._values)
+
+    def get(self, user_id):
+        return self._values.get(user_id)
+
+    def set(self, user_id, value):
+        """ユーザーの値を設定（未登録なら追加）"""
+        old = self._values.get(user_id)
+        if old == value:
+            return
+        if old is not None:
+            self._remove((-old, user_id))
+        self._values[user_id] = value
+        self._insert((-value, user_id))
+
+    def top(self, n):
+        """上位 n 件の [(user_id, 値), ...]"""
+        return [(user_id, -negated) for negated, user_id in islice(chain.from_iterable(self._buckets), n)]
+
+    def rank(self, user_id):
+        """順位（1始まり）。未登録なら None"""
+        value = self._values.get(user_id)
+        if value is None:
+            return None
+        # 値が自分より大きいユーザーの数 + 1（'' はどの user_id よりも前に来る）
+        key = (-value, '')
+        index = bisect_left(self._maxes, key)
+        return self._count_before(index) + bisect_left(self._buckets[index], key) + 1
+
+
+class HistoryPage(NamedTuple):
+    """取引履歴の1ページ"""
+    transactions: list  # 新しい順
+    has_newer: bool     # このページより新しい取引があるか
+    has_older: bool     # このページより古い取引があるか
+
+
+def _seq(transaction):
+    return transaction.get('seq', 0)
+
+
+def _date(transaction):
+    return transaction['timestamp'][:10]
+
+
+class _History:
+    """古い順の取引リスト（先頭からの削除は head をずらすだけにする）"""
+    __slots__ = ('items', 'head')
+
+    def __init__(self):
+        self.items = []
+        self.head = 0
+
+    def __len__(self):
+        return len(self.items) - self.head
+
+    def popleft(self):
+        self.head += 1
+        # 削除済みの領域が半分を超えたらまとめて詰める（償却 O(1)）
+        if self.head >= 1024 and self.head * 2 >= len(self.items):
+            del self.items[:self.head]
+            self.head = 0
+
+
+class TransactionIndex:
+    """ユーザーごと・ユーザー×種別ごとの取引一覧
+
+    取引は連番（seq）順に追記されるので、各一覧も連番・日時の昇順に並ぶ。
+    日付範囲と前後のページ位置は二分探索で求めるため、1ページの取得は
+    そのユーザーの取引数によらずページの大きさに比例する。
+    """
+
+    def __init__(self, transactions=()):
+        self._histories = {}    # (user_id, 種別 または None) → _History
+        for transaction in transactions:
+            self.add(transaction)
+
+    def _keys(self, transaction):
+        return (transaction['user_id'], None), (transaction['user_id'], transaction['type'])
+
+    def add(self, transaction):
+        """新しい取引を末尾に加える"""
+        for key in self._keys(transaction):
+            history = self._histories.get(key)
+            if history is None:
+                history = self._histories[key] = _History()
+            history.items.append(transaction)
+
+    def evict(self, transaction):
+        """最も古い取引を外す（メモリ上の履歴の範囲から外れた時）"""
+        for key in self._keys(transaction):
+            history = self._histories[key]
+            history.popleft()
+            if not history:
+                del self._histories[key]
+
+    def count(self, user_id, transaction_type=None):
+        history = self._histories.get((str(user_id), transaction_type))
+        return len(history) if history else 0
+
+    def page(self, user_id, transaction_type=None, start_date=None, end_date=None,
+             before=None, after=None, limit=10):
+        """新しい順に最大 limit 件を返す
+
+        start_date / end_date: 'YYYY-MM-DD'（両端を含む）
+        before: この連番より古いものを返す / after: この連番より新しいものを返す（どちらも無ければ最新から）
+        """
+        history = self._histories.get((str(user_id), transaction_type))
+        if not history:
+            return HistoryPage([], False, False)
+        items = history.items
+        lo, hi = history.head, len(items)
+        if start_date:
+            lo = bisect_left(items, start_date, lo, hi, key=_date)
+        if end_date:
+            hi = bisect_right(items, end_date, lo, hi, key=_date)
+
+        if after is not None:
+            first = bisect_right(items, after, lo, hi, key=_seq)
+            last = min(first + limit, hi)
+        else:
+            last = bisect_left(items, before, lo, hi, key=_seq) if before is not None else hi
+            first = max(last - limit, lo)
+        return HistoryPage(items[first:last][::-1], last < hi, first > lo)
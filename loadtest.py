@@ -0,0 +1,313 @@
+"""Discord に接続しない負荷試験
+
+fake_discord の代役（REST の遅延と 429 を模擬）を使い、多数の模擬ユーザーが
+/残高確認・/送金・/ちんちろ（ボタンを押してゲーム終了まで）を実際のコマンド処理に
+並行して流し込む。操作ごとの p50 / p99 レイテンシ、スループット、
+イベントループの遅延を集計する。保存先は一時ディレクトリに作る。
+
+    python loadtest.py                                   # 1000人・30秒
+    python loadtest.py --users 5000 --duration 60 --latency 0.08 --rate-limit-probability 0.01
+    python loadtest.py --mix balance=5,send=3,chinchin=2 --json > result.json
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from fake_discord import FakeChannel, FakeInteraction, FakeMessage, FakeInteractionMetadata, FakeUser, RestSimulator
+
+ACTIONS = ('balance', 'send', 'chinchin')
+DEFAULT_MIX = 'balance=4,send=3,chinchin=3'
+# 模擬ユーザーのIDの始まり
+USER_ID_BASE = 400_000_000_000_000_000
+# Discord がインタラクションへの初回応答を待つ時間（秒）
+INTERACTION_DEADLINE = 3.0
+# イベントループの遅延を測る間隔（秒）
+LAG_INTERVAL = 0.05
+
+
+def percentile(values, q):
+    """q（0〜100）パーセンタイル（最近傍）"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(values):
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'p50': percentile(values, 50),
+        'p90': percentile(values, 90),
+        'p99': percentile(values, 99),
+        'max': max(values),
+        'mean': statistics.fmean(values),
+    }
+
+
+def parse_mix(text):
+    weights = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ACTIONS:
+            raise SystemExit(f"不明な操作です: {name}（{', '.join(ACTIONS)}）")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.rest = RestSimulator(
+            latency=args.latency, jitter=args.jitter,
+            route_limit=(args.route_limit, args.route_period),
+            global_limit=(args.global_limit, 1.0),
+            rate_limit_probability=args.rate_limit_probability, seed=args.seed
+        )
+        self.users = [FakeUser(USER_ID_BASE + index) for index in range(args.users)]
+        self.mix = parse_mix(args.mix)
+        self.channel = FakeChannel(self.rest)
+        self.log_channel = FakeChannel(self.rest)
+        # 操作ごとの (初回応答までの秒数, 完了までの秒数)
+        self.ack = {action: [] for action in ACTIONS}
+        self.total = {action: [] for action in ACTIONS}
+        self.errors = {}
+        self.completed = 0
+        # 試験時間内に完了した件数（スループットはこれを試験時間で割る）
+        self.completed_in_duration = 0
+        self.lag = []
+
+    def setup(self):
+        """Bot を読み込み、ログチャンネルを代役に差し替える"""
+        os.environ['METRICS_PORT'] = '0'
+        import Zerobot
+        self.Z = Zerobot
+        self.bot = Zerobot.bot
+        Zerobot.LOG_CHANNEL_ID = self.log_channel.id
+        self.bot.log_dispatcher.channel_id = self.log_channel.id
+        self.bot.get_channel = lambda channel_id: self.log_channel if channel_id == self.log_channel.id else None
+        if self.args.animation:
+            Zerobot.CHINCHIN_ANIMATION = self.args.animation
+
+    async def prepare(self):
+        bot = self.bot
+        await bot.load_ledger()
+        bot.log_dispatcher.start()
+        if bot.watchdog:
+            bot.watchdog.start()
+        # 全員に元手を配っておく
+        await bot.bulk_credit([user.id for user in self.users], self.args.initial_balance, 'admin_issue')
+
+    def interaction(self, user, command_name=None, message=None):
+        command = self.bot.tree.get_command(command_name) if command_name else None
+        return FakeInteraction(user, self.rest, command=command, message=message, channel=self.channel)
+
+    async def do_balance(self, user):
+        interaction = self.interaction(user, '残高確認')
+        await self.Z.balance_slash.callback(interaction, None)
+        return interaction
+
+    async def do_send(self, user):
+        target = self.rng.choice(self.users)
+        while target is user:
+            target = self.rng.choice(self.users)
+        interaction = self.interaction(user, '送金')
+        await self.Z.send_slash.callback(interaction, target, self.rng.choice((100, 500, 1000)))
+        return interaction
+
+    async def do_chinchin(self, user):
+        # /ちんちろ でレート選択画面を出し、続けてボタンを押す
+        interaction = self.interaction(user, 'ちんちろ')
+        await self.Z.chinchin_slash.callback(interaction)
+        if interaction.original is None or interaction.original.view is None:
+            return interaction
+        view = self.Z.chinchin_rate_view
+        custom_id = self.rng.choice([f"{self.Z.CHINCHIN_RATE_PREFIX}{amount}" for amount in (1000, 5000, 10000)])
+        button = next(item for item in view.children if getattr(item, 'custom_id', None) == custom_id)
+        message = FakeMessage(self.rest, interaction.route, embeds=interaction.original.embeds, view=view,
+                              interaction_metadata=FakeInteractionMetadata(user))
+        pressed = self.interaction(user, message=message)
+        if await view.interaction_check(pressed):
+            await view.start_chinchin(pressed, button)
+        # 応答時間は /ちんちろ の初回応答、完了はゲーム（演出）終了までで測る
+        pressed.created_at = interaction.created_at
+        pressed.responded_at = interaction.responded_at
+        return pressed
+
+    async def think(self):
+        if self.args.think:
+            await asyncio.sleep(self.rng.expovariate(1 / self.args.think))
+
+    async def simulated_user(self, user, deadline):
+        actions = list(self.mix)
+        weights = [self.mix[action] for action in actions]
+        # 開始をずらす
+        await asyncio.sleep(self.rng.uniform(0, self.args.ramp_up))
+        while time.perf_counter() < deadline:
+            action = self.rng.choices(actions, weights)[0]
+            started = time.perf_counter()
+            try:
+                interaction = await getattr(self, f"do_{action}")(user)
+            except Exception as e:
+                key = f"{action}: {type(e).__name__}"
+                self.errors[key] = self.errors.get(key, 0) + 1
+            else:
+                finished = time.perf_counter()
+                if interaction.responded_at is not None:
+                    self.ack[action].append(interaction.responded_at - interaction.created_at)
+                self.total[action].append(finished - started)
+                self.completed += 1
+                if finished <= deadline:
+                    self.completed_in_duration += 1
+            await self.think()
+
+    async def measure_lag(self, stop):
+        """sleep がどれだけ遅れて戻るか（= イベントループが他の処理で塞がっていた時間）"""
+        loop = asyncio.get_running_loop()
+        while not stop.is_set():
+            expected = loop.time() + LAG_INTERVAL
+            await asyncio.sleep(LAG_INTERVAL)
+            self.lag.append(max(0.0, loop.time() - expected))
+
+    async def run(self):
+        await self.prepare()
+        stop = asyncio.Event()
+        lag_task = asyncio.create_task(self.measure_lag(stop))
+        started = time.perf_counter()
+        deadline = started + self.args.duration
+        await asyncio.gather(*(self.simulated_user(user, deadline) for user in self.users))
+        # 試験時間の終わりに実行中だった操作（演出など）が終わるまでの時間
+        drain = max(0.0, time.perf_counter() - deadline)
+        stop.set()
+        await lag_task
+        # 残ったログの送信を少しだけ待つ
+        await asyncio.sleep(0.5)
+        report = self.report(drain)
+        await self.bot.close()
+        return report
+
+    def report(self, drain):
+        bot = self.bot
+        all_ack = [value for values in self.ack.values() for value in values]
+        return {
+            'config': {
+                'users': self.args.users,
+                'duration': self.args.duration,
+                'mix': self.mix,
+                'latency': self.args.latency,
+                'jitter': self.args.jitter,
+                'route_limit': [self.args.route_limit, self.args.route_period],
+                'global_limit': self.args.global_limit,
+                'rate_limit_probability': self.args.rate_limit_probability,
+                'think': self.args.think,
+                'animation': self.Z.chinchin_animation_mode(),
+            },
+            'completed': self.completed,
+            'completed_in_duration': self.completed_in_duration,
+            'throughput_per_second': self.completed_in_duration / self.args.duration if self.args.duration else None,
+            'drain_seconds': drain,
+            'ack_latency': {action: summarize(values) for action, values in self.ack.items()},
+            'total_latency': {action: summarize(values) for action, values in self.total.items()},
+            'over_interaction_deadline': sum(1 for value in all_ack if value > INTERACTION_DEADLINE),
+            'event_loop_lag': summarize(self.lag),
+            # 監視が記録した、ループを止めていた箇所（合計時間の長い順）
+            'loop_stalls': [
+                {'site': site, 'count': count, 'total_seconds': total, 'max_seconds': longest,
+                 'context': event.context}
+                for site, count, total, longest, event in bot.watchdog.worst()
+            ] if bot.watchdog else [],
+            'errors': self.errors,
+            'rest_calls': dict(self.rest.calls),
+            'rest_rate_limited': dict(self.rest.rate_limited),
+            'edit_scheduler': bot.edit_scheduler.stats(),
+            'chinchin_rejected_busy': bot.game_sessions.rejected_busy,
+            'log_embeds_sent': bot.log_dispatcher.sent,
+            'log_embeds_spilled': bot.log_dispatcher.spilled,
+        }
+
+
+def _ms(value):
+    return f"{value * 1000:8.1f}ms" if value is not None else '       -'
+
+
+def print_report(report):
+    print(f"\n完了 {report['completed_in_duration']:,}件 / {report['config']['duration']:.1f}秒"
+          f"（{report['throughput_per_second']:,.1f}件/秒）")
+    print(f"終了待ち: {report['drain_seconds']:.1f}秒（この間に完了 {report['completed'] - report['completed_in_duration']:,}件）")
+    print(f"{'操作':<10} {'件数':>8} {'応答 p50':>10} {'応答 p99':>10} {'完了 p50':>10} {'完了 p99':>10}")
+    for action in ACTIONS:
+        ack = report['ack_latency'][action]
+        total = report['total_latency'][action]
+        if not total['count']:
+            continue
+        print(f"{action:<10} {total['count']:>8,} {_ms(ack.get('p50'))} {_ms(ack.get('p99'))} "
+              f"{_ms(total.get('p50'))} {_ms(total.get('p99'))}")
+    lag = report['event_loop_lag']
+    print(f"イベントループの遅延: p50 {_ms(lag.get('p50'))} / p99 {_ms(lag.get('p99'))} / 最大 {_ms(lag.get('max'))}")
+    for stall in report['loop_stalls']:
+        context = stall['context'] or {}
+        print(f"  ループ停止 {stall['count']:>4}回 合計 {stall['total_seconds']:6.2f}秒 最大 {_ms(stall['max_seconds'])}"
+              f"  {stall['site']}（{context.get('command') or context.get('task') or '-'}）")
+    print(f"3秒以内に応答できなかったインタラクション: {report['over_interaction_deadline']}件")
+    print(f"REST 呼び出し: {report['rest_calls']}")
+    print(f"429: {report['rest_rate_limited']}")
+    print(f"メッセージ編集: {report['edit_scheduler']}")
+    print(f"混雑で断ったちんちろ: {report['chinchin_rejected_busy']}件 / ログ送信: {report['log_embeds_sent']}件"
+          f"（退避 {report['log_embeds_spilled']}件）")
+    if report['errors']:
+        print(f"エラー: {report['errors']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Discord に接続しない負荷試験")
+    parser.add_argument('--users', type=int, default=1000, help="同時に操作する模擬ユーザー数")
+    parser.add_argument('--duration', type=float, default=30.0, help="試験時間（秒）")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f"操作の比率（既定: {DEFAULT_MIX}）")
+    parser.add_argument('--think', type=float, default=1.0, help="操作の間隔の平均（秒、指数分布）")
+    parser.add_argument('--ramp-up', type=float, default=2.0, help="全員が動き出すまでの秒数")
+    parser.add_argument('--latency', type=float, default=0.05, help="REST 呼び出し1回の遅延（秒）")
+    parser.add_argument('--jitter', type=float, default=0.02, help="遅延のばらつきの平均（秒）")
+    parser.add_argument('--route-limit', type=int, default=5, help="1ルートあたりの呼び出し上限（回）")
+    parser.add_argument('--route-period', type=float, default=2.0, help="1ルートあたりの上限の期間（秒）")
+    parser.add_argument('--global-limit', type=int, default=50, help="Bot 全体の1秒あたりの呼び出し上限")
+    parser.add_argument('--rate-limit-probability', type=float, default=0.0, help="ランダムに 429 を返す確率")
+    parser.add_argument('--initial-balance', type=int, default=1_000_000, help="模擬ユーザーの元手")
+    parser.add_argument('--animation', choices=('full', 'compact', 'off'), help="ちんちろの演出モード（既定: 環境変数）")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help="結果を JSON で出力")
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    home = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='zerobot-loadtest-') as workdir:
+        os.chdir(workdir)
+        try:
+            test = LoadTest(args)
+            # Bot 本体の print は標準エラーに回し、結果だけを標準出力に出す
+            with contextlib.redirect_stdout(sys.stderr):
+                test.setup()
+                report = asyncio.run(test.run())
+        finally:
+            os.chdir(home)
+
+    if args.json:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        print_report(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,224 @@
+"""Bot の動作指標（カウンター・ゲージ・ヒストグラム）と Prometheus 形式での公開
+
+コマンドの処理時間や保存時間、キューの長さなどを記録し、
+start_http_server で http://host:port/metrics として公開する。
+記録側（inc / observe）は辞書の更新だけなので、ホットパスから呼んでも軽い。
+aiohttp（discord.py の依存パッケージ）以外には依存しない。
+"""
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# 処理時間（秒）の既定のバケット
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _escape_help(text):
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape_label(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=(), function=None):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        # 値を読み出し時に計算する場合の関数（数値、またはラベル値のタプル → 数値の dict を返す）
+        self.function = function
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} のラベルは {self.labelnames} です: {sorted(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        """[(ラベル値のタプル, 値), ...]"""
+        if self.function is None:
+            with self._lock:
+                return sorted(self._values.items())
+        value = self.function()
+        if isinstance(value, dict):
+            return sorted(
+                ((key if isinstance(key, tuple) else (key,)), number) for key, number in value.items()
+            )
+        return [((), value)]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {_escape_help(self.help)}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in self._samples():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """増える一方の値（回数・バイト数など）"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError("Counter は減らせません")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """増減する現在値（キューの長さ・進行中のゲーム数など）"""
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def get(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class _HistogramValue:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(_Metric):
+    """値の分布（処理時間など）。バケットごとの件数と合計を持つ"""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = _HistogramValue(len(self.buckets))
+            # le（以下）で数えるので、値と等しい上限のバケットに入れる（+Inf 分は count から求める）
+            i = bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                entry.counts[i] += 1
+            entry.sum += value
+            entry.count += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """with ブロックの処理時間を記録する"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def snapshot(self, **labels):
+        """(バケットごとの件数, 合計, 件数)。バケットの件数は累積しない"""
+        entry = self._values.get(self._key(labels))
+        if entry is None:
+            return [0] * len(self.buckets), 0.0, 0
+        with self._lock:
+            return list(entry.counts), entry.sum, entry.count
+
+    def render(self):
+        lines = [f"# HELP {self.name} {_escape_help(self.help)}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            entries = sorted((key, list(entry.counts), entry.sum, entry.count) for key, entry in self._values.items())
+        for key, counts, total, count in entries:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                labels = _format_labels(self.labelnames, key, (('le', _format_value(float(bound))),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key, (('le', '+Inf'),))
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """指標の一覧。名前には prefix を付ける"""
+
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self._metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"同じ名前の指標が登録済みです: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labelnames=(), function=None):
+        return self._register(Counter(self.prefix + name, help_text, labelnames, function))
+
+    def gauge(self, name, help_text, labelnames=(), function=None):
+        return self._register(Gauge(self.prefix + name, help_text, labelnames, function))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self.prefix + name, help_text, labelnames, buckets))
+
+    def render(self):
+        """Prometheus のテキスト形式"""
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # 読み出し関数の失敗で他の指標まで見えなくならないようにする
+                lines.append(f"# {metric.name} の読み出しに失敗しました: {_escape_help(str(e))}")
+        return '\n'.join(lines) + '\n'
+
+
+async def start_http_server(registry, host='127.0.0.1', port=9108):
+    """/metrics を返す HTTP サーバーを起動し、停止用の AppRunner を返す"""
+    from aiohttp import web
+
+    async def handle_metrics(request):
+        return web.Response(body=registry.render().encode('utf-8'), headers={'Content-Type': CONTENT_TYPE})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    try:
+        await site.start()
+    except BaseException:
+        await runner.cleanup()
+        raise
+    return runner
@@ -0,0 +1,300 @@
+"""稼働中の Bot のプロファイル取得
+
+/プロファイル から使う。2つの方式がある。
+
+- sampling: 別スレッドから一定間隔で対象スレッド（イベントループ）のスタックを覗き、
+  collapsed 形式（flamegraph.pl / speedscope で読める "a;b;c 回数" の行）で保存する。
+  対象スレッドの処理を止めないので、本番のピーク中でも使える。
+  ただし GIL を持ったまま長く動く C の関数（json.dumps など）の中は覗けず、
+  その後に GIL を手放した箇所（多くはループの select）に数えられる。
+  select の割合が高いのに遅い場合は cprofile で確かめる。
+- cprofile: cProfile で関数ごとの呼び出し回数と時間を取り、pstats 形式で保存する。
+  正確だがループ上の処理がすべて遅くなる。
+
+スタックの取得（thread_stack / format_stack）はイベントループの監視（LoopWatchdog）でも使う。
+Discord に依存しない。
+"""
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import NamedTuple
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def thread_stack(thread_id):
+    """スレッドの現在のスタック（外側 → 内側の (ファイル名, 行番号, 関数名) のタプル）。無ければ None"""
+    frame = sys._current_frames().get(thread_id)
+    if frame is None:
+        return None
+    stack = []
+    while frame is not None:
+        stack.append((frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name))
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
+
+
+def format_stack(stack, limit=None):
+    """thread_stack の戻り値を traceback と同じような複数行の文字列にする（limit は内側から数えた段数）"""
+    frames = stack[-limit:] if limit else stack
+    return '\n'.join(f'  File "{filename}", line {lineno}, in {name}' for filename, lineno, name in frames)
+
+
+class StackSampler:
+    """対象スレッドのスタックを別スレッドから一定間隔で数える"""
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()     # (関数ラベル, ...)（外側 → 内側） → 回数
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        labels = {}     # コードオブジェクト → ラベル（毎回文字列を作らない）
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                label = labels.get(code)
+                if label is None:
+                    label = labels[code] = _frame_label(code)
+                stack.append(label)
+                frame = frame.f_back
+            stack.reverse()
+            self.stacks[tuple(stack)] += 1
+            self.samples += 1
+
+    def write_collapsed(self, path):
+        """collapsed 形式（1行1スタック）で保存する"""
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{';'.join(label.replace(';', ',') for label in stack)} {count}\n")
+
+    def top(self, n=15):
+        """[(関数ラベル, 自分の割合, 呼び出し先を含めた割合), ...] を自分の割合の大きい順に"""
+        own = Counter()
+        total = Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for label in set(stack):
+                total[label] += count
+        samples = self.samples or 1
+        return [(label, count / samples, total[label] / samples) for label, count in own.most_common(n)]
+
+    def summary(self, n=15):
+        lines = [f"{'self':>6} {'total':>6}  関数"]
+        for label, own, total in self.top(n):
+            lines.append(f"{own * 100:5.1f}% {total * 100:5.1f}%  {label}")
+        return '\n'.join(lines)
+
+
+class ProfileCapture:
+    """cProfile による計測（start したスレッドの処理だけが対象）"""
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.stats = None
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        self.stats = pstats.Stats(self.profile, stream=io.StringIO())
+
+    def write_pstats(self, path):
+        self.stats.dump_stats(path)
+
+    def top(self, n=15):
+        """[(関数ラベル, 呼び出し回数, 自分の時間, 呼び出し先を含めた時間), ...] を自分の時間の大きい順に"""
+        rows = []
+        for (filename, lineno, name), (_, calls, own, cumulative, _) in self.stats.stats.items():
+            label = f"{name} ({os.path.basename(filename)}:{lineno})" if lineno else name
+            rows.append((label, calls, own, cumulative))
+        rows.sort(key=lambda row: row[2], reverse=True)
+        return rows[:n]
+
+    def summary(self, n=15):
+        lines = [f"{'tottime':>8} {'cumtime':>8} {'ncalls':>8}  関数"]
+        for label, calls, own, cumulative in self.top(n):
+            lines.append(f"{own:8.3f} {cumulative:8.3f} {calls:8d}  {label}")
+        return '\n'.join(lines)
+
+
+def output_path(directory, mode, now=None):
+    """保存先のファイル名（profiles/profile-20250101-120000-sampling.collapsed など）"""
+    stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(now))
+    extension = 'collapsed' if mode == 'sampling' else 'pstats'
+    return os.path.join(directory, f"profile-{stamp}-{mode}.{extension}")
+
+
+# 監視の記録でライブラリ側とみなす場所（どこで止まったかは自分のコードの行で数える）
+_STDLIB_DIR = os.path.dirname(os.__file__)
+
+
+def _is_library(filename):
+    return filename.startswith(_STDLIB_DIR) or 'site-packages' in filename or filename.startswith('<')
+
+
+def blocking_site(stack, depth=3):
+    """スタックのうち、止まっていた箇所を表すラベル
+
+    自分のコードの内側 depth 段（外側 > 内側）と、その先のライブラリの一番内側の関数。
+    """
+    if not stack:
+        return '(不明)'
+    label = lambda frame: f"{frame[2]} ({os.path.basename(frame[0])}:{frame[1]})"
+    own = [index for index, frame in enumerate(stack) if not _is_library(frame[0])]
+    if not own:
+        return label(stack[-1])
+    parts = [label(stack[index]) for index in own[-depth:]]
+    if own[-1] != len(stack) - 1:
+        parts.append(label(stack[-1]))
+    return ' > '.join(parts)
+
+
+class BlockingEvent(NamedTuple):
+    """イベントループが止まっていた1回分"""
+    started: float          # 止まり始めた時刻（time.time()）
+    duration: float         # 止まっていた秒数（予定より遅れた分）
+    stack: tuple            # 閾値を超えた時点のループのスレッドのスタック（thread_stack の戻り値）
+    context: object         # その時点の context() の戻り値（実行中のコマンドなど）
+
+    @property
+    def site(self):
+        return blocking_site(self.stack)
+
+
+class LoopWatchdog:
+    """イベントループの遅れを常に測り、閾値を超えて止まったときのスタックを記録する
+
+    ループ上のタスクが interval ごとに時刻を記録し、予定より遅れた分を on_lag に渡す。
+    別スレッドがその時刻を見張り、threshold 秒以上遅れたらループのスレッドのスタックと
+    context() の戻り値を取る。ループが再開したら BlockingEvent として on_block に渡す
+    （on_block は監視スレッドから呼ばれる）。止まった箇所ごとの回数と時間も集計する。
+    StackSampler と同じく、GIL を持ったまま動く C の関数の中では監視スレッドも動けない。
+    """
+
+    def __init__(self, threshold=0.25, interval=0.05, context=None, on_lag=None, on_block=None, history=100):
+        self.threshold = threshold
+        self.interval = interval
+        self.context = context
+        self.on_lag = on_lag
+        self.on_block = on_block
+        self.events = deque(maxlen=history)     # 直近の BlockingEvent
+        self.offenders = {}                     # 止まった箇所 → [回数, 合計秒数, 最大秒数, 最大のときの BlockingEvent]
+        self.max_lag = 0.0
+        self.thread_id = None
+        self.loop = None
+        self._beat = None
+        self._task = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """ループのスレッド（コルーチンの中）から呼ぶ"""
+        self.thread_id = threading.get_ident()
+        self.loop = asyncio.get_running_loop()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = self.loop.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._run, name='loop-watchdog', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._beat = now
+            lag = max(0.0, now - expected)
+            if lag > self.max_lag:
+                self.max_lag = lag
+            if self.on_lag:
+                self.on_lag(lag)
+
+    def _run(self):
+        stall = None    # 止まっている間: (最後の拍の時刻, 時刻, スタック, context)
+        check = min(self.interval, self.threshold / 4)
+        while not self._stop.wait(check):
+            beat = self._beat
+            if stall is not None:
+                if beat == stall[0]:
+                    continue
+                # 再開した: 最後の拍から次の拍までのうち、予定の間隔を超えた分が止まっていた時間
+                self._record(BlockingEvent(stall[1], max(0.0, beat - stall[0] - self.interval), stall[2], stall[3]))
+                stall = None
+                continue
+            behind = time.monotonic() - beat - self.interval
+            if behind < self.threshold:
+                continue
+            stack = thread_stack(self.thread_id)
+            context = None
+            if self.context:
+                try:
+                    context = self.context()
+                except Exception:
+                    # 記録の補足情報なので、取れなくてもスタックだけは残す
+                    pass
+            stall = (beat, time.time() - behind, stack, context)
+
+    def _record(self, event):
+        site = event.site
+        with self._lock:
+            self.events.append(event)
+            entry = self.offenders.get(site)
+            if entry is None:
+                entry = self.offenders[site] = [0, 0.0, 0.0, None]
+            entry[0] += 1
+            entry[1] += event.duration
+            if event.duration >= entry[2]:
+                entry[2] = event.duration
+                entry[3] = event
+        if self.on_block:
+            self.on_block(event)
+
+    def worst(self, n=10):
+        """[(止まった箇所, 回数, 合計秒数, 最大秒数, 最大のときの BlockingEvent), ...] を合計秒数の大きい順に"""
+        with self._lock:
+            rows = [(site, *entry) for site, entry in self.offenders.items()]
+        rows.sort(key=lambda row: row[2], reverse=True)
+        return rows[:n]
+
+    def summary(self, n=10):
+        lines = [f"{'total':>8} {'max':>7} {'count':>6}  箇所"]
+        for site, count, total, longest, _ in self.worst(n):
+            lines.append(f"{total:7.2f}s {longest:6.2f}s {count:6d}  {site}")
+        return '\n'.join(lines)
@@ -0,0 +1,1372 @@
+"""Z通貨の台帳（ユーザー・取引履歴）の保存先
+
+ZCurrencyBot はメモリ上のユーザーデータを正として読み書きし、変更は
+ジャーナルレコード（dict）として永続化スレッドからここへ渡される。
+保存先は STORAGE_BACKEND で切り替える:
+
+- json:   スナップショット（バイナリまたは JSON）＋追記型ジャーナル
+- sqlite: SQLite（WALモード）の users / transactions テーブル
+"""
+import argparse
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import zlib
+from array import array
+from datetime import datetime, timedelta
+
+from ledger_index import HistoryPage
+
+
+# 種別ごとの累計に加えて、ユーザーごとの累計も持つ取引種別
+USER_TOTAL_TYPES = ('chinchin', 'transfer_in', 'transfer_out', 'role_issue')
+
+
+class UserAccount:
+    """1ユーザー分の残高と累計
+
+    ユーザーごとの dict の代わりに __slots__ で持ち、参加日時はエポックからのマイクロ秒
+    （joined_at）で持つ。既存の呼び出し側のために user['balance'] のような dict と同じ
+    読み書きもでき、'join_date' は従来どおり isoformat() の文字列になる。
+    """
+    __slots__ = ('balance', 'total_earned', 'total_spent', 'joined_at')
+    KEYS = ('balance', 'total_earned', 'total_spent', 'join_date')
+
+    def __init__(self, balance, total_earned, total_spent, joined_at):
+        self.balance = balance
+        self.total_earned = total_earned
+        self.total_spent = total_spent
+        # 整数にできない古い形式の日時は文字列のまま持つ
+        self.joined_at = joined_at
+
+    @classmethod
+    def from_dict(cls, record):
+        return cls(record['balance'], record['total_earned'], record['total_spent'],
+                   _parse_join_date(record['join_date']))
+
+    @property
+    def join_date(self):
+        if isinstance(self.joined_at, str):
+            return self.joined_at
+        return _int_to_timestamp(self.joined_at)
+
+    @join_date.setter
+    def join_date(self, value):
+        self.joined_at = _parse_join_date(value)
+
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.KEYS
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+    def __eq__(self, other):
+        if isinstance(other, UserAccount):
+            return (self.balance, self.total_earned, self.total_spent, self.joined_at) == \
+                (other.balance, other.total_earned, other.total_spent, other.joined_at)
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def __repr__(self):
+        return f"UserAccount({self.to_dict()!r})"
+
+    def keys(self):
+        return self.KEYS
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.KEYS else default
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.KEYS]
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.KEYS}
+
+    def copy(self):
+        return UserAccount(self.balance, self.total_earned, self.total_spent, self.joined_at)
+
+
+def _parse_join_date(value):
+    try:
+        return _timestamp_to_int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def _to_json(value):
+    """json.dumps の default（UserAccount を dict にする）"""
+    if isinstance(value, UserAccount):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def new_user_record(initial_balance, join_date):
+    """新規ユーザーのデータ"""
+    return UserAccount(initial_balance, initial_balance, 0, _parse_join_date(join_date))
+
+
+def new_stats():
+    """取引の累計（ランキング・統計用）
+
+    types: 種別 → {'count': 件数, 'earned': 入金合計, 'spent': 出金合計}
+    users: USER_TOTAL_TYPES の種別 → {user_id: 増減の合計}
+    """
+    return {'types': {}, 'users': {transaction_type: {} for transaction_type in USER_TOTAL_TYPES}}
+
+
+def add_to_stats(stats, user_id, amount, transaction_type):
+    """1件の取引を累計に加える"""
+    totals = stats['types'].get(transaction_type)
+    if totals is None:
+        totals = stats['types'][transaction_type] = {'count': 0, 'earned': 0, 'spent': 0}
+    totals['count'] += 1
+    if amount > 0:
+        totals['earned'] += amount
+    else:
+        totals['spent'] += abs(amount)
+    per_user = stats['users'].get(transaction_type)
+    if per_user is not None:
+        per_user[user_id] = per_user.get(user_id, 0) + amount
+
+
+def copy_stats(stats):
+    """スナップショット用のコピー"""
+    return {
+        'types': {transaction_type: dict(totals) for transaction_type, totals in stats['types'].items()},
+        'users': {transaction_type: dict(per_user) for transaction_type, per_user in stats['users'].items()}
+    }
+
+
+def freeze_accounts(users, originals):
+    """スナップショット用に各ユーザーをコピーする（永続化スレッドから呼ぶ）
+
+    users はスナップショットを取った時点のユーザー辞書の浅いコピー、originals はその後に
+    ループ側が変更する直前に残した変更前のコピー（user_id → UserAccount）。
+    ループは「originals に残す → 変更する」の順に行うので、ここでは先に現在の値をコピーし、
+    その後で originals を確かめる（変更が始まっていれば必ず originals に入っている）。
+    """
+    frozen = {}
+    for user_id, account in users.items():
+        current = account.copy()
+        frozen[user_id] = originals.get(user_id, current)
+    return frozen
+
+
+class LedgerStorage:
+    """台帳の保存先の共通インターフェース
+
+    load() は起動時にメインスレッドから、それ以外は永続化スレッドから呼ばれる。
+    """
+    name = 'base'
+    # 取引履歴をメモリ上にも保持する必要があるか（スナップショットに含めるため）
+    in_memory_transactions = True
+    # compact() にメモリ上のデータのコピーを渡す必要があるか
+    wants_snapshot = False
+
+    def load(self):
+        """{'users': {...}, 'transactions': [...], 'stats': {...}, 'journal_seq': n} を返す"""
+        raise NotImplementedError
+
+    def write_batch(self, records):
+        """ジャーナルレコードをまとめて耐久化する"""
+        raise NotImplementedError
+
+    def needs_compaction(self):
+        """compact() を実行すべき状態か"""
+        return False
+
+    def read_history(self, user_id, transaction_type=None, start_date=None, end_date=None,
+                     before=None, after=None, limit=10):
+        """取引履歴の1ページ（in_memory_transactions でない保存先だけが実装する）"""
+        raise NotImplementedError
+
+    def read_archived_page(self, user_id, transaction_type=None, start_date=None, end_date=None,
+                           before=None, after=None, limit=10):
+        """メモリ上の範囲から外れた（アーカイブ済みの）取引の1ページ（in_memory_transactions の保存先だけが実装する）"""
+        return []
+
+    def compact(self, snapshot, records):
+        """未確定の records を書き出した上で、保存領域を圧縮する（書き出したバイト数を返す。失敗したら例外を送出する）"""
+        if records:
+            self.write_batch(records)
+        return 0
+
+    def close(self):
+        pass
+
+
+# アーカイブの gzip メンバー1つあたりの取引数（索引から1件読む時に展開する量の上限）
+ARCHIVE_MEMBER_ENTRIES = 64
+
+
+def _gzip_members(path, start=0):
+    """gzip ファイルの start 以降のメンバーを順に (先頭の位置, 行のリスト) で返す
+
+    途中で切れたメンバー（書き込み中に落ちた末尾）に当たったらそこで止める。
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = memoryview(f.read())
+    position = 0
+    while position < len(data):
+        decompressor = zlib.decompressobj(wbits=31)
+        parts = []
+        cursor = position
+        while not decompressor.eof and cursor < len(data):
+            chunk = data[cursor:cursor + 65536]
+            parts.append(decompressor.decompress(chunk))
+            cursor += len(chunk)
+        if not decompressor.eof:
+            print(f"⚠️ {path} の末尾（{start + position} バイト目以降）が壊れているため索引に含めません")
+            return
+        # ensure_ascii=False の JSON は U+2028 などをそのまま含むので、splitlines ではなく改行だけで分ける
+        yield start + position, b''.join(parts).decode('utf-8').split('\n')[:-1]
+        position = cursor - len(decompressor.unused_data)
+
+
+def _read_gzip_member(path, offset):
+    """offset から始まる gzip メンバー1つ分の行"""
+    decompressor = zlib.decompressobj(wbits=31)
+    parts = []
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while not decompressor.eof:
+            chunk = f.read(16384)
+            if not chunk:
+                break
+            parts.append(decompressor.decompress(chunk))
+    return b''.join(parts).decode('utf-8').split('\n')[:-1]
+
+
+def _write_gzip_members(f, entries):
+    """取引を ARCHIVE_MEMBER_ENTRIES 件ずつ別の gzip メンバーとして書き、(先頭の位置, 取引のリスト) を返す"""
+    members = []
+    for start in range(0, len(entries), ARCHIVE_MEMBER_ENTRIES):
+        chunk = entries[start:start + ARCHIVE_MEMBER_ENTRIES]
+        offset = f.tell()
+        with gzip.GzipFile(fileobj=f, mode='ab') as gz:
+            gz.write(''.join(json.dumps(t, ensure_ascii=False) + '\n' for t in chunk).encode('utf-8'))
+        members.append((offset, chunk))
+    return members
+
+
+class ArchiveIndex:
+    """アーカイブ済みの取引の索引（archive_dir/index.sqlite）
+
+    取引ごとに 連番 → (日付, gzip メンバーの先頭の位置, メンバー内の行) を持ち、ユーザーごと・
+    ユーザー×種別ごとの連番順の索引から /履歴 の1ページ分だけを引く。ファイルごとに索引済みの
+    大きさも持ち、索引の前に落ちて取り残された末尾は次の起動時に索引し直す。
+    書き込みは永続化スレッド、読み出しは Bot のアーカイブ読み出し用スレッドから行うので、接続はスレッドごとに持つ。
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS archived (
+        seq INTEGER PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        type TEXT NOT NULL,
+        date TEXT NOT NULL,
+        offset INTEGER NOT NULL,
+        line INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_archived_user ON archived (user_id, seq);
+    CREATE INDEX IF NOT EXISTS idx_archived_user_type ON archived (user_id, type, seq);
+    CREATE TABLE IF NOT EXISTS archive_files (
+        date TEXT PRIMARY KEY,
+        size INTEGER NOT NULL
+    );
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # 失っても次の起動時にファイルの大きさの差から索引し直せる
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(self.SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def indexed_sizes(self):
+        """日付 → 索引済みのファイルの大きさ（バイト）"""
+        return dict(self._conn().execute('SELECT date, size FROM archive_files'))
+
+    def add(self, date, members, start, size):
+        """書き込んだメンバー（_write_gzip_members / _gzip_members の戻り値）を索引し、ファイルの大きさを記録する
+
+        start は書き込む前のファイルの大きさ。索引済みの大きさと食い違う（間に索引できなかった分がある）
+        場合は大きさを進めず、次の起動時の sync に索引し直させる。
+        """
+        rows = [
+            (t['seq'], t['user_id'], t['type'], date, offset, line)
+            for offset, entries in members for line, t in enumerate(entries) if 'seq' in t
+        ]
+        conn = self._conn()
+        conn.execute('BEGIN')
+        try:
+            # 退避直後に落ちて二重に書かれた取引は、先に索引したものを使う
+            conn.executemany(
+                'INSERT OR IGNORE INTO archived (seq, user_id, type, date, offset, line) VALUES (?, ?, ?, ?, ?, ?)', rows
+            )
+            updated = conn.execute(
+                'UPDATE archive_files SET size = ? WHERE date = ? AND size = ?', (size, date, start)
+            ).rowcount
+            if not updated and start == 0:
+                conn.execute('INSERT OR IGNORE INTO archive_files (date, size) VALUES (?, ?)', (date, size))
+            conn.execute('COMMIT')
+        except:
+            conn.execute('ROLLBACK')
+            raise
+
+    def forget(self, date):
+        """ファイルを書き換えた日の索引を消す（次の sync で索引し直す）"""
+        conn = self._conn()
+        conn.execute('BEGIN')
+        conn.execute('DELETE FROM archived WHERE date = ?', (date,))
+        conn.execute('DELETE FROM archive_files WHERE date = ?', (date,))
+        conn.execute('COMMIT')
+
+    def page(self, user_id, transaction_type=None, start_date=None, end_date=None, before=None, after=None, limit=10):
+        """[(連番, 日付, メンバーの位置, 行), ...]（before か両方無しなら新しい順、after なら古い順）"""
+        conditions = ['user_id = ?']
+        params = [str(user_id)]
+        if transaction_type:
+            conditions.append('type = ?')
+            params.append(transaction_type)
+        if start_date:
+            conditions.append('date >= ?')
+            params.append(start_date)
+        if end_date:
+            conditions.append('date <= ?')
+            params.append(end_date)
+        if after is not None:
+            conditions.append('seq > ?')
+            params.append(after)
+            order = 'ASC'
+        else:
+            if before is not None:
+                conditions.append('seq < ?')
+                params.append(before)
+            order = 'DESC'
+        return self._conn().execute(
+            f"SELECT seq, date, offset, line FROM archived WHERE {' AND '.join(conditions)} ORDER BY seq {order} LIMIT ?",
+            (*params, limit)
+        ).fetchall()
+
+
+class JsonLedgerStorage(LedgerStorage):
+    """スナップショット＋追記型ジャーナル（JSON lines）
+
+    スナップショットは snapshot_format が 'binary' なら snapshot_file に、'json' なら data_file に書く。
+    読み込みは設定した形式のファイルを優先し、無ければもう一方の形式から読む。
+    """
+    name = 'json'
+    wants_snapshot = True
+
+    def __init__(self, data_file, journal_file, initial_balance=0, compact_bytes=4 * 1024 * 1024,
+                 archive_dir=None, transaction_window=None, snapshot_file=None, snapshot_format='json'):
+        self.data_file = data_file
+        self.snapshot_file = snapshot_file
+        self.snapshot_format = snapshot_format if snapshot_file else 'json'
+        self.journal_file = journal_file
+        self.initial_balance = initial_balance
+        self.compact_bytes = compact_bytes
+        # メモリ（とスナップショット）に残す直近の取引数。古いものは archive_dir へ退避する
+        self.archive_dir = archive_dir
+        self.transaction_window = transaction_window
+        self._archive_index = None
+
+    def _snapshot_paths(self):
+        """(設定した形式のファイル, もう一方の形式のファイル)"""
+        if self.snapshot_format == 'binary':
+            return self.snapshot_file, self.data_file
+        return self.data_file, self.snapshot_file
+
+    def snapshot_exists(self):
+        return any(path and os.path.exists(path) for path in self._snapshot_paths())
+
+    def _previous_journal(self):
+        """直前の compact で退避したジャーナル（.backup のスナップショットからの差分）"""
+        return f"{self.journal_file}.prev"
+
+    def load(self):
+        """スナップショットを読み込み、ジャーナルを再生する
+
+        スナップショットが読めなければ .backup（1つ前のスナップショット）と退避したジャーナルから
+        復元する。どちらも読めない・差分が揃わない場合は、残高を失わないよう例外を送出して起動を止める。
+        """
+        data = {'users': {}, 'transactions': [], 'stats': new_stats(), 'journal_seq': 0}
+        journals = [self.journal_file]
+        path = next((path for path in self._snapshot_paths()
+                     if path and (os.path.exists(path) or os.path.exists(f"{path}.backup"))), None)
+        if path:
+            data, from_backup = self._read_snapshot(path)
+            if from_backup:
+                journals = [self._previous_journal(), self.journal_file]
+        if 'stats' not in data:
+            data['stats'] = self._rebuild_stats(data)
+
+        # スナップショット以降のジャーナルを再生
+        base = data['journal_seq']
+        applied = self._replay(data, journals)
+        if journals[0] != self.journal_file and applied and min(applied) != base + 1:
+            raise RuntimeError(
+                f"{path}.backup の後の変更（連番 {base + 1}〜{min(applied) - 1}）がジャーナルに無いため起動を中止します。"
+                "スナップショットを手動で復旧してください"
+            )
+        if applied:
+            print(f"ジャーナルから {len(applied)} 件の変更を再生しました")
+        legacy = self._assign_legacy_seqs(data)
+        if self._trim_window(data) or legacy:
+            # 振った連番を保存し、アーカイブに移した旧形式の取引をスナップショットから外す
+            try:
+                self.compact(data, [])
+            except Exception as e:
+                print(f"⚠️ 読み込み後のスナップショットの保存に失敗しました: {e}")
+        self._sync_archive_index()
+        return data
+
+    def _read_snapshot(self, path):
+        """(スナップショット, .backup から読んだか)。どちらも読めなければ例外を送出する"""
+        for candidate in (path, f"{path}.backup"):
+            if not os.path.exists(candidate):
+                continue
+            if candidate != path and not os.path.exists(self._previous_journal()):
+                # 1つ前のスナップショットだけでは直近の変更が欠けるので使わない
+                print(f"⚠️ {candidate} 以降のジャーナルが無いため、バックアップからは復元できません")
+                continue
+            try:
+                data = read_snapshot_file(candidate, accounts=True)
+                data.setdefault('journal_seq', 0)
+            except (OSError, ValueError, KeyError, TypeError, IndexError, zlib.error) as e:
+                print(f"⚠️ スナップショット {candidate} を読めません: {e}")
+                continue
+            if candidate != path:
+                print(f"⚠️ バックアップ {candidate} から復元します")
+            return data, candidate != path
+        raise RuntimeError(f"スナップショット {path} もバックアップも読めないため起動を中止します（台帳を空にはしません）")
+
+    def _replay(self, data, paths):
+        """ジャーナルのうちスナップショットより後のレコードを適用し、適用した連番を返す
+
+        書き込みに失敗して再送したレコードは後から（重複して）書かれることがあるので、
+        直前の連番ではなく適用済みの集合で判定する。
+        """
+        base = data['journal_seq']
+        applied = set()
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 書き込み途中で落ちた末尾行は捨てる
+                        break
+                    seq = record['seq']
+                    if seq <= base or seq in applied:
+                        continue
+                    apply_record(data, record, self.initial_balance)
+                    applied.add(seq)
+                    data['journal_seq'] = max(data['journal_seq'], seq)
+        return applied
+
+    def _assign_legacy_seqs(self, data):
+        """連番（seq）の無い旧形式の取引に、既存の連番より前の負の連番を古い順に振る
+
+        /履歴 のページ位置は連番で表すので、無いままだと全件が同じ位置になる。
+        アーカイブ済みのものも一度だけ振り直して書き換え、archive_dir の legacy_seq に
+        振った最小の連番を残す（以降の起動ではアーカイブを走査しない）。
+        スナップショットの取引に振った場合は True
+        """
+        legacy = [t for t in data['transactions'] if 'seq' not in t]
+        rewrite = {}    # 日付 → その日のファイルの全取引（連番の無いものを含む日だけ）
+        lowest = 0
+        marker = os.path.join(self.archive_dir, 'legacy_seq') if self.archive_dir else None
+        if marker and os.path.exists(marker):
+            try:
+                with open(marker, 'r', encoding='utf-8') as f:
+                    lowest = min(int(f.read().strip() or 0), 0)
+            except (OSError, ValueError):
+                pass
+        elif marker:
+            for date in self._archive_dates():
+                with gzip.open(self._archive_path(date), 'rt', encoding='utf-8') as f:
+                    entries = [json.loads(line) for line in f]
+                if any('seq' not in t for t in entries):
+                    rewrite[date] = entries
+
+        pending = [t for date in sorted(rewrite) for t in rewrite[date] if 'seq' not in t] + legacy
+        seq = lowest - len(pending)
+        for transaction in pending:
+            transaction['seq'] = seq
+            seq += 1
+        for date, entries in rewrite.items():
+            self._rewrite_archive(date, entries)
+        if marker:
+            os.makedirs(self.archive_dir, exist_ok=True)
+            with open(marker, 'w', encoding='utf-8') as f:
+                f.write(str(min(lowest - len(pending), 0)))
+        if pending:
+            print(f"連番の無い旧形式の取引 {len(pending)} 件に連番を振りました")
+        return bool(legacy)
+
+    def _rebuild_stats(self, data):
+        """累計を持たない旧形式のスナップショット用に、アーカイブと履歴から累計を作り直す"""
+        stats = new_stats()
+        recent = {t['seq'] for t in data['transactions'] if 'seq' in t}
+        for transaction in self.read_archived_transactions():
+            seq = transaction.get('seq')
+            # スナップショットにも残っているもの・スナップショットより後（ジャーナルで再生される）ものは除く
+            if seq is not None and (seq in recent or seq > data['journal_seq']):
+                continue
+            add_to_stats(stats, transaction['user_id'], transaction['amount'], transaction['type'])
+        for transaction in data['transactions']:
+            add_to_stats(stats, transaction['user_id'], transaction['amount'], transaction['type'])
+        return stats
+
+    def _trim_window(self, data):
+        """読み込んだ取引履歴を直近の範囲に切り詰め、はみ出した分をアーカイブする
+
+        旧形式の取引（負の連番）を移した場合は True（二重に退避しないよう、すぐにスナップショットから外す）
+        """
+        if not self.transaction_window or len(data['transactions']) <= self.transaction_window:
+            return False
+        overflow = data['transactions'][:-self.transaction_window]
+        data['transactions'] = data['transactions'][-self.transaction_window:]
+
+        # 実行中に退避済みのもの（連番が記録済み以下）は書き直さない
+        archived_seq = self._read_archived_seq()
+        pending = [t for t in overflow if t['seq'] > archived_seq or t['seq'] < 0]
+        if pending:
+            self._write_archive(pending)
+            print(f"取引履歴 {len(pending)} 件をアーカイブに移しました")
+        return any(t['seq'] < 0 for t in overflow)
+
+    def write_batch(self, records):
+        """アーカイブ分を先に書き、ジャーナルに追記してバッチ単位で fsync する"""
+        archived = [record['transaction'] for record in records if record['op'] == 'archive']
+        if archived:
+            self._write_archive(archived)
+        lines = [json.dumps(record, ensure_ascii=False) for record in records if record['op'] != 'archive']
+        if not lines:
+            return
+        with open(self.journal_file, 'a', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _archive_path(self, date):
+        return os.path.join(self.archive_dir, f"transactions-{date}.jsonl.gz")
+
+    def _read_archived_seq(self):
+        try:
+            with open(os.path.join(self.archive_dir, 'archived_seq'), 'r', encoding='utf-8') as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _index(self):
+        if self._archive_index is None:
+            os.makedirs(self.archive_dir, exist_ok=True)
+            self._archive_index = ArchiveIndex(os.path.join(self.archive_dir, 'index.sqlite'))
+        return self._archive_index
+
+    def _write_archive(self, transactions):
+        """取引を日付ごとの gzip ファイルに追記し（ARCHIVE_MEMBER_ENTRIES 件ごとに1つの gzip メンバー）、索引する"""
+        os.makedirs(self.archive_dir, exist_ok=True)
+        index = self._index()
+        by_date = {}
+        for transaction in transactions:
+            by_date.setdefault(transaction['timestamp'][:10], []).append(transaction)
+        for date, entries in by_date.items():
+            with open(self._archive_path(date), 'ab') as raw:
+                start = raw.tell()
+                members = _write_gzip_members(raw, entries)
+                raw.flush()
+                os.fsync(raw.fileno())
+                size = raw.tell()
+            index.add(date, members, start, size)
+
+        archived_seq = max((t.get('seq', 0) for t in transactions), default=0)
+        if archived_seq > self._read_archived_seq():
+            marker = os.path.join(self.archive_dir, 'archived_seq')
+            with open(f"{marker}.tmp", 'w', encoding='utf-8') as f:
+                f.write(str(archived_seq))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(f"{marker}.tmp", marker)
+
+    def _rewrite_archive(self, date, entries):
+        """その日のファイルを entries で置き換える（索引は次の sync で作り直す）"""
+        path = self._archive_path(date)
+        with open(f"{path}.tmp", 'wb') as f:
+            _write_gzip_members(f, entries)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{path}.tmp", path)
+        self._index().forget(date)
+
+    def _sync_archive_index(self):
+        """索引に無いアーカイブ（索引を持たない版で書いたファイル・索引の前に落ちた末尾）を索引する"""
+        dates = self._archive_dates()
+        if not dates:
+            return
+        index = self._index()
+        sizes = index.indexed_sizes()
+        indexed = 0
+        for date in dates:
+            path = self._archive_path(date)
+            start = sizes.get(date, 0)
+            size = os.path.getsize(path)
+            if start == size:
+                continue
+            if start > size or start == 0:
+                # 書き換えられたか、まだ索引していないファイル
+                index.forget(date)
+                start = 0
+            members = [(offset, [json.loads(line) for line in lines]) for offset, lines in _gzip_members(path, start)]
+            if start == 0 and any(len(entries) > ARCHIVE_MEMBER_ENTRIES for _, entries in members):
+                # 以前は1回の退避を1つのメンバーに書いていた。1件読むために大きく展開しないよう分け直す
+                self._rewrite_archive(date, [t for _, entries in members for t in entries])
+                members = [(offset, [json.loads(line) for line in lines]) for offset, lines in _gzip_members(path)]
+                size = os.path.getsize(path)
+            index.add(date, members, start, size)
+            indexed += sum(len(entries) for _, entries in members)
+        if indexed:
+            print(f"アーカイブの取引 {indexed} 件を索引しました")
+
+    def _archive_dates(self):
+        """アーカイブのある日付（古い順）"""
+        if not self.archive_dir or not os.path.isdir(self.archive_dir):
+            return []
+        return sorted(
+            name[len('transactions-'):-len('.jsonl.gz')]
+            for name in os.listdir(self.archive_dir)
+            if name.startswith('transactions-') and name.endswith('.jsonl.gz')
+        )
+
+    def read_archived_page(self, user_id, transaction_type=None, start_date=None, end_date=None,
+                           before=None, after=None, limit=10):
+        """アーカイブ済みの取引から最大 limit 件
+
+        before（または両方無し）: その連番より古いものを新しい順に / after: その連番より新しいものを古い順に。
+        索引で位置を引き、該当する gzip メンバーだけを展開する（アーカイブの量によらずページの件数分）。
+        書き込み（永続化スレッド）と並行して呼んでよい。
+        """
+        if not self.archive_dir or not os.path.isdir(self.archive_dir):
+            return []
+        rows = self._index().page(user_id, transaction_type, start_date, end_date, before, after, limit)
+        members = {}    # (日付, メンバーの位置) → {行: 連番}
+        for seq, date, offset, line in rows:
+            members.setdefault((date, offset), {})[line] = seq
+        found = {}
+        for (date, offset), lines in members.items():
+            for number, line in enumerate(_read_gzip_member(self._archive_path(date), offset)):
+                if number in lines:
+                    found[lines[number]] = json.loads(line)
+        return [found[seq] for seq, _, _, _ in rows if seq in found]
+
+    def read_archived_transactions(self, start_date=None, end_date=None, user_id=None):
+        """アーカイブ済みの取引を古い順に読み出す（日付は 'YYYY-MM-DD'、両端を含む）"""
+        seen = set()
+        for date in self._archive_dates():
+            if (start_date and date < start_date) or (end_date and date > end_date):
+                continue
+            with gzip.open(self._archive_path(date), 'rt', encoding='utf-8') as f:
+                for line in f:
+                    transaction = json.loads(line)
+                    if user_id is not None and transaction['user_id'] != str(user_id):
+                        continue
+                    # 退避直後に落ちた場合の重複を除く
+                    seq = transaction.get('seq')
+                    if seq is not None:
+                        if seq in seen:
+                            continue
+                        seen.add(seq)
+                    yield transaction
+
+    def journal_size(self):
+        """ジャーナルファイルのサイズ（バイト）"""
+        try:
+            return os.path.getsize(self.journal_file)
+        except OSError:
+            return 0
+
+    def needs_compaction(self):
+        return self.journal_size() >= self.compact_bytes
+
+    def _encode(self, snapshot):
+        """(書き込み先, 中身のバイト列)"""
+        if self.snapshot_format == 'binary':
+            try:
+                return self.snapshot_file, encode_snapshot(snapshot)
+            except ValueError as e:
+                print(f"⚠️ バイナリ形式にできないため JSON で保存します: {e}")
+        return self.data_file, json.dumps(snapshot, ensure_ascii=False, indent=2, default=_to_json).encode('utf-8')
+
+    def compact(self, snapshot, records):
+        """スナップショットを書き出してジャーナルを切り詰める"""
+        # スナップショットと同時に渡された未確定分も念のため先に確定
+        if records:
+            self.write_batch(records)
+        path, payload = self._encode(snapshot)
+        try:
+            # バックアップを作成
+            if os.path.exists(path):
+                backup_file = f"{path}.backup"
+                shutil.copy2(path, backup_file)
+
+            # 一時ファイルに書き込み
+            temp_file = f"{path}.tmp"
+            with open(temp_file, 'wb') as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+
+            # 原子的な置換
+            if os.path.exists(temp_file):
+                os.replace(temp_file, path)
+
+            # もう一方の形式の古いスナップショットは読まれないよう退避する
+            for other in self._snapshot_paths():
+                if other and other != path and os.path.exists(other):
+                    os.replace(other, f"{other}.migrated")
+
+            # スナップショットに取り込んだのでジャーナルは空にしてよい。.backup からの復元用に
+            # 1世代だけ退避しておく（途中で落ちても journal_seq 以下のレコードは再生時にスキップされる）
+            if os.path.exists(self.journal_file):
+                os.replace(self.journal_file, self._previous_journal())
+            with open(self.journal_file, 'w', encoding='utf-8'):
+                pass
+            return len(payload)
+
+        except Exception as e:
+            print(f"データ保存エラー: {e}")
+            # バックアップから復元を試行
+            backup_file = f"{path}.backup"
+            if os.path.exists(backup_file):
+                try:
+                    shutil.copy2(backup_file, path)
+                    print("バックアップから復元しました")
+                except:
+                    print("バックアップからの復元も失敗しました")
+            # 失敗を呼び出し元（保存の動作指標）に伝える
+            raise
+
+
+class SqliteLedgerStorage(LedgerStorage):
+    """SQLite（WALモード）の users / transactions テーブル
+
+    取引履歴はテーブルにだけ保持し、起動時にメモリへは読み込まない。
+    """
+    name = 'sqlite'
+    in_memory_transactions = False
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        user_id TEXT PRIMARY KEY,
+        balance INTEGER NOT NULL,
+        total_earned INTEGER NOT NULL,
+        total_spent INTEGER NOT NULL,
+        join_date TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS transactions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        amount INTEGER NOT NULL,
+        type TEXT NOT NULL,
+        timestamp TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_transactions_user ON transactions (user_id, id);
+    CREATE INDEX IF NOT EXISTS idx_transactions_type ON transactions (type, id);
+    CREATE INDEX IF NOT EXISTS idx_transactions_user_type ON transactions (user_id, type, id);
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS type_stats (
+        type TEXT PRIMARY KEY,
+        count INTEGER NOT NULL,
+        earned INTEGER NOT NULL,
+        spent INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS user_stats (
+        type TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        total INTEGER NOT NULL,
+        PRIMARY KEY (type, user_id)
+    ) WITHOUT ROWID;
+    """
+
+    def __init__(self, db_file, initial_balance=0, migrate_from=None, compact_bytes=16 * 1024 * 1024):
+        self.db_file = db_file
+        self.initial_balance = initial_balance
+        self.migrate_from = migrate_from
+        self.compact_bytes = compact_bytes
+        # 読み込みはメインスレッド、書き込みは永続化スレッドから（同時には使わない）
+        self.conn = sqlite3.connect(db_file, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        # commit が返った時点で電源断にも耐えるよう FULL にする
+        self.conn.execute('PRAGMA synchronous=FULL')
+        self.conn.executescript(self.SCHEMA)
+
+    def _get_meta(self, key, default=None):
+        row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def load(self):
+        if self.migrate_from and self._get_meta('migrated_from_json') is None:
+            self._migrate(self.migrate_from)
+
+        users = {}
+        for user_id, balance, total_earned, total_spent, join_date in self.conn.execute(
+                'SELECT user_id, balance, total_earned, total_spent, join_date FROM users'):
+            users[user_id] = UserAccount(balance, total_earned, total_spent, _parse_join_date(join_date))
+        return {
+            'users': users,
+            'transactions': [],
+            'stats': self._load_stats(),
+            'journal_seq': int(self._get_meta('journal_seq', 0))
+        }
+
+    def _load_stats(self):
+        """累計テーブル（write_batch が取引と同じトランザクションで更新する）を読む"""
+        if self._get_meta('stats_built') is None:
+            self._build_stats()
+        stats = new_stats()
+        for transaction_type, count, earned, spent in self.conn.execute('SELECT type, count, earned, spent FROM type_stats'):
+            stats['types'][transaction_type] = {'count': count, 'earned': earned, 'spent': spent}
+        for transaction_type, user_id, total in self.conn.execute('SELECT type, user_id, total FROM user_stats'):
+            per_user = stats['users'].get(transaction_type)
+            if per_user is not None:
+                per_user[user_id] = total
+        return stats
+
+    def _build_stats(self):
+        """累計テーブルが無かった頃のデータベース向けに、取引テーブルを一度だけ集計する"""
+        placeholders = ', '.join('?' * len(USER_TOTAL_TYPES))
+        cur = self.conn.cursor()
+        cur.execute('BEGIN')
+        try:
+            cur.execute('DELETE FROM type_stats')
+            cur.execute('DELETE FROM user_stats')
+            cur.execute(
+                'INSERT INTO type_stats (type, count, earned, spent) '
+                'SELECT type, COUNT(*), SUM(MAX(amount, 0)), SUM(MAX(-amount, 0)) FROM transactions GROUP BY type'
+            )
+            cur.execute(
+                'INSERT INTO user_stats (type, user_id, total) '
+                f'SELECT type, user_id, SUM(amount) FROM transactions WHERE type IN ({placeholders}) GROUP BY type, user_id',
+                USER_TOTAL_TYPES
+            )
+            cur.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('stats_built', '1')")
+            cur.execute('COMMIT')
+        except:
+            cur.execute('ROLLBACK')
+            raise
+
+    @staticmethod
+    def _write_stats(cur, records):
+        """バッチ分の取引を累計テーブルに加える"""
+        stats = new_stats()
+        for record in records:
+            if record['op'] == 'balance':
+                add_to_stats(stats, record['user_id'], record['amount'], record['type'])
+        cur.executemany(
+            'INSERT INTO type_stats (type, count, earned, spent) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (type) DO UPDATE SET count = count + excluded.count, '
+            'earned = earned + excluded.earned, spent = spent + excluded.spent',
+            [(transaction_type, totals['count'], totals['earned'], totals['spent'])
+             for transaction_type, totals in stats['types'].items()]
+        )
+        cur.executemany(
+            'INSERT INTO user_stats (type, user_id, total) VALUES (?, ?, ?) '
+            'ON CONFLICT (type, user_id) DO UPDATE SET total = total + excluded.total',
+            [(transaction_type, user_id, total)
+             for transaction_type, per_user in stats['users'].items() for user_id, total in per_user.items()]
+        )
+
+    def _migrate(self, json_storage):
+        """既存の JSON 台帳を一度だけ取り込む"""
+        has_json = json_storage.snapshot_exists() or os.path.exists(json_storage.journal_file)
+        if has_json:
+            data = json_storage.load()
+            # メモリ上の直近分だけでなく、アーカイブ済みの履歴もすべて取り込む
+            recent = {t.get('seq') for t in data['transactions'] if 'seq' in t}
+            archived = [t for t in json_storage.read_archived_transactions() if t.get('seq') not in recent or 'seq' not in t]
+            data['transactions'] = archived + data['transactions']
+        else:
+            data = {'users': {}, 'transactions': [], 'stats': new_stats(), 'journal_seq': 0}
+
+        cur = self.conn.cursor()
+        cur.execute('BEGIN')
+        try:
+            cur.executemany(
+                'INSERT OR REPLACE INTO users (user_id, balance, total_earned, total_spent, join_date) VALUES (?, ?, ?, ?, ?)',
+                [(user_id, u['balance'], u['total_earned'], u['total_spent'], u['join_date'])
+                 for user_id, u in data['users'].items()]
+            )
+            cur.executemany(
+                'INSERT INTO transactions (user_id, amount, type, timestamp) VALUES (?, ?, ?, ?)',
+                [(t['user_id'], t['amount'], t['type'], t['timestamp']) for t in data['transactions']]
+            )
+            cur.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('journal_seq', ?)", (str(data['journal_seq']),))
+            cur.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from_json', '1')")
+            # 取り込んだ取引の累計は次の _load_stats で集計し直す
+            cur.execute("DELETE FROM meta WHERE key = 'stats_built'")
+            cur.execute('COMMIT')
+        except:
+            cur.execute('ROLLBACK')
+            raise
+
+        if has_json:
+            # 二重取り込みを防ぐため、取り込み済みのファイルは退避しておく
+            for path in (json_storage.data_file, json_storage.snapshot_file, json_storage.journal_file):
+                if path and os.path.exists(path):
+                    os.replace(path, f"{path}.migrated")
+            print(f"JSON台帳を SQLite に移行しました（ユーザー {len(data['users'])}人 / 取引 {len(data['transactions'])}件）")
+
+    def write_batch(self, records):
+        """1つの SQL トランザクションでまとめて書き込む"""
+        cur = self.conn.cursor()
+        cur.execute('BEGIN')
+        try:
+            for record in records:
+                if record['op'] == 'archive':
+                    continue
+                join_date = record.get('join_date', record['timestamp'])
+                cur.execute(
+                    'INSERT OR IGNORE INTO users (user_id, balance, total_earned, total_spent, join_date) VALUES (?, ?, ?, 0, ?)',
+                    (record['user_id'], self.initial_balance, self.initial_balance, join_date)
+                )
+                if record['op'] != 'balance':
+                    continue
+                amount = record['amount']
+                cur.execute(
+                    'UPDATE users SET balance = balance + ?, total_earned = total_earned + ?, total_spent = total_spent + ? WHERE user_id = ?',
+                    (amount, max(amount, 0), max(-amount, 0), record['user_id'])
+                )
+                cur.execute(
+                    'INSERT INTO transactions (user_id, amount, type, timestamp) VALUES (?, ?, ?, ?)',
+                    (record['user_id'], amount, record['type'], record['timestamp'])
+                )
+            self._write_stats(cur, records)
+            seqs = [record['seq'] for record in records if 'seq' in record]
+            if seqs:
+                cur.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('journal_seq', ?)", (str(seqs[-1]),))
+            cur.execute('COMMIT')
+        except:
+            cur.execute('ROLLBACK')
+            raise
+
+    def read_history(self, user_id, transaction_type=None, start_date=None, end_date=None,
+                     before=None, after=None, limit=10):
+        """ユーザーの取引を新しい順に最大 limit 件（TransactionIndex.page と同じ引数。連番は取引の id）
+
+        id をキーにしたキーセットページングなので、OFFSET と違い履歴の量によらず速い。
+        """
+        conditions = ['user_id = ?']
+        params = [str(user_id)]
+        if transaction_type:
+            conditions.append('type = ?')
+            params.append(transaction_type)
+        if start_date:
+            conditions.append('timestamp >= ?')
+            params.append(start_date)
+        if end_date:
+            # 'YYYY-MM-DD' の日の終わりまで（'T' 以降はその日の時刻）
+            conditions.append('timestamp < ?')
+            params.append(f"{end_date}U")
+        where = ' AND '.join(conditions)
+
+        if after is not None:
+            rows = self.conn.execute(
+                f'SELECT id, user_id, amount, type, timestamp FROM transactions WHERE {where} AND id > ? ORDER BY id ASC LIMIT ?',
+                (*params, after, limit + 1)
+            ).fetchall()
+            has_newer = len(rows) > limit
+            rows = rows[:limit][::-1]
+        else:
+            if before is not None:
+                rows = self.conn.execute(
+                    f'SELECT id, user_id, amount, type, timestamp FROM transactions WHERE {where} AND id < ? ORDER BY id DESC LIMIT ?',
+                    (*params, before, limit + 1)
+                ).fetchall()
+            else:
+                rows = self.conn.execute(
+                    f'SELECT id, user_id, amount, type, timestamp FROM transactions WHERE {where} ORDER BY id DESC LIMIT ?',
+                    (*params, limit + 1)
+                ).fetchall()
+            has_newer = None
+            has_older = len(rows) > limit
+            rows = rows[:limit]
+
+        transactions = [
+            {'seq': row_id, 'user_id': row_user_id, 'amount': amount, 'type': row_type, 'timestamp': timestamp}
+            for row_id, row_user_id, amount, row_type, timestamp in rows
+        ]
+        if not transactions:
+            return HistoryPage([], False, False)
+
+        def exists(condition, value):
+            return self.conn.execute(
+                f'SELECT 1 FROM transactions WHERE {where} AND {condition} LIMIT 1', (*params, value)
+            ).fetchone() is not None
+
+        if has_newer is None:
+            has_newer = exists('id > ?', transactions[0]['seq'])
+        else:
+            has_older = exists('id < ?', transactions[-1]['seq'])
+        return HistoryPage(transactions, has_newer, has_older)
+
+    def needs_compaction(self):
+        try:
+            return os.path.getsize(f"{self.db_file}-wal") >= self.compact_bytes
+        except OSError:
+            return False
+
+    def compact(self, snapshot, records):
+        if records:
+            self.write_batch(records)
+        _, _, checkpointed = self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+        page_size = self.conn.execute('PRAGMA page_size').fetchone()[0]
+        # WAL から本体へ書き戻したページ分
+        return max(checkpointed, 0) * page_size
+
+    def close(self):
+        self.conn.close()
+
+
+def apply_record(data, record, initial_balance=0):
+    """ジャーナルの1レコードをデータに適用（再生・移行用）"""
+    user_id = record['user_id']
+    if user_id not in data['users']:
+        data['users'][user_id] = new_user_record(initial_balance, record.get('join_date', record['timestamp']))
+    if record['op'] != 'balance':
+        return
+
+    user_data = data['users'][user_id]
+    amount = record['amount']
+    user_data['balance'] += amount
+    if amount > 0:
+        user_data['total_earned'] += amount
+    else:
+        user_data['total_spent'] += abs(amount)
+    add_to_stats(data['stats'], user_id, amount, record['type'])
+    data['transactions'].append({
+        'user_id': user_id,
+        'amount': amount,
+        'type': record['type'],
+        'timestamp': record['timestamp'],
+        'seq': record['seq']
+    })
+
+
+# バイナリスナップショット
+#
+# JSON スナップショットと同じ内容を、列ごとの配列（array）にして zlib で圧縮したもの。
+# ユーザーIDは整数の表に、取引種別は名前の表に置き換え、日時はエポックからのマイクロ秒で持つ。
+#
+#   MAGIC (8バイト) + zlib( ヘッダー長 (4バイト LE) + ヘッダー (JSON) + 配列 * n )
+#   配列: 型コード (1バイト) + バイト数 (8バイト LE) + リトルエンディアンの中身
+#
+# 元の JSON に戻せない値（数字以外のユーザーID、isoformat() 以外の日時、未知のキーなど）を
+# 含む場合は encode_snapshot が ValueError を出し、呼び出し側は JSON で保存する。
+SNAPSHOT_MAGIC = b'ZLEDGER1'
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+_USER_KEYS = {'balance', 'total_earned', 'total_spent', 'join_date'}
+_TRANSACTION_KEYS = {'user_id', 'amount', 'type', 'timestamp'}
+# 配列の型コードと1要素のバイト数（プラットフォームによらず同じ大きさのものだけを使う）
+_ITEM_SIZES = {'H': 2, 'I': 4, 'q': 8, 'Q': 8}
+
+
+def _timestamp_to_int(value):
+    """isoformat() の日時をエポックからのマイクロ秒にする（元の文字列に戻せなければ ValueError）"""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        raise ValueError(f"タイムゾーン付きの日時は変換できません: {value}")
+    if parsed.isoformat() != value:
+        raise ValueError(f"元の形式に戻せない日時です: {value}")
+    return (parsed - _EPOCH) // _MICROSECOND
+
+
+def _int_to_timestamp(micros):
+    return (_EPOCH + timedelta(microseconds=micros)).isoformat()
+
+
+_HMS = None     # 0〜86399 秒 → 'HH:MM:SS'（初回の読み込みで作る）
+
+
+def _ints_to_timestamps(values):
+    """_int_to_timestamp をまとめて行う（日付部分は日ごとに1度だけ作る）"""
+    global _HMS
+    if _HMS is None:
+        _HMS = [f"{h:02d}:{m:02d}:{s:02d}" for h in range(24) for m in range(60) for s in range(60)]
+    hms = _HMS
+    days = {}
+    result = []
+    append = result.append
+    for micros in values:
+        seconds, fraction = divmod(micros, 1_000_000)
+        day, seconds = divmod(seconds, 86400)
+        prefix = days.get(day)
+        if prefix is None:
+            prefix = days[day] = (_EPOCH + timedelta(days=day)).date().isoformat() + 'T'
+        # isoformat() はマイクロ秒が 0 の時だけ小数部を省く
+        if fraction:
+            append(f"{prefix}{hms[seconds]}.{fraction:06d}")
+        else:
+            append(prefix + hms[seconds])
+    return result
+
+
+def _user_id_to_int(user_id):
+    if not user_id.isdigit() or str(int(user_id)) != user_id or int(user_id) >= 2 ** 64:
+        raise ValueError(f"整数にできないユーザーIDです: {user_id}")
+    return int(user_id)
+
+
+def encode_snapshot(data):
+    """スナップショット（dict）をバイナリ形式にする"""
+    try:
+        return _encode_snapshot(data)
+    except (TypeError, OverflowError) as e:
+        # 整数でない金額や範囲外の値など
+        raise ValueError(f"バイナリにできない値があります: {e}") from e
+
+
+def _encode_snapshot(data):
+    extra = {key: value for key, value in data.items() if key not in ('users', 'transactions', 'stats', 'journal_seq')}
+    users = data['users']
+    transactions = data['transactions']
+    stats = data.get('stats')
+
+    # ユーザーIDの表（ユーザー → 取引・累計にだけ出てくるID の順）
+    user_ids = list(users)
+    user_index = {user_id: i for i, user_id in enumerate(user_ids)}
+
+    def intern_user(user_id):
+        index = user_index.get(user_id)
+        if index is None:
+            index = user_index[user_id] = len(user_ids)
+            user_ids.append(user_id)
+        return index
+
+    balances, earned, spent, join_dates = array('q'), array('q'), array('q'), array('q')
+    for user in users.values():
+        if isinstance(user, UserAccount):
+            if isinstance(user.joined_at, str):
+                raise ValueError(f"元の形式に戻せない日時です: {user.joined_at}")
+            joined_at = user.joined_at
+        elif set(user) != _USER_KEYS:
+            raise ValueError(f"未知の項目を持つユーザーデータです: {sorted(user)}")
+        else:
+            joined_at = _timestamp_to_int(user['join_date'])
+        balances.append(user['balance'])
+        earned.append(user['total_earned'])
+        spent.append(user['total_spent'])
+        join_dates.append(joined_at)
+
+    types = []
+    type_index = {}
+    tx_user, tx_type, tx_amount, tx_time, tx_seq = array('I'), array('H'), array('q'), array('q'), array('q')
+    for transaction in transactions:
+        keys = set(transaction)
+        keys.discard('seq')
+        if keys != _TRANSACTION_KEYS:
+            raise ValueError(f"未知の項目を持つ取引です: {sorted(transaction)}")
+        index = type_index.get(transaction['type'])
+        if index is None:
+            index = type_index[transaction['type']] = len(types)
+            types.append(transaction['type'])
+        tx_user.append(intern_user(transaction['user_id']))
+        tx_type.append(index)
+        tx_amount.append(transaction['amount'])
+        tx_time.append(_timestamp_to_int(transaction['timestamp']))
+        # 連番の無い旧形式の取引は 0 にしておく（連番は 1 から始まる）
+        tx_seq.append(transaction.get('seq', 0))
+
+    columns = [balances, earned, spent, join_dates, tx_user, tx_type, tx_amount, tx_time, tx_seq]
+    header = {
+        'version': 1,
+        'keys': list(data),
+        'journal_seq': data.get('journal_seq', 0),
+        'users': len(users),
+        'transactions': len(transactions),
+        'types': types,
+        'extra': extra,
+        'has_journal_seq': 'journal_seq' in data,
+    }
+    if stats is not None:
+        header['stats_types'] = stats['types']
+        header['stats_users'] = list(stats['users'])
+        for per_user in stats['users'].values():
+            columns.append(array('I', [intern_user(user_id) for user_id in per_user]))
+            columns.append(array('q', per_user.values()))
+    # 取引・累計にしか出てこないIDも含めた、最終的なユーザーIDの表
+    columns.insert(0, array('Q', [_user_id_to_int(user_id) for user_id in user_ids]))
+
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    body = [len(header_bytes).to_bytes(4, 'little'), header_bytes]
+    for column in columns:
+        if sys.byteorder != 'little':
+            column = array(column.typecode, column)
+            column.byteswap()
+        raw = column.tobytes()
+        body.append(column.typecode.encode('ascii'))
+        body.append(len(raw).to_bytes(8, 'little'))
+        body.append(raw)
+    return SNAPSHOT_MAGIC + zlib.compress(b''.join(body), 6)
+
+
+def decode_snapshot(blob, accounts=False):
+    """encode_snapshot の逆変換（accounts=True ならユーザーを UserAccount で返す）"""
+    if not blob.startswith(SNAPSHOT_MAGIC):
+        raise ValueError("バイナリスナップショットではありません")
+    body = memoryview(zlib.decompress(blob[len(SNAPSHOT_MAGIC):]))
+    header_length = int.from_bytes(body[:4], 'little')
+    header = json.loads(bytes(body[4:4 + header_length]).decode('utf-8'))
+    offset = 4 + header_length
+
+    def read_column():
+        nonlocal offset
+        typecode = chr(body[offset])
+        if array(typecode).itemsize != _ITEM_SIZES.get(typecode):
+            raise ValueError(f"この環境では読めない配列の型です: {typecode}")
+        length = int.from_bytes(body[offset + 1:offset + 9], 'little')
+        offset += 9
+        column = array(typecode)
+        column.frombytes(body[offset:offset + length])
+        offset += length
+        if sys.byteorder != 'little':
+            column.byteswap()
+        return column
+
+    user_ids = [str(user_id) for user_id in read_column()]
+    balances, earned, spent, join_dates = read_column(), read_column(), read_column(), read_column()
+    tx_user, tx_type, tx_amount, tx_time, tx_seq = (read_column() for _ in range(5))
+
+    if accounts:
+        users = {
+            user_id: UserAccount(balance, total_earned, total_spent, joined_at)
+            for user_id, balance, total_earned, total_spent, joined_at in zip(user_ids, balances, earned, spent, join_dates)
+        }
+    else:
+        users = {
+            user_id: {'balance': balance, 'total_earned': total_earned, 'total_spent': total_spent, 'join_date': join_date}
+            for user_id, balance, total_earned, total_spent, join_date
+            in zip(user_ids, balances, earned, spent, _ints_to_timestamps(join_dates))
+        }
+
+    types = header['types']
+    transactions = [
+        {'user_id': user_ids[user], 'amount': amount, 'type': types[kind], 'timestamp': timestamp, 'seq': seq}
+        if seq else
+        {'user_id': user_ids[user], 'amount': amount, 'type': types[kind], 'timestamp': timestamp}
+        for user, kind, amount, timestamp, seq in zip(tx_user, tx_type, tx_amount, _ints_to_timestamps(tx_time), tx_seq)
+    ]
+
+    decoded = {'users': users, 'transactions': transactions}
+    if 'stats_types' in header:
+        stats_users = {}
+        for transaction_type in header['stats_users']:
+            indexes, totals = read_column(), read_column()
+            stats_users[transaction_type] = {user_ids[i]: total for i, total in zip(indexes, totals)}
+        decoded['stats'] = {'types': header['stats_types'], 'users': stats_users}
+    if header['has_journal_seq']:
+        decoded['journal_seq'] = header['journal_seq']
+    decoded.update(header['extra'])
+    # 元のキーの順に並べ直す
+    return {key: decoded[key] for key in header['keys']}
+
+
+def read_snapshot_file(path, accounts=False):
+    """スナップショットを読む（先頭の MAGIC でバイナリか JSON かを判別）
+
+    accounts=True ならユーザーを UserAccount にして返す（台帳の読み込み用）。
+    """
+    with open(path, 'rb') as f:
+        blob = f.read()
+    if blob.startswith(SNAPSHOT_MAGIC):
+        return decode_snapshot(blob, accounts)
+    data = json.loads(blob.decode('utf-8'))
+    if accounts:
+        data['users'] = {user_id: UserAccount.from_dict(user) for user_id, user in data['users'].items()}
+    return data
+
+
+def create_storage(backend, data_file, journal_file, sqlite_file, initial_balance=0, compact_bytes=4 * 1024 * 1024,
+                   archive_dir=None, transaction_window=None, snapshot_file=None, snapshot_format='json'):
+    """STORAGE_BACKEND の値から保存先を作る"""
+    json_storage = JsonLedgerStorage(data_file, journal_file, initial_balance, compact_bytes,
+                                     archive_dir=archive_dir, transaction_window=transaction_window,
+                                     snapshot_file=snapshot_file, snapshot_format=snapshot_format)
+    if backend == 'json':
+        return json_storage
+    if backend == 'sqlite':
+        return SqliteLedgerStorage(sqlite_file, initial_balance, migrate_from=json_storage)
+    raise ValueError(f"不明な STORAGE_BACKEND です: {backend}")
+
+
+def main(argv=None):
+    """スナップショットの形式を変換する
+
+        python storage.py to-binary z_currency_data.json z_currency_data.snapshot
+        python storage.py to-json z_currency_data.snapshot z_currency_data.json
+        python storage.py verify z_currency_data.json   # 往復変換で元に戻るか確認
+    """
+    parser = argparse.ArgumentParser(description="台帳スナップショットの形式変換")
+    parser.add_argument('command', choices=['to-binary', 'to-json', 'verify'])
+    parser.add_argument('source')
+    parser.add_argument('destination', nargs='?')
+    args = parser.parse_args(argv)
+
+    data = read_snapshot_file(args.source)
+    if args.command == 'verify':
+        blob = encode_snapshot(data)
+        restored = decode_snapshot(blob)
+        text = json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+        ok = restored == data and json.dumps(restored, ensure_ascii=False, indent=2).encode('utf-8') == text
+        print(f"JSON: {len(text):,} バイト / バイナリ: {len(blob):,} バイト（{len(text) / len(blob):.1f}分の1）")
+        print("往復変換: " + ("OK" if ok else "NG"))
+        return 0 if ok else 1
+
+    if not args.destination:
+        parser.error("変換先のファイルを指定してください")
+    if args.command == 'to-binary':
+        payload = encode_snapshot(data)
+    else:
+        payload = json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+    with open(args.destination, 'wb') as f:
+        f.write(payload)
+    print(f"{args.source} → {args.destination}（{len(payload):,} バイト）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
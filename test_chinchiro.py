@@ -0,0 +1,107 @@
+"""chinchiro の表が、表を作る前の判定（evaluate_chinchin_dice と if 連鎖）と一致するかの確認
+
+python -m pytest -q で実行する。
+"""
+import itertools
+
+import chinchiro
+from chinchiro import HAND_TABLE, HANDS, RESULT_MATRIX, lookup_hand, pack_dice, resolve, unpack_dice
+
+ALL_DICE = [list(dice) for dice in itertools.product(range(1, 7), repeat=3)]
+
+
+def old_evaluate_chinchin_dice(dice):
+    """表にする前の役判定（そのまま写したもの）"""
+    dice_sorted = sorted(dice)
+    if dice_sorted == [1, 1, 1]:
+        return 'ピンゾロ', 5
+    if dice_sorted == [4, 5, 6]:
+        return 'シゴロ', 2
+    if dice_sorted[0] == dice_sorted[1] == dice_sorted[2]:
+        return f'{dice_sorted[0]}ゾロ', 3
+    if dice_sorted == [1, 2, 3]:
+        return 'ヒフミ', -2
+    if dice_sorted[0] == dice_sorted[1]:
+        return f'{dice_sorted[2]}の目', dice_sorted[2]
+    elif dice_sorted[1] == dice_sorted[2]:
+        return f'{dice_sorted[0]}の目', dice_sorted[0]
+    return '役無し', 0
+
+
+def old_judge(player_hand, bot_hand):
+    """表にする前の勝敗判定（表示名の文字列で比べていたもの）。(結果, 倍率, 色, 絵文字) を返す"""
+    win = ("勝利", 1, 0x00ff00, "🎉")
+    lose = ("敗北", -1, 0xff0000, "😢")
+    draw = ("引き分け", 0, 0xffff00, "🤝")
+    player_is_instant_lose = player_hand == 'ヒフミ'
+    bot_is_instant_lose = bot_hand == 'ヒフミ'
+    player_is_shigoro = 'シゴロ' in player_hand
+    bot_is_shigoro = 'シゴロ' in bot_hand
+
+    if player_is_instant_lose and bot_is_instant_lose:
+        return draw
+    elif player_is_instant_lose:
+        return ("敗北", -2, 0xff0000, "😢")
+    elif bot_is_instant_lose:
+        return ("勝利", 2, 0x00ff00, "🎉")
+    elif player_is_shigoro and bot_is_shigoro:
+        return draw
+    elif player_is_shigoro:
+        return ("勝利", 2, 0x00ff00, "🎉")
+    elif bot_is_shigoro:
+        return ("敗北", -2, 0xff0000, "😢")
+    if player_hand == 'ピンゾロ' and bot_hand != 'ピンゾロ':
+        return ("勝利", 5, 0xffd700, "🏆")
+    elif bot_hand == 'ピンゾロ' and player_hand != 'ピンゾロ':
+        return ("敗北", -5, 0xff0000, "😱")
+    elif '目' in player_hand and '目' in bot_hand:
+        player_num = int(player_hand[0])
+        bot_num = int(bot_hand[0])
+        if player_num > bot_num:
+            return win
+        elif player_num < bot_num:
+            return lose
+        return draw
+    elif '目' in player_hand and player_hand != '役無し':
+        return win
+    elif '目' in bot_hand and bot_hand != '役無し':
+        return lose
+    elif 'ゾロ' in player_hand and 'ゾロ' not in bot_hand:
+        return ("勝利", 3, 0x00ff00, "🎉")
+    elif 'ゾロ' in bot_hand and 'ゾロ' not in player_hand:
+        return ("敗北", -3, 0xff0000, "😢")
+    return draw
+
+
+def test_pack_dice_round_trip():
+    for dice in ALL_DICE:
+        assert unpack_dice(pack_dice(*dice)) == dice
+    assert sorted(pack_dice(*dice) for dice in ALL_DICE) == list(range(216))
+
+
+def test_hand_table_matches_old_rules():
+    assert len(HAND_TABLE) == 216
+    for dice in ALL_DICE:
+        hand = lookup_hand(dice)
+        assert (hand.name, hand.power) == old_evaluate_chinchin_dice(dice), dice
+        assert hand is HANDS[hand.id]
+        # 役無しの時だけ振り直す
+        assert hand.final == (hand.name != '役無し')
+
+
+def test_result_matrix_matches_old_rules():
+    assert len(RESULT_MATRIX) == len(HANDS)
+    # 216×216 の出目の組み合わせすべてで比べる
+    for player_dice in ALL_DICE:
+        player_hand = lookup_hand(player_dice)
+        for bot_dice in ALL_DICE:
+            bot_hand = lookup_hand(bot_dice)
+            expected = old_judge(old_evaluate_chinchin_dice(player_dice)[0],
+                                 old_evaluate_chinchin_dice(bot_dice)[0])
+            assert tuple(resolve(player_hand, bot_hand)) == expected, (player_dice, bot_dice)
+
+
+def test_max_loss_multiplier_is_pinzoro_loss():
+    worst = min(old_judge(old_evaluate_chinchin_dice(p)[0], old_evaluate_chinchin_dice(b)[0])[1]
+                for p in ALL_DICE for b in ALL_DICE)
+    assert chinchiro.MAX_LOSS_MULTIPLIER == -worst == 5
@@ -0,0 +1,168 @@
+"""ledger_index のインデックスを、全件をソート・絞り込みする素朴な実装と突き合わせる
+
+python -m pytest -q で実行する。
+"""
+import random
+
+import pytest
+
+import ledger_index
+from ledger_index import HistoryPage, RankIndex, TransactionIndex
+
+
+def sorted_ranking(values):
+    """値の大きい順（同じ値は user_id 順）の [(user_id, 値), ...]"""
+    return sorted(values.items(), key=lambda item: (-item[1], item[0]))
+
+
+def sorted_rank(values, user_id):
+    """自分より値の大きいユーザーの数 + 1"""
+    return sum(1 for value in values.values() if value > values[user_id]) + 1
+
+
+def check_rank_index(index, values):
+    assert len(index) == len(values)
+    assert index.top(len(values) + 1) == sorted_ranking(values)
+    for user_id in values:
+        assert index.get(user_id) == values[user_id]
+        assert index.rank(user_id) == sorted_rank(values, user_id), user_id
+    # バケットの件数と Fenwick 木が食い違っていないか
+    assert all(index._buckets)
+    for i in range(len(index._buckets) + 1):
+        assert index._count_before(i) == sum(len(bucket) for bucket in index._buckets[:i])
+
+
+@pytest.mark.parametrize("bucket_size", [1, 4, 512])
+def test_rank_index_matches_sort(monkeypatch, bucket_size):
+    # バケットを小さくして分割・削除の経路を何度も通す
+    monkeypatch.setattr(ledger_index, '_BUCKET_SIZE', bucket_size)
+    rng = random.Random(bucket_size)
+    values = {str(user_id): rng.randint(-50, 50) for user_id in range(300)}
+    index = RankIndex(values)
+    check_rank_index(index, values)
+
+    for step in range(3000):
+        user_id = str(rng.randrange(600))
+        # 同じ値が多く出るように狭い範囲で動かす（同順位の扱いも確かめる）
+        value = rng.randint(-50, 50)
+        index.set(user_id, value)
+        values[user_id] = value
+        if step % 100 == 0:
+            check_rank_index(index, values)
+    check_rank_index(index, values)
+    assert index.top(10) == sorted_ranking(values)[:10]
+
+
+def test_rank_index_drains_and_refills_buckets(monkeypatch):
+    monkeypatch.setattr(ledger_index, '_BUCKET_SIZE', 2)
+    index = RankIndex()
+    values = {}
+    assert index.rank('1') is None
+    assert index.top(5) == []
+    # 全員を上位へ順に押し上げて、下位側のバケットを空にする
+    for user_id in range(40):
+        values[str(user_id)] = 0
+        index.set(str(user_id), 0)
+    for user_id in range(40):
+        values[str(user_id)] = 100 + user_id
+        index.set(str(user_id), 100 + user_id)
+        check_rank_index(index, values)
+    assert index.top(3) == [('39', 139), ('38', 138), ('37', 137)]
+    assert index.rank('0') == 40
+
+
+def make_transactions(rng, count, users=6, days=5):
+    """連番・日時の昇順に並んだ取引"""
+    transactions = []
+    for seq in range(1, count + 1):
+        day = 1 + (seq - 1) * days // count
+        transactions.append({
+            'seq': seq,
+            'user_id': str(rng.randrange(users)),
+            'type': rng.choice(('transfer_in', 'transfer_out', 'chinchin')),
+            'amount': rng.randint(1, 1000),
+            'timestamp': f"2026-01-{day:02d}T{seq % 24:02d}:00:00",
+        })
+    return transactions
+
+
+def sliced_page(transactions, user_id, transaction_type=None, start_date=None, end_date=None,
+                before=None, after=None, limit=10):
+    """全件を絞り込んでから切り出した1ページ（TransactionIndex.page と同じ HistoryPage）"""
+    matched = [
+        t for t in transactions
+        if t['user_id'] == str(user_id)
+        and (transaction_type is None or t['type'] == transaction_type)
+        and (start_date is None or t['timestamp'][:10] >= start_date)
+        and (end_date is None or t['timestamp'][:10] <= end_date)
+    ]
+    if after is not None:
+        first = sum(1 for t in matched if t['seq'] <= after)
+        last = min(first + limit, len(matched))
+    else:
+        last = sum(1 for t in matched if t['seq'] < before) if before is not None else len(matched)
+        first = max(last - limit, 0)
+    return HistoryPage(matched[first:last][::-1], last < len(matched), first > 0)
+
+
+def random_query(rng, transactions):
+    seqs = [t['seq'] for t in transactions] or [0]
+    query = {'limit': rng.choice((1, 3, 10, 25))}
+    if rng.random() < 0.5:
+        query['transaction_type'] = rng.choice(('transfer_in', 'transfer_out', 'chinchin'))
+    if rng.random() < 0.4:
+        query['start_date'] = f"2026-01-{rng.randint(1, 6):02d}"
+    if rng.random() < 0.4:
+        query['end_date'] = f"2026-01-{rng.randint(1, 6):02d}"
+    position = rng.random()
+    if position < 0.4:
+        query['before'] = rng.randint(min(seqs) - 1, max(seqs) + 1)
+    elif position < 0.8:
+        query['after'] = rng.randint(min(seqs) - 1, max(seqs) + 1)
+    return query
+
+
+def test_transaction_index_page_matches_slice():
+    rng = random.Random(17)
+    transactions = make_transactions(rng, 4000, users=2)
+    index = TransactionIndex(transactions[:2000])
+    live = list(transactions[:2000])
+    # 追加と、古いものからの削除を交互に進めながら問い合わせる（削除済みの領域を詰める経路も通す）
+    for transaction in transactions[2000:]:
+        index.add(transaction)
+        live.append(transaction)
+        if rng.random() < 0.8:
+            index.evict(live.pop(0))
+            index.evict(live.pop(0))
+        for _ in range(3):
+            user_id = str(rng.randrange(3))
+            query = random_query(rng, live)
+            assert index.page(user_id, **query) == sliced_page(live, user_id, **query), (user_id, query)
+    for user_id in map(str, range(3)):
+        assert index.count(user_id) == sum(1 for t in live if t['user_id'] == user_id)
+
+
+def test_transaction_index_walks_every_page():
+    rng = random.Random(3)
+    transactions = make_transactions(rng, 500)
+    index = TransactionIndex(transactions)
+    expected = [t for t in transactions if t['user_id'] == '0' and t['timestamp'][:10] >= '2026-01-02'][::-1]
+    # 古い方へ順に辿ると、絞り込んだ全件を新しい順に1回ずつ返す
+    seen = []
+    page = index.page('0', start_date='2026-01-02', limit=7)
+    assert not page.has_newer
+    while True:
+        seen.extend(page.transactions)
+        if not page.has_older:
+            break
+        page = index.page('0', start_date='2026-01-02', before=page.transactions[-1]['seq'], limit=7)
+    assert seen == expected
+    # 新しい方へ戻ると同じ取引を逆順に辿る
+    back = []
+    page = index.page('0', start_date='2026-01-02', after=0, limit=7)
+    while True:
+        back.extend(page.transactions[::-1])
+        if not page.has_newer:
+            break
+        page = index.page('0', start_date='2026-01-02', after=page.transactions[0]['seq'], limit=7)
+    assert back == expected[::-1]
@@ -0,0 +1,172 @@
+"""storage の保存形式と読み出しを、素朴な実装（全件の読み込み・JSON）と突き合わせる
+
+python -m pytest -q で実行する。ファイルはすべて pytest の一時ディレクトリに作る。
+"""
+import gzip
+import json
+import os
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import storage
+from storage import (
+    JsonLedgerStorage, UserAccount, add_to_stats, decode_snapshot, encode_snapshot, new_stats, read_snapshot_file
+)
+from test_ledger_index import make_transactions, random_query
+
+
+def make_storage(tmp_path):
+    return JsonLedgerStorage(str(tmp_path / 'data.json'), str(tmp_path / 'journal.jsonl'),
+                             archive_dir=str(tmp_path / 'archive'))
+
+
+def filtered_archive(transactions, user_id, transaction_type=None, start_date=None, end_date=None,
+                     before=None, after=None, limit=10):
+    """全件を絞り込んで並べた1ページ（before か両方無しなら新しい順、after なら古い順）"""
+    matched = [
+        t for t in transactions
+        if t['user_id'] == str(user_id)
+        and (transaction_type is None or t['type'] == transaction_type)
+        and (start_date is None or t['timestamp'][:10] >= start_date)
+        and (end_date is None or t['timestamp'][:10] <= end_date)
+    ]
+    if after is not None:
+        return [t for t in matched if t['seq'] > after][:limit]
+    return [t for t in matched if before is None or t['seq'] < before][::-1][:limit]
+
+
+def check_archived_pages(ledger, transactions, seed):
+    rng = random.Random(seed)
+    for _ in range(500):
+        user_id = str(rng.randrange(7))
+        query = random_query(rng, transactions)
+        assert ledger.read_archived_page(user_id, **query) == filtered_archive(transactions, user_id, **query), \
+            (user_id, query)
+
+
+def test_read_archived_page_matches_full_scan(tmp_path):
+    rng = random.Random(5)
+    transactions = make_transactions(rng, 2000)
+    ledger = make_storage(tmp_path)
+    # 大きさの違う退避を重ねる（1メンバー ARCHIVE_MEMBER_ENTRIES 件を跨ぐもの・日付を跨ぐものを含む）
+    start = 0
+    while start < len(transactions):
+        size = rng.choice((1, 7, 64, 65, 200))
+        ledger.write_batch([{'op': 'archive', 'transaction': t} for t in transactions[start:start + size]])
+        start += size
+    # 退避の直後に落ちて同じ取引がもう一度書かれても、二重には返さない
+    ledger.write_batch([{'op': 'archive', 'transaction': t} for t in transactions[100:150]])
+    check_archived_pages(ledger, transactions, 1)
+    assert list(ledger.read_archived_transactions()) == transactions
+
+    # 索引を失っても、次の読み込みでファイルから作り直す
+    os.remove(tmp_path / 'archive' / 'index.sqlite')
+    ledger = make_storage(tmp_path)
+    ledger.load()
+    check_archived_pages(ledger, transactions, 2)
+
+
+def test_read_archived_page_splits_legacy_members(tmp_path):
+    rng = random.Random(9)
+    transactions = make_transactions(rng, 600, days=2)
+    os.makedirs(tmp_path / 'archive')
+    # 索引を持たない版は1回の退避を1つの大きな gzip メンバーに書いていた
+    for date in ('2026-01-01', '2026-01-02'):
+        entries = [t for t in transactions if t['timestamp'].startswith(date)]
+        with gzip.open(tmp_path / 'archive' / f'transactions-{date}.jsonl.gz', 'wt', encoding='utf-8') as f:
+            f.writelines(json.dumps(t, ensure_ascii=False) + '\n' for t in entries)
+    ledger = make_storage(tmp_path)
+    ledger.load()
+    check_archived_pages(ledger, transactions, 3)
+    for date in ('2026-01-01', '2026-01-02'):
+        members = list(storage._gzip_members(str(tmp_path / 'archive' / f'transactions-{date}.jsonl.gz')))
+        assert len(members) > 1
+        assert all(len(lines) <= storage.ARCHIVE_MEMBER_ENTRIES for _, lines in members)
+
+
+def make_snapshot(rng, users=300, transactions=2000):
+    """保存時と同じ形のスナップショット（旧形式の連番の無い取引・マイクロ秒が 0 の日時・未知のキーも含む）"""
+    start = datetime(2025, 12, 31, 23, 59, 59)
+    user_ids = [str(rng.randrange(10 ** 17, 10 ** 19)) for _ in range(users)]
+    data = {
+        'users': {
+            user_id: {
+                'balance': rng.randint(0, 10 ** 12),
+                'total_earned': rng.randint(0, 10 ** 12),
+                'total_spent': rng.randint(0, 10 ** 12),
+                'join_date': (start + timedelta(seconds=rng.randrange(10 ** 7),
+                                                microseconds=rng.choice((0, rng.randrange(10 ** 6))))).isoformat(),
+            }
+            for user_id in user_ids
+        },
+        'transactions': [],
+        'stats': new_stats(),
+        'journal_seq': transactions + 12,
+        'settings': {'メモ': '未知のキーはそのまま残す', 'list': [1, 2]},
+    }
+    for seq in range(1, transactions + 1):
+        # 取引にしか出てこない（退会した）ユーザーも混ぜる
+        user_id = rng.choice(user_ids) if rng.random() < 0.95 else str(rng.randrange(10 ** 6))
+        transaction = {
+            'user_id': user_id,
+            'amount': rng.randint(-10 ** 9, 10 ** 9),
+            'type': rng.choice(('chinchin', 'transfer_in', 'transfer_out', 'admin_issue', 'role_issue')),
+            'timestamp': (start + timedelta(microseconds=seq * 777_777)).isoformat(),
+        }
+        if seq > 100:
+            transaction['seq'] = seq
+        data['transactions'].append(transaction)
+        add_to_stats(data['stats'], user_id, transaction['amount'], transaction['type'])
+    return data
+
+
+def json_round_trip(data):
+    return json.loads(json.dumps(data, ensure_ascii=False))
+
+
+def test_binary_snapshot_matches_json_round_trip():
+    data = make_snapshot(random.Random(19))
+    decoded = decode_snapshot(encode_snapshot(data))
+    assert decoded == json_round_trip(data)
+    assert list(decoded) == list(data)
+    # 台帳の読み込み用（UserAccount）でも同じ中身になる
+    accounts = decode_snapshot(encode_snapshot(data), accounts=True)
+    assert accounts['users'] == {user_id: UserAccount.from_dict(user) for user_id, user in data['users'].items()}
+    assert encode_snapshot(accounts) == encode_snapshot(data)
+
+
+def test_binary_snapshot_without_optional_keys():
+    data = {'users': {}, 'transactions': []}
+    assert decode_snapshot(encode_snapshot(data)) == data
+    data = make_snapshot(random.Random(1), users=3, transactions=5)
+    del data['stats'], data['journal_seq']
+    assert decode_snapshot(encode_snapshot(data)) == json_round_trip(data)
+
+
+@pytest.mark.parametrize("change", [
+    lambda data: data['transactions'][0].update(amount=1.5),
+    lambda data: data['transactions'][0].update(timestamp='2026-01-01T00:00:00+09:00'),
+    lambda data: data['transactions'][0].update(memo='x'),
+    lambda data: data['users'].update({'abc': dict(next(iter(data['users'].values())))}),
+    lambda data: next(iter(data['users'].values())).update(join_date='2026-01-01 00:00:00'),
+])
+def test_binary_snapshot_rejects_values_it_cannot_restore(change):
+    data = make_snapshot(random.Random(2), users=5, transactions=5)
+    change(data)
+    with pytest.raises(ValueError):
+        encode_snapshot(data)
+
+
+def test_snapshot_files_read_the_same_in_both_formats(tmp_path):
+    data = make_snapshot(random.Random(4), users=50, transactions=200)
+    binary = JsonLedgerStorage(str(tmp_path / 'a.json'), str(tmp_path / 'a.jsonl'),
+                               snapshot_file=str(tmp_path / 'a.snapshot'), snapshot_format='binary')
+    text = JsonLedgerStorage(str(tmp_path / 'b.json'), str(tmp_path / 'b.jsonl'))
+    binary.compact(data, [])
+    text.compact(data, [])
+    with open(tmp_path / 'a.snapshot', 'rb') as f:
+        assert f.read().startswith(storage.SNAPSHOT_MAGIC)
+    assert read_snapshot_file(str(tmp_path / 'a.snapshot')) == read_snapshot_file(str(tmp_path / 'b.json'))
+    assert binary.load() == text.load()
@@ -0,0 +1,98 @@
+"""Zerobot の部品のうち Discord に接続せずに確かめられるもの
+
+python -m pytest -q で実行する。REST は fake_discord.RestSimulator で模擬する。
+"""
+import asyncio
+import time
+
+import discord
+import pytest
+
+from fake_discord import FakeInteraction, FakeUser, RestSimulator
+
+
+@pytest.fixture
+def Z(tmp_path, monkeypatch):
+    """Zerobot を読み込む（台帳などのファイルは一時ディレクトリに作らせる）"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('METRICS_PORT', '0')
+    import Zerobot
+    return Zerobot
+
+
+async def responded(rest):
+    interaction = FakeInteraction(FakeUser(1), rest)
+    await interaction.response.send_message(embed=discord.Embed(title='start'))
+    return interaction
+
+
+def titles(interaction):
+    return [edit['embed'].title for edit in interaction.edits]
+
+
+def test_edit_scheduler_coalesces_pending_edits(Z):
+    async def run():
+        scheduler = Z.EditScheduler()
+        interaction = await responded(RestSimulator(latency=0.01, route_limit=None, global_limit=None))
+        futures = [scheduler.submit(interaction, discord.Embed(title='0'))]
+        # 0 の送信が始まるまで待つ（送信前に来た編集はすべて1件にまとめられる）
+        await asyncio.sleep(0.005)
+        futures += [scheduler.submit(interaction, discord.Embed(title=str(i))) for i in range(1, 5)]
+        await asyncio.gather(*futures)
+        return scheduler, interaction
+
+    scheduler, interaction = asyncio.run(run())
+    # 0 の送信中に来た 1〜4 は最新の 4 だけにまとめられる
+    assert titles(interaction) == ['0', '4']
+    assert scheduler.stats()['submitted'] == 5
+    assert scheduler.stats()['coalesced'] == 3
+    assert scheduler.stats()['sent'] == 2
+    assert scheduler.queue_depth() == 0
+
+
+def test_edit_scheduler_paces_each_route(Z, monkeypatch):
+    monkeypatch.setattr(Z, 'EDIT_RATE_PER_ROUTE', 20.0)
+    monkeypatch.setattr(Z, 'EDIT_BURST_PER_ROUTE', 2)
+
+    async def run():
+        scheduler = Z.EditScheduler()
+        rest = RestSimulator(route_limit=None, global_limit=None)
+        slow = await responded(rest)
+        others = [await responded(rest) for _ in range(10)]
+        started = time.monotonic()
+        # 同じメッセージへの編集は 1 つずつ待つのでまとめられず、ルートのレートで送られる
+        for i in range(8):
+            await scheduler.edit(slow, discord.Embed(title=str(i)))
+        slow_elapsed = time.monotonic() - started
+        # 別のメッセージ（別ルート）は互いに待たされない
+        started = time.monotonic()
+        await asyncio.gather(*(scheduler.edit(other, discord.Embed(title='x')) for other in others))
+        others_elapsed = time.monotonic() - started
+        return scheduler, slow, others, slow_elapsed, others_elapsed
+
+    scheduler, slow, others, slow_elapsed, others_elapsed = asyncio.run(run())
+    assert titles(slow) == [str(i) for i in range(8)]
+    assert all(titles(other) == ['x'] for other in others)
+    # バースト 2 件の後は 1/20 秒ごとに 1 件
+    assert slow_elapsed >= (8 - 2) / 20 * 0.9
+    assert others_elapsed < slow_elapsed / 2
+
+
+def test_edit_scheduler_retries_after_rate_limit(Z, monkeypatch):
+    # Bot 側の制限を Discord より緩くして、429 を受けた時の再送を通す
+    monkeypatch.setattr(Z, 'EDIT_RATE_PER_ROUTE', 100.0)
+    monkeypatch.setattr(Z, 'EDIT_BURST_PER_ROUTE', 10)
+
+    async def run():
+        scheduler = Z.EditScheduler()
+        rest = RestSimulator(route_limit=(2, 0.2), global_limit=None)
+        interaction = await responded(rest)
+        for i in range(5):
+            await scheduler.edit(interaction, discord.Embed(title=str(i)))
+        return scheduler, interaction, rest
+
+    scheduler, interaction, rest = asyncio.run(run())
+    assert titles(interaction) == [str(i) for i in range(5)]
+    assert rest.rate_limited.get('edit_original_response', 0) > 0
+    assert scheduler.stats()['rate_limited'] == rest.rate_limited['edit_original_response']
+    assert scheduler.stats()['failed'] == 0